@@ -0,0 +1,130 @@
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime, case, exists, func, insert, literal, select
+from sqlalchemy.orm import Session
+
+from . import models, outbox, summaries
+from .db import SessionLocal, unit_of_work
+
+_COLUMNS = [
+    "customer_id",
+    "job_id",
+    "status",
+    "subtotal",
+    "tax",
+    "total",
+    "issued_at",
+    "due_date",
+    "service_address",
+]
+
+
+def run(
+    db: Session,
+    dry_run: bool = False,
+    completed_before: datetime | None = None,
+    due_in_days: int | None = None,
+    now: datetime | None = None,
+) -> dict:
+    """Invoice every completed job that has no invoice yet.
+
+    Tax is the job total times Settings.default_tax_rate. Candidates and
+    their amounts come from one SELECT anti-joining jobs against invoices,
+    and the invoices are written by a single INSERT ... SELECT over it, so
+    the "no invoice yet" check runs inside the write: a concurrent run that
+    commits first leaves nothing for this one to insert. The caller commits.
+    A dry run returns the same summary without writing anything.
+    """
+    now = now or datetime.utcnow()
+    settings = db.query(models.Settings).first()
+    tax_rate = settings.default_tax_rate if settings else 0.0
+    due_date = now + timedelta(days=due_in_days) if due_in_days is not None else None
+
+    subtotal = func.coalesce(models.Job.total, 0.0)
+    tax = func.round(subtotal * tax_rate, 2)
+    filters = [
+        models.Job.status == "completed",
+        ~exists().where(models.Invoice.job_id == models.Job.id),
+    ]
+    if completed_before is not None:
+        filters.append(models.Job.completed_at < completed_before)
+    candidates = (
+        select(
+            models.Job.customer_id,
+            models.Job.id,
+            literal("unpaid"),
+            subtotal,
+            tax,
+            case((subtotal + tax > 0, subtotal + tax), else_=0.0),
+            literal(now, DateTime),
+            literal(due_date, DateTime),
+            models.Job.service_address,
+        )
+        .where(*filters)
+        .order_by(models.Job.id)
+    )
+
+    if dry_run:
+        rows = [dict(zip(_COLUMNS, row), id=None) for row in db.execute(candidates)]
+    else:
+        created = db.execute(
+            insert(models.Invoice)
+            .from_select(_COLUMNS, candidates)
+            .returning(
+                models.Invoice.id,
+                models.Invoice.job_id,
+                models.Invoice.customer_id,
+                models.Invoice.subtotal,
+                models.Invoice.tax,
+                models.Invoice.total,
+                models.Invoice.due_date,
+            )
+        ).all()
+        rows = sorted((row._asdict() for row in created), key=lambda row: row["job_id"])
+        if created:
+            # INSERT ... SELECT carries no row parameters for the summaries to pick up.
+            summaries.mark(db, customers={row.customer_id for row in created})
+            outbox.invoice_issued(db, created)
+
+    return {
+        "dry_run": dry_run,
+        "tax_rate": tax_rate,
+        "jobs": len(rows),
+        "invoices_created": sum(1 for row in rows if row["id"] is not None),
+        "subtotal": round(sum(row["subtotal"] for row in rows), 2),
+        "tax": round(sum(row["tax"] for row in rows), 2),
+        "total": round(sum(row["total"] for row in rows), 2),
+        "invoices": [
+            {
+                "invoice_id": row["id"],
+                "job_id": row["job_id"],
+                "customer_id": row["customer_id"],
+                "subtotal": row["subtotal"],
+                "tax": row["tax"],
+                "total": row["total"],
+            }
+            for row in rows
+        ],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Invoice all completed, uninvoiced jobs.")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--completed-before", type=datetime.fromisoformat)
+    parser.add_argument("--due-in-days", type=int)
+    args = parser.parse_args()
+    session = SessionLocal()
+    try:
+        with unit_of_work(session):
+            summary = run(
+                session,
+                dry_run=args.dry_run,
+                completed_before=args.completed_before,
+                due_in_days=args.due_in_days,
+            )
+        summary.pop("invoices")
+        print(summary)
+    finally:
+        session.close()
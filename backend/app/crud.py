@@ -1,8 +1,16 @@
-from datetime import datetime
-from sqlalchemy import func, or_
-from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, or_, update
+from sqlalchemy.orm import Session, contains_eager, selectinload
 
-from . import models
+from . import events, models, outbox, schemas, summaries, sync
+
+# sort key -> summary column; the customer list sorts highest first, customers without a summary last
+CUSTOMER_SORTS = {
+    "lifetime_revenue": models.CustomerSummary.lifetime_revenue,
+    "open_balance": models.CustomerSummary.open_balance,
+    "job_count": models.CustomerSummary.job_count,
+    "last_job_at": models.CustomerSummary.last_job_at,
+}
 
 
 def get_user_by_email(db: Session, email: str):
@@ -12,8 +20,7 @@ def get_user_by_email(db: Session, email: str):
 def create_user(db: Session, name: str, email: str, role: str, password_hash: str):
     user = models.User(name=name, email=email, role=role, password_hash=password_hash)
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    db.flush()
     return user
 
 
@@ -21,8 +28,7 @@ def update_user(db: Session, user: models.User, **updates):
     for key, value in updates.items():
         if value is not None and hasattr(user, key):
             setattr(user, key, value)
-    db.commit()
-    db.refresh(user)
+    db.flush()
     return user
 
 
@@ -33,8 +39,7 @@ def list_users(db: Session):
 def create_customer(db: Session, **payload):
     customer = models.Customer(**payload)
     db.add(customer)
-    db.commit()
-    db.refresh(customer)
+    db.flush()
     return customer
 
 
@@ -42,13 +47,16 @@ def update_customer(db: Session, customer: models.Customer, **updates):
     for key, value in updates.items():
         if value is not None and hasattr(customer, key):
             setattr(customer, key, value)
-    db.commit()
-    db.refresh(customer)
+    db.flush()
     return customer
 
 
-def list_customers(db: Session, q: str | None = None, tag: str | None = None):
-    query = db.query(models.Customer)
+def list_customers(db: Session, q: str | None = None, tag: str | None = None, sort: str | None = None):
+    query = (
+        db.query(models.Customer)
+        .outerjoin(models.Customer.summary)
+        .options(contains_eager(models.Customer.summary))
+    )
     if q:
         like = f"%{q.lower()}%"
         query = query.filter(
@@ -60,14 +68,16 @@ def list_customers(db: Session, q: str | None = None, tag: str | None = None):
         )
     if tag:
         query = query.filter(models.Customer.tags.contains([tag]))
+    if sort:
+        column = CUSTOMER_SORTS[sort]
+        query = query.order_by(column.is_(None), column.desc())
     return query.order_by(models.Customer.id.desc()).all()
 
 
 def create_lead(db: Session, **payload):
     lead = models.Lead(**payload)
     db.add(lead)
-    db.commit()
-    db.refresh(lead)
+    db.flush()
     return lead
 
 
@@ -75,8 +85,7 @@ def update_lead(db: Session, lead: models.Lead, **updates):
     for key, value in updates.items():
         if value is not None and hasattr(lead, key):
             setattr(lead, key, value)
-    db.commit()
-    db.refresh(lead)
+    db.flush()
     return lead
 
 
@@ -142,8 +151,7 @@ def create_estimate(db: Session, payload, line_items):
         line_items=items,
     )
     db.add(estimate)
-    db.commit()
-    db.refresh(estimate)
+    db.flush()
     return estimate
 
 
@@ -155,8 +163,7 @@ def update_estimate(db: Session, estimate: models.Estimate, payload, line_items)
         estimate.line_items = _build_line_items(line_items)
         _, total = _calculate_total_from_items(estimate.line_items, estimate.tax, estimate.discount)
         estimate.total = total
-    db.commit()
-    db.refresh(estimate)
+    db.flush()
     return estimate
 
 
@@ -202,22 +209,204 @@ def create_job(db: Session, payload, tasks, equipment_ids):
             models.JobEquipment(equipment_id=e_id) for e_id in equipment_ids
         ]
     db.add(job)
-    db.commit()
-    db.refresh(job)
+    db.flush()
+    if job.status == "scheduled":
+        outbox.jobs_scheduled(db, [job])
+    events.publish_job(
+        job,
+        "created",
+        {"status": job.status, "scheduled_end": job.scheduled_end, "customer_id": job.customer_id},
+        db=db,
+    )
     return job
 
 
 def update_job(db: Session, job: models.Job, **updates):
+    previous = {"crew_id": job.crew_id, "scheduled_start": job.scheduled_start}
+    was_scheduled = job.status == "scheduled"
+    changes = {}
     for key, value in updates.items():
         if value is not None and hasattr(job, key):
             setattr(job, key, value)
+            changes[key] = value
     if job.status == "completed" and job.completed_at is None:
         job.completed_at = datetime.utcnow()
-    db.commit()
-    db.refresh(job)
+        changes["completed_at"] = job.completed_at
+    db.flush()
+    # The customer hears about a new time or a job newly scheduled, not a resent one.
+    if job.status == "scheduled" and (not was_scheduled or job.scheduled_start != previous["scheduled_start"]):
+        outbox.jobs_scheduled(db, [job])
+    events.publish_job(job, "updated", changes, previous, db=db)
     return job
 
 
+# Jobs without a scheduled_end occupy their crew for this long when checking conflicts.
+DEFAULT_JOB_DURATION = timedelta(hours=1)
+# Jobs in these statuses no longer occupy their crew.
+INACTIVE_JOB_STATUSES = ("canceled", "completed")
+
+
+def find_crew_conflicts(db: Session, planned: dict[int, tuple], exclude_statuses=INACTIVE_JOB_STATUSES):
+    """Return crew double-bookings among `planned` jobs and the rest of the schedule.
+
+    `planned` maps job id -> (crew_id, scheduled_start, scheduled_end) as it
+    will be after a change. Other jobs of the same crews in the affected window
+    are loaded with one query; overlaps are then found with a sweep per crew.
+    """
+    intervals = {}
+    for job_id, (crew_id, start, end) in planned.items():
+        if crew_id and start:
+            intervals[job_id] = (crew_id, start, end if end and end > start else start + DEFAULT_JOB_DURATION)
+    if not intervals:
+        return []
+    window_start = min(start for _, start, _ in intervals.values())
+    window_end = max(end for _, _, end in intervals.values())
+    others = (
+        db.query(models.Job.id, models.Job.crew_id, models.Job.scheduled_start, models.Job.scheduled_end)
+        .filter(
+            models.Job.crew_id.in_({crew_id for crew_id, _, _ in intervals.values()}),
+            models.Job.id.notin_(list(planned)),
+            models.Job.status.notin_(exclude_statuses),
+            models.Job.scheduled_start.isnot(None),
+            models.Job.scheduled_start < window_end,
+            # Still running at the window start, however long ago it began;
+            # jobs without a usable end occupy DEFAULT_JOB_DURATION.
+            or_(
+                models.Job.scheduled_end > window_start,
+                models.Job.scheduled_start > window_start - DEFAULT_JOB_DURATION,
+            ),
+        )
+        .all()
+    )
+    by_crew: dict[int, list] = {}
+    for job_id, (crew_id, start, end) in intervals.items():
+        by_crew.setdefault(crew_id, []).append((start, end, job_id))
+    for job_id, crew_id, start, end in others:
+        by_crew.setdefault(crew_id, []).append(
+            (start, end if end and end > start else start + DEFAULT_JOB_DURATION, job_id)
+        )
+
+    conflicts = []
+    for crew_id, entries in by_crew.items():
+        entries.sort()
+        active = []
+        for start, end, job_id in entries:
+            active = [(a_end, a_id) for a_end, a_id in active if a_end > start]
+            for _, other_id in active:
+                if job_id in intervals or other_id in intervals:
+                    conflicts.append({"crew_id": crew_id, "job_id": other_id, "conflicting_job_id": job_id})
+            active.append((end, job_id))
+    return conflicts
+
+
+def bulk_update_jobs(
+    db: Session,
+    job_ids: list[int],
+    shift_days: int = 0,
+    crew_id: int | None = None,
+    status: str | None = None,
+    allow_conflicts: bool = False,
+):
+    """Shift, reassign and/or restatus many jobs in one transaction.
+
+    Returns (jobs, conflicts, applied). When conflicts are found and not
+    allowed, nothing is written.
+    """
+    current = (
+        db.query(
+            models.Job.id,
+            models.Job.crew_id,
+            models.Job.status,
+            models.Job.scheduled_start,
+            models.Job.scheduled_end,
+        )
+        .filter(models.Job.id.in_(job_ids))
+        .all()
+    )
+    shift = timedelta(days=shift_days)
+    planned = {
+        job.id: (
+            crew_id if crew_id is not None else job.crew_id,
+            job.scheduled_start + shift if job.scheduled_start else None,
+            job.scheduled_end + shift if job.scheduled_end else None,
+        )
+        for job in current
+    }
+    # Moved jobs and jobs a status change reactivates are checked; jobs that end
+    # up canceled or completed free their slot; untouched ones stay as they are.
+    checked = {}
+    for job in current:
+        if (status or job.status) in INACTIVE_JOB_STATUSES:
+            checked[job.id] = (None, None, None)
+        elif shift_days or crew_id is not None or job.status in INACTIVE_JOB_STATUSES:
+            checked[job.id] = planned[job.id]
+    conflicts = find_crew_conflicts(db, checked)
+    if conflicts and not allow_conflicts:
+        return [], conflicts, False
+
+    now = datetime.utcnow()
+    values = {"updated_at": now}
+    if crew_id is not None:
+        values["crew_id"] = crew_id
+    if status is not None:
+        values["status"] = status
+    if shift_days:
+        # Per-row new dates: one executemany UPDATE keyed by primary key.
+        db.execute(
+            update(models.Job),
+            [
+                {"id": job_id, "scheduled_start": start, "scheduled_end": end, **values}
+                for job_id, (_, start, end) in planned.items()
+            ],
+        )
+    else:
+        db.execute(
+            update(models.Job).where(models.Job.id.in_(job_ids)).values(**values),
+            execution_options={"synchronize_session": False},
+        )
+    # The WHERE-clause UPDATEs carry no row ids for the summaries to pick up.
+    summaries.mark(db, jobs=job_ids)
+    if status == "completed":
+        db.execute(
+            update(models.Job)
+            .where(models.Job.id.in_(job_ids), models.Job.completed_at.is_(None))
+            .values(completed_at=now),
+            execution_options={"synchronize_session": False},
+        )
+
+    # The UPDATEs bypassed the identity map, so reload rows already in the session.
+    jobs = (
+        db.query(models.Job)
+        .populate_existing()
+        .options(selectinload(models.Job.tasks), selectinload(models.Job.equipment_links))
+        .filter(models.Job.id.in_(job_ids))
+        .order_by(models.Job.id)
+        .all()
+    )
+    changes = {key: value for key, value in values.items() if key != "updated_at"}
+    if shift_days:
+        changes["shift_days"] = shift_days
+    was_scheduled = {job.id for job in current if job.status == "scheduled"}
+    outbox.jobs_scheduled(
+        db, [job for job in jobs if job.status == "scheduled" and (shift_days or job.id not in was_scheduled)]
+    )
+    events.publish_jobs_bulk(
+        "updated",
+        [{"id": job.id, "crew_id": job.crew_id, "scheduled_start": job.scheduled_start} for job in jobs],
+        changes,
+        db=db,
+    )
+    moved = [
+        {"id": job.id, "crew_id": job.crew_id, "scheduled_start": job.scheduled_start}
+        for job in current
+        if crew_id is not None and job.crew_id != crew_id
+    ]
+    if moved:
+        sync.record_reassignments(db, [(job["id"], job["crew_id"]) for job in moved])
+        events.publish_jobs_bulk("reassigned", moved, changes, db=db)
+    return jobs, conflicts, True
+
+
 def list_jobs(
     db: Session,
     q: str | None = None,
@@ -252,6 +441,52 @@ def list_jobs(
     return query.order_by(models.Job.id.desc()).all()
 
 
+def create_recurring_template(db: Session, payload):
+    template = models.RecurringJobTemplate(**payload.model_dump())
+    db.add(template)
+    db.flush()
+    return template
+
+
+def update_recurring_template(db: Session, template: models.RecurringJobTemplate, **updates):
+    """Apply `updates`; a new rule or start drops the old schedule's upcoming jobs.
+
+    Occurrences still scheduled after now are deleted and the template is
+    marked materialized only through now, so the next materialize run lays
+    out the rest of the horizon on the new schedule. Started, finished and
+    past jobs stay as they are.
+    """
+    schedule = (template.rrule, template.dtstart)
+    for key, value in updates.items():
+        if value is not None and hasattr(template, key):
+            setattr(template, key, value)
+    if template.materialized_through is not None and (template.rrule, template.dtstart) != schedule:
+        now = datetime.utcnow()
+        upcoming = (
+            db.query(models.Job)
+            .filter(
+                models.Job.recurring_template_id == template.id,
+                models.Job.status == "scheduled",
+                models.Job.scheduled_start > now,
+            )
+            .all()
+        )
+        for job in upcoming:
+            db.delete(job)
+        template.materialized_through = min(template.materialized_through, now)
+    db.flush()
+    return template
+
+
+def list_recurring_templates(db: Session, customer_id: int | None = None, active: bool | None = None):
+    query = db.query(models.RecurringJobTemplate)
+    if customer_id:
+        query = query.filter(models.RecurringJobTemplate.customer_id == customer_id)
+    if active is not None:
+        query = query.filter(models.RecurringJobTemplate.active.is_(active))
+    return query.order_by(models.RecurringJobTemplate.id.desc()).all()
+
+
 def create_invoice(db: Session, payload):
     invoice = models.Invoice(
         customer_id=payload.customer_id,
@@ -266,8 +501,8 @@ def create_invoice(db: Session, payload):
         notes=payload.notes,
     )
     db.add(invoice)
-    db.commit()
-    db.refresh(invoice)
+    db.flush()
+    outbox.invoice_issued(db, [invoice])
     return invoice
 
 
@@ -275,8 +510,7 @@ def update_invoice(db: Session, invoice: models.Invoice, **updates):
     for key, value in updates.items():
         if value is not None and hasattr(invoice, key):
             setattr(invoice, key, value)
-    db.commit()
-    db.refresh(invoice)
+    db.flush()
     return invoice
 
 
@@ -323,22 +557,110 @@ def record_payment(db: Session, invoice: models.Invoice, payload):
         .filter(models.Payment.invoice_id == invoice.id)
         .scalar()
     )
-    if total_paid >= invoice.total:
-        invoice.status = "paid"
-    elif total_paid > 0:
-        invoice.status = "partial"
-    db.commit()
-    db.refresh(invoice)
+    invoice.status = _invoice_status(invoice.status, invoice.total, total_paid)
+    outbox.payments_recorded(db, [payment])
+    db.flush()
     return payment, invoice
 
 
+def _invoice_status(current: str, total: float, total_paid: float) -> str:
+    if total_paid >= total:
+        return "paid"
+    if total_paid > 0:
+        return "partial"
+    return current
+
+
+def record_payments_batch(
+    db: Session,
+    lines: list[tuple[int, schemas.PaymentCreate]],
+    rejected: list[dict] | None = None,
+):
+    """Post many payments at once.
+
+    `lines` are (line number, payment) pairs; `rejected` holds results for lines
+    that already failed parsing. Valid lines are inserted with one executemany
+    INSERT and every touched invoice's status is recomputed from one grouped
+    SUM, all inside the caller's transaction.
+    """
+    results = list(rejected or [])
+    parsed = []
+    for line, payment in lines:
+        if payment.amount <= 0:
+            results.append(
+                {"line": line, "status": "rejected", "invoice_id": payment.invoice_id, "message": "Amount must be positive"}
+            )
+            continue
+        parsed.append((line, payment))
+
+    invoice_ids = {payment.invoice_id for _, payment in parsed}
+    invoices = {
+        invoice_id: (total, status)
+        for invoice_id, total, status in db.query(models.Invoice.id, models.Invoice.total, models.Invoice.status)
+        .filter(models.Invoice.id.in_(invoice_ids))
+    }
+    now = datetime.utcnow()
+    rows = []
+    for line, payment in parsed:
+        if payment.invoice_id not in invoices:
+            results.append(
+                {"line": line, "status": "rejected", "invoice_id": payment.invoice_id, "message": "Invoice not found"}
+            )
+            continue
+        rows.append(
+            {
+                "invoice_id": payment.invoice_id,
+                "amount": payment.amount,
+                "method": payment.method,
+                "paid_at": payment.paid_at or now,
+                "note": payment.note,
+            }
+        )
+        results.append({"line": line, "status": "posted", "invoice_id": payment.invoice_id})
+
+    touched = []
+    if rows:
+        payments = db.execute(
+            insert(models.Payment).returning(models.Payment.id, models.Payment.invoice_id, models.Payment.amount),
+            rows,
+        ).all()
+        outbox.payments_recorded(db, payments)
+        touched_ids = {row["invoice_id"] for row in rows}
+        totals = dict(
+            db.query(models.Payment.invoice_id, func.sum(models.Payment.amount))
+            .filter(models.Payment.invoice_id.in_(touched_ids))
+            .group_by(models.Payment.invoice_id)
+            .all()
+        )
+        for invoice_id in sorted(touched_ids):
+            total, current = invoices[invoice_id]
+            paid = totals.get(invoice_id) or 0.0
+            touched.append(
+                {
+                    "invoice_id": invoice_id,
+                    "status": _invoice_status(current, total, paid),
+                    "paid": paid,
+                    "balance": max(total - paid, 0.0),
+                }
+            )
+        db.execute(
+            update(models.Invoice),
+            [{"id": item["invoice_id"], "status": item["status"], "updated_at": now} for item in touched],
+        )
+    return {
+        "posted": len(rows),
+        "rejected": len(results) - len(rows),
+        "results": sorted(results, key=lambda result: result["line"]),
+        "invoices": touched,
+    }
+
+
 def create_crew(db: Session, payload):
     crew = models.Crew(name=payload.name, type=payload.type, color=payload.color, notes=payload.notes)
     if payload.member_ids:
         crew.members = [models.CrewMember(user_id=uid) for uid in payload.member_ids]
     db.add(crew)
-    db.commit()
-    db.refresh(crew)
+    db.flush()
     return crew
 
 
@@ -349,8 +671,7 @@ def update_crew(db: Session, crew: models.Crew, payload):
             setattr(crew, key, value)
     if payload.member_ids is not None:
         crew.members = [models.CrewMember(user_id=uid) for uid in payload.member_ids]
-    db.commit()
-    db.refresh(crew)
+    db.flush()
     return crew
 
 
@@ -366,8 +687,7 @@ def create_equipment(db: Session, payload):
         notes=payload.notes,
     )
     db.add(equipment)
-    db.commit()
-    db.refresh(equipment)
+    db.flush()
     return equipment
 
 
@@ -376,8 +696,7 @@ def update_equipment(db: Session, equipment: models.Equipment, payload):
         value = getattr(payload, key, None)
         if value is not None:
             setattr(equipment, key, value)
-    db.commit()
-    db.refresh(equipment)
+    db.flush()
     return equipment
 
 
@@ -391,16 +710,17 @@ def list_equipment(db: Session, status: str | None = None, q: str | None = None)
     return query.order_by(models.Equipment.id.desc()).all()
 
 
-def create_attachment(db: Session, payload):
+def create_attachment(db: Session, payload, sha256: str | None = None, filename: str | None = None):
     attachment = models.Attachment(
         entity_type=payload.entity_type,
         entity_id=payload.entity_id,
         url=payload.url,
         caption=payload.caption,
+        sha256=sha256,
+        filename=filename,
     )
     db.add(attachment)
-    db.commit()
-    db.refresh(attachment)
+    db.flush()
     return attachment
 
 
@@ -418,8 +738,7 @@ def ensure_settings(db: Session):
     if not settings:
         settings = models.Settings()
         db.add(settings)
-        db.commit()
-        db.refresh(settings)
+        db.flush()
     return settings
 
 
@@ -429,10 +748,10 @@ def create_sales_rep(db: Session, payload):
         email=payload.email,
         phone=payload.phone,
         notes=payload.notes,
+        commission_rules=payload.commission_rules.model_dump() if payload.commission_rules else None,
     )
     db.add(sales_rep)
-    db.commit()
-    db.refresh(sales_rep)
+    db.flush()
     return sales_rep
 
 
@@ -441,8 +760,9 @@ def update_sales_rep(db: Session, sales_rep: models.SalesRep, payload):
         value = getattr(payload, key, None)
         if value is not None:
             setattr(sales_rep, key, value)
-    db.commit()
-    db.refresh(sales_rep)
+    if payload.commission_rules is not None:
+        sales_rep.commission_rules = payload.commission_rules.model_dump()
+    db.flush()
     return sales_rep
 
 
@@ -453,16 +773,14 @@ def list_sales_reps(db: Session):
 def create_job_type(db: Session, payload):
     job_type = models.JobType(name=payload.name)
     db.add(job_type)
-    db.commit()
-    db.refresh(job_type)
+    db.flush()
     return job_type
 
 
 def update_job_type(db: Session, job_type: models.JobType, payload):
     if payload.name is not None:
         job_type.name = payload.name
-    db.commit()
-    db.refresh(job_type)
+    db.flush()
     return job_type
 
 
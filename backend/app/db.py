@@ -1,6 +1,8 @@
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, DeclarativeBase, Session
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:////data/app.db")
 
@@ -8,18 +10,56 @@ engine = create_engine(
     DATABASE_URL,
     connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
 )
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# Objects stay usable after commit; server-generated ids come back on flush.
+SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False)
 
 class Base(DeclarativeBase):
     pass
 
+@contextmanager
+def unit_of_work(db: Session):
+    """Commit once if the block succeeds, roll back if it raises."""
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+def after_commit(db: Session, callback):
+    """Run `callback` once the session's current transaction commits; it is dropped on rollback."""
+    db.info.setdefault("after_commit", []).append(callback)
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session: Session):
+    for callback in session.info.pop("after_commit", []):
+        callback()
+
+def after_rollback(db: Session, callback):
+    """Run `callback` if the session's current transaction rolls back; it is dropped on commit."""
+    db.info.setdefault("after_rollback", []).append(callback)
+
+@event.listens_for(Session, "after_commit")
+def _discard_after_rollback(session: Session):
+    session.info.pop("after_rollback", None)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_commit(session: Session):
+    session.info.pop("after_commit", None)
+    for callback in session.info.pop("after_rollback", []):
+        callback()
+
 def get_db():
     db = SessionLocal()
     try:
-        yield db
+        with unit_of_work(db):
+            yield db
     finally:
         db.close()
 
+def separate_session(db: Session) -> Session:
+    """A new session on `db`'s engine for work that commits on its own schedule."""
+    return SessionLocal(bind=db.get_bind())
+
 def get_engine():
     return engine
-
@@ -0,0 +1,425 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, selectinload
+
+from . import models
+from .pdf import MARGIN, PAGE_WIDTH, Document
+
+# Bump when the layout changes so cached documents are re-rendered.
+RENDER_VERSION = 1
+WORKERS = int(os.getenv("PDF_WORKERS", str(min(os.cpu_count() or 1, 4))))
+CACHE_BYTES = int(os.getenv("PDF_CACHE_BYTES", str(64 * 1024 * 1024)))
+ZIP_CHUNK = 16
+
+
+def _money(value: float | None) -> str:
+    return f"${value or 0:,.2f}"
+
+
+def _date(value: str | None) -> str:
+    return value[:10] if value else "-"
+
+
+def _iso(value: datetime | None) -> str | None:
+    return value.isoformat() if value else None
+
+
+# Snapshots: plain dicts so they can cross into worker processes.
+def _settings_snapshot(settings: models.Settings | None) -> dict:
+    if settings is None:
+        return {"company_name": "ArborSoftAI Pro", "updated_at": None}
+    return {"company_name": settings.company_name, "updated_at": _iso(settings.updated_at)}
+
+
+def _customer_snapshot(customer: models.Customer) -> dict:
+    return {
+        "name": customer.name,
+        "company_name": customer.company_name,
+        "billing_address": customer.billing_address,
+        "email": customer.email,
+        "phone": customer.phone,
+        "updated_at": _iso(customer.updated_at),
+    }
+
+
+def _line_items(estimate: models.Estimate | None) -> list[dict]:
+    if estimate is None:
+        return []
+    return [
+        {
+            "name": item.name,
+            "description": item.description,
+            "qty": item.qty,
+            "unit_price": item.unit_price,
+            "total": item.total,
+            "updated_at": _iso(item.updated_at),
+        }
+        for item in sorted(estimate.line_items, key=lambda item: (item.sort_order, item.id))
+    ]
+
+
+def invoice_snapshot(invoice: models.Invoice, settings: dict) -> dict:
+    job = invoice.job
+    estimate = job.estimate if job else None
+    return {
+        "kind": "invoice",
+        "id": invoice.id,
+        "status": invoice.status,
+        "issued_at": _iso(invoice.issued_at or invoice.created_at),
+        "due_date": _iso(invoice.due_date),
+        "service_address": invoice.service_address,
+        "subtotal": invoice.subtotal,
+        "tax": invoice.tax,
+        "total": invoice.total,
+        "notes": invoice.notes,
+        "updated_at": _iso(invoice.updated_at),
+        "job": {"id": job.id, "updated_at": _iso(job.updated_at)} if job else None,
+        "estimate_updated_at": _iso(estimate.updated_at) if estimate else None,
+        "line_items": _line_items(estimate),
+        "payments": [
+            {
+                "id": payment.id,
+                "amount": payment.amount,
+                "method": payment.method,
+                "paid_at": _iso(payment.paid_at),
+                "updated_at": _iso(payment.updated_at),
+            }
+            for payment in sorted(invoice.payments, key=lambda payment: payment.id)
+        ],
+        "customer": _customer_snapshot(invoice.customer),
+        "settings": settings,
+    }
+
+
+def estimate_snapshot(estimate: models.Estimate, settings: dict) -> dict:
+    return {
+        "kind": "estimate",
+        "id": estimate.id,
+        "status": estimate.status,
+        "created_at": _iso(estimate.created_at),
+        "sent_at": _iso(estimate.sent_at),
+        "service_address": estimate.service_address,
+        "scope": estimate.scope,
+        "hazards": estimate.hazards,
+        "equipment": estimate.equipment,
+        "tax": estimate.tax,
+        "discount": estimate.discount,
+        "total": estimate.total,
+        "notes": estimate.notes,
+        "updated_at": _iso(estimate.updated_at),
+        "line_items": _line_items(estimate),
+        "customer": _customer_snapshot(estimate.customer),
+        "settings": settings,
+    }
+
+
+def cache_key(snapshot: dict) -> str:
+    """Hash every updated_at (and payment id) the document depends on, plus Settings."""
+    stamps = {
+        "version": RENDER_VERSION,
+        "kind": snapshot["kind"],
+        "id": snapshot["id"],
+        "updated_at": snapshot["updated_at"],
+        "customer": snapshot["customer"]["updated_at"],
+        "settings": snapshot["settings"]["updated_at"],
+        "line_items": [item["updated_at"] for item in snapshot["line_items"]],
+        "job": snapshot.get("job"),
+        "estimate": snapshot.get("estimate_updated_at"),
+        "payments": [(payment["id"], payment["updated_at"]) for payment in snapshot.get("payments", [])],
+    }
+    return hashlib.sha256(json.dumps(stamps, sort_keys=True).encode()).hexdigest()
+
+
+# Rendering: pure functions of a snapshot, run in worker processes.
+def _header(doc: Document, snapshot: dict, title: str, facts: list[tuple[str, str]]):
+    right = PAGE_WIDTH - MARGIN
+    doc.line(snapshot["settings"]["company_name"], size=18, bold=True)
+    doc.text(right, doc.y, title, size=18, bold=True, align="right")
+    for label, value in facts:
+        doc.line(f"{label}: {value}", size=10, x=right - 180)
+    doc.line()
+    customer = snapshot["customer"]
+    doc.line("Bill to", bold=True)
+    for value in [customer["name"], customer["company_name"], *customer["billing_address"].splitlines()]:
+        if value:
+            doc.line(value)
+    contact = " | ".join(value for value in [customer["email"], customer["phone"]] if value)
+    if contact:
+        doc.line(contact)
+    if snapshot["service_address"]:
+        doc.line()
+        doc.line("Service address", bold=True)
+        doc.paragraph(snapshot["service_address"])
+    doc.line()
+
+
+def _items_table(doc: Document, items: list[dict]):
+    right = PAGE_WIDTH - MARGIN
+    columns = (right - 200, right - 100, right)
+    doc.line("Description", bold=True)
+    for x, label in zip(columns, ("Qty", "Unit price", "Amount")):
+        doc.text(x, doc.y, label, bold=True, align="right")
+    doc.rule(MARGIN, doc.y - 4, right, doc.y - 4)
+    doc.y -= 4
+    for item in items:
+        doc.line(item["name"])
+        doc.text(columns[0], doc.y, f"{item['qty']:g}", align="right")
+        doc.text(columns[1], doc.y, _money(item["unit_price"]), align="right")
+        doc.text(columns[2], doc.y, _money(item["total"]), align="right")
+        if item.get("description"):
+            doc.line(item["description"], size=8, x=MARGIN + 12)
+    doc.rule(MARGIN, doc.y - 6, right, doc.y - 6)
+    doc.y -= 6
+
+
+def _totals(doc: Document, rows: list[tuple[str, str, bool]]):
+    right = PAGE_WIDTH - MARGIN
+    for label, value, bold in rows:
+        doc.line(label, bold=bold, x=right - 200)
+        doc.text(right, doc.y, value, bold=bold, align="right")
+
+
+def render_invoice(snapshot: dict) -> bytes:
+    doc = Document()
+    facts = [
+        ("Invoice", f"#{snapshot['id']}"),
+        ("Issued", _date(snapshot["issued_at"])),
+        ("Due", _date(snapshot["due_date"])),
+        ("Status", snapshot["status"].title()),
+    ]
+    _header(doc, snapshot, "INVOICE", facts)
+    items = snapshot["line_items"] or [
+        {
+            "name": f"Tree service, job #{snapshot['job']['id']}" if snapshot["job"] else "Tree service",
+            "qty": 1,
+            "unit_price": snapshot["subtotal"],
+            "total": snapshot["subtotal"],
+        }
+    ]
+    _items_table(doc, items)
+    paid = sum(payment["amount"] for payment in snapshot["payments"])
+    _totals(
+        doc,
+        [
+            ("Subtotal", _money(snapshot["subtotal"]), False),
+            ("Tax", _money(snapshot["tax"]), False),
+            ("Total", _money(snapshot["total"]), True),
+            ("Paid", _money(paid), False),
+            ("Balance due", _money(max(snapshot["total"] - paid, 0.0)), True),
+        ],
+    )
+    if snapshot["payments"]:
+        doc.line()
+        doc.line("Payments", bold=True)
+        for payment in snapshot["payments"]:
+            doc.line(f"{_date(payment['paid_at'])}  {payment['method']}  {_money(payment['amount'])}")
+    if snapshot["notes"]:
+        doc.line()
+        doc.line("Notes", bold=True)
+        doc.paragraph(snapshot["notes"])
+    return doc.to_bytes()
+
+
+def render_estimate(snapshot: dict) -> bytes:
+    doc = Document()
+    facts = [
+        ("Estimate", f"#{snapshot['id']}"),
+        ("Date", _date(snapshot["sent_at"] or snapshot["created_at"])),
+        ("Status", snapshot["status"].title()),
+    ]
+    _header(doc, snapshot, "ESTIMATE", facts)
+    for label, key in (("Scope of work", "scope"), ("Hazards", "hazards"), ("Equipment", "equipment")):
+        if snapshot[key]:
+            doc.line(label, bold=True)
+            doc.paragraph(snapshot[key])
+            doc.line()
+    if snapshot["line_items"]:
+        _items_table(doc, snapshot["line_items"])
+    rows = []
+    if snapshot["line_items"]:
+        rows.append(("Subtotal", _money(sum(item["total"] for item in snapshot["line_items"])), False))
+    if snapshot["tax"]:
+        rows.append(("Tax", _money(snapshot["tax"]), False))
+    if snapshot["discount"]:
+        rows.append(("Discount", f"-{_money(snapshot['discount'])}", False))
+    rows.append(("Total", _money(snapshot["total"]), True))
+    _totals(doc, rows)
+    if snapshot["notes"]:
+        doc.line()
+        doc.line("Notes", bold=True)
+        doc.paragraph(snapshot["notes"])
+    return doc.to_bytes()
+
+
+RENDERERS = {"invoice": render_invoice, "estimate": render_estimate}
+
+
+def render(snapshot: dict) -> bytes:
+    return RENDERERS[snapshot["kind"]](snapshot)
+
+
+class DocumentCache:
+    """LRU of rendered documents keyed by cache_key, bounded by total bytes."""
+
+    def __init__(self, max_bytes: int = CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+cache = DocumentCache()
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _executor() -> ProcessPoolExecutor | None:
+    global _pool
+    if WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn: the API process runs threads, which fork does not copy safely.
+            _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def render_many(snapshots: list[dict]) -> list[tuple[str, bytes]]:
+    """Return (cache key, PDF) for each snapshot, rendering cache misses in the process pool."""
+    keys = [cache_key(snapshot) for snapshot in snapshots]
+    found = {key: cache.get(key) for key in keys}
+    missing = [snapshot for key, snapshot in zip(keys, snapshots) if found[key] is None]
+    if missing:
+        pool = _executor()
+        rendered = pool.map(render, missing) if pool else map(render, missing)
+        for snapshot, data in zip(missing, rendered):
+            key = cache_key(snapshot)
+            cache.put(key, data)
+            found[key] = data
+    return [(key, found[key]) for key in keys]
+
+
+def _settings(db: Session) -> dict:
+    return _settings_snapshot(db.query(models.Settings).first())
+
+
+def _invoice_query(db: Session):
+    return db.query(models.Invoice).options(
+        selectinload(models.Invoice.customer),
+        selectinload(models.Invoice.payments),
+        selectinload(models.Invoice.job)
+        .selectinload(models.Job.estimate)
+        .selectinload(models.Estimate.line_items),
+    )
+
+
+def _render_unless_current(snapshot: dict, if_none_match: str | None) -> tuple[str, bytes | None]:
+    # The key comes from the snapshot alone, so a revalidation never renders.
+    key = cache_key(snapshot)
+    if if_none_match == f'"{key}"':
+        return key, None
+    return render_many([snapshot])[0]
+
+
+def invoice_pdf(db: Session, invoice_id: int, if_none_match: str | None = None) -> tuple[str, bytes | None] | None:
+    """(cache key, PDF) for the invoice; the PDF is None when `if_none_match` is already its ETag."""
+    invoice = _invoice_query(db).filter(models.Invoice.id == invoice_id).first()
+    if invoice is None:
+        return None
+    return _render_unless_current(invoice_snapshot(invoice, _settings(db)), if_none_match)
+
+
+def estimate_pdf(db: Session, estimate_id: int, if_none_match: str | None = None) -> tuple[str, bytes | None] | None:
+    estimate = (
+        db.query(models.Estimate)
+        .options(selectinload(models.Estimate.customer), selectinload(models.Estimate.line_items))
+        .filter(models.Estimate.id == estimate_id)
+        .first()
+    )
+    if estimate is None:
+        return None
+    return _render_unless_current(estimate_snapshot(estimate, _settings(db)), if_none_match)
+
+
+def month_invoice_snapshots(db: Session, start: datetime, end: datetime) -> list[dict]:
+    issued = func.coalesce(models.Invoice.issued_at, models.Invoice.created_at)
+    invoices = _invoice_query(db).filter(issued >= start, issued < end).order_by(models.Invoice.id).all()
+    settings = _settings(db)
+    return [invoice_snapshot(invoice, settings) for invoice in invoices]
+
+
+class _ZipStream:
+    """Write-only file object that hands out what zipfile has written so far."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offset = 0
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def stream_zip(snapshots: list[dict]):
+    """Yield a ZIP of invoice PDFs, rendering ZIP_CHUNK documents at a time."""
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for start in range(0, len(snapshots), ZIP_CHUNK):
+            chunk = snapshots[start:start + ZIP_CHUNK]
+            for snapshot, (_, data) in zip(chunk, render_many(chunk)):
+                archive.writestr(f"{snapshot['kind']}-{snapshot['id']}.pdf", data)
+            yield stream.drain()
+    yield stream.drain()
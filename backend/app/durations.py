@@ -0,0 +1,191 @@
+import logging
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from . import events, models
+from .db import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.8, 0.9)
+MIN_SAMPLES = 3
+MAX_DURATION_HOURS = 24 * 14
+REFRESH_SECONDS = int(os.getenv("DURATION_MODEL_REFRESH_SECONDS", "600"))
+
+# Most to least specific; an estimate uses the first level with MIN_SAMPLES.
+LEVELS = ("job_type_crew", "job_type", "crew", "all")
+_MISSING = -1
+
+
+def _level_key(level: str, job_type_id: int | None, crew_id: int | None) -> tuple:
+    job_type = _MISSING if job_type_id is None else job_type_id
+    crew = _MISSING if crew_id is None else crew_id
+    return {
+        "job_type_crew": (level, job_type, crew),
+        "job_type": (level, job_type),
+        "crew": (level, crew),
+        "all": (level,),
+    }[level]
+
+
+def _group(columns: list[np.ndarray], hours: np.ndarray):
+    """Yield (key values, hours) for each distinct combination of `columns`."""
+    if not columns:
+        yield (), hours
+        return
+    keys = np.stack(columns, axis=1)
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(unique)))[:-1]
+    for key, chunk in zip(unique, np.split(hours[order], bounds)):
+        yield tuple(int(v) for v in key), chunk
+
+
+class DurationModel:
+    """Job duration quantiles by job type and crew, learned from completed jobs.
+
+    Duration is completed_at - scheduled_start. Samples are kept per group so
+    a refresh only reads jobs completed after the last one seen and only
+    recomputes quantiles for the groups those jobs touch.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples: dict[tuple, np.ndarray] = {}
+        self._stats: dict[tuple, dict] = {}
+        self._watermark: tuple[datetime, int] | None = None
+        self.trained_at: datetime | None = None
+        self.dirty = threading.Event()
+
+    def refresh(self, db: Session, full: bool = False) -> int:
+        query = db.query(
+            models.Job.id,
+            models.Job.job_type_id,
+            models.Job.crew_id,
+            models.Job.scheduled_start,
+            models.Job.completed_at,
+        ).filter(
+            models.Job.status == "completed",
+            models.Job.scheduled_start.isnot(None),
+            models.Job.completed_at.isnot(None),
+        )
+        with self._lock:
+            watermark = None if full else self._watermark
+        if watermark is not None:
+            last_ts, last_id = watermark
+            query = query.filter(
+                or_(
+                    models.Job.completed_at > last_ts,
+                    and_(models.Job.completed_at == last_ts, models.Job.id > last_id),
+                )
+            )
+        self.dirty.clear()
+        rows = query.order_by(models.Job.completed_at, models.Job.id).all()
+
+        with self._lock:
+            if full:
+                self._samples = {}
+                self._stats = {}
+            if rows:
+                self._add_samples(rows)
+                self._watermark = (rows[-1].completed_at, rows[-1].id)
+            self.trained_at = datetime.utcnow()
+        return len(rows)
+
+    def _add_samples(self, rows):
+        starts = np.array([row.scheduled_start for row in rows], dtype="datetime64[us]")
+        ends = np.array([row.completed_at for row in rows], dtype="datetime64[us]")
+        hours = (ends - starts) / np.timedelta64(1, "h")
+        job_types = np.array([_MISSING if row.job_type_id is None else row.job_type_id for row in rows])
+        crews = np.array([_MISSING if row.crew_id is None else row.crew_id for row in rows])
+        valid = (hours > 0) & (hours <= MAX_DURATION_HOURS)
+        hours, job_types, crews = hours[valid], job_types[valid], crews[valid]
+        if not len(hours):
+            return
+        columns = {
+            "job_type_crew": [job_types, crews],
+            "job_type": [job_types],
+            "crew": [crews],
+            "all": [],
+        }
+        for level, cols in columns.items():
+            for values, chunk in _group(cols, hours):
+                key = (level, *values)
+                existing = self._samples.get(key)
+                samples = chunk if existing is None else np.concatenate([existing, chunk])
+                self._samples[key] = samples
+                q = np.quantile(samples, QUANTILES)
+                self._stats[key] = {
+                    "samples": int(len(samples)),
+                    "p50_hours": float(q[0]),
+                    "p80_hours": float(q[1]),
+                    "p90_hours": float(q[2]),
+                }
+
+    def estimate(self, job_type_id: int | None = None, crew_id: int | None = None) -> dict | None:
+        with self._lock:
+            for level in LEVELS:
+                stats = self._stats.get(_level_key(level, job_type_id, crew_id))
+                if stats and stats["samples"] >= MIN_SAMPLES:
+                    return {"basis": level, **stats}
+        return None
+
+    def ensure_fresh(self, db: Session):
+        """Train on first use, and catch up inline when no background refresher is running."""
+        if self.trained_at is None:
+            self.refresh(db, full=True)
+        elif self.dirty.is_set() and not _refresher_running():
+            self.refresh(db)
+
+
+model = DurationModel()
+
+
+def _on_event(event: dict):
+    if event["topic"] == "job" and event.get("changes", {}).get("status") == "completed":
+        model.dirty.set()
+
+
+events.bus.add_listener(_on_event)
+
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+
+
+def _refresher_running() -> bool:
+    return _thread is not None and _thread.is_alive()
+
+
+def _refresh_loop():
+    while not _stop.is_set():
+        model.dirty.wait(REFRESH_SECONDS)
+        if _stop.is_set():
+            return
+        db = SessionLocal()
+        try:
+            model.refresh(db, full=model.trained_at is None)
+        except Exception:
+            logger.exception("Duration model refresh failed")
+        finally:
+            db.close()
+
+
+def start_background_refresh():
+    global _thread
+    if REFRESH_SECONDS <= 0 or _refresher_running():
+        return
+    _stop.clear()
+    model.dirty.set()
+    _thread = threading.Thread(target=_refresh_loop, name="duration-model", daemon=True)
+    _thread.start()
+
+
+def stop_background_refresh():
+    _stop.set()
+    model.dirty.set()
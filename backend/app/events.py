@@ -0,0 +1,222 @@
+import asyncio
+import threading
+import uuid
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session
+
+from .db import after_commit
+
+SUBSCRIBER_QUEUE_SIZE = 256
+KEEPALIVE_SECONDS = 15
+# Topics for other workers' caches, never streamed to clients.
+INTERNAL_TOPICS = {"data"}
+
+
+class LocalBroker:
+    """In-process stand-in for a cross-worker broker.
+
+    Every attached bus plays the role of one worker: publishing fans the event
+    out to all of them, including the publisher. A networked broker (Redis
+    pub/sub, NATS, Postgres LISTEN/NOTIFY) only needs the same two methods,
+    delivering serialized events to each worker's `EventBus.deliver`.
+    """
+
+    def __init__(self):
+        self._buses = []
+        self._lock = threading.Lock()
+
+    def attach(self, bus: "EventBus"):
+        with self._lock:
+            self._buses.append(bus)
+
+    def detach(self, bus: "EventBus"):
+        with self._lock:
+            if bus in self._buses:
+                self._buses.remove(bus)
+
+    def publish(self, event: dict):
+        with self._lock:
+            buses = list(self._buses)
+        for bus in buses:
+            bus.deliver(event)
+
+
+def _parse_ts(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+class Subscription:
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        topics: set[str] | None = None,
+        crew_id: int | None = None,
+        start: datetime | None = None,
+        end: datetime | None = None,
+    ):
+        self.loop = loop
+        self.topics = topics
+        self.crew_id = crew_id
+        self.start = start
+        self.end = end
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def matches(self, event: dict) -> bool:
+        if event["topic"] in INTERNAL_TOPICS:
+            return False
+        if self.topics and event["topic"] not in self.topics:
+            return False
+        if self.crew_id is not None and self.crew_id not in (
+            event.get("crew_id"),
+            event.get("previous_crew_id"),
+        ):
+            return False
+        if self.start is not None or self.end is not None:
+            starts = [
+                _parse_ts(event.get(key))
+                for key in ("scheduled_start", "previous_scheduled_start")
+                if event.get(key)
+            ]
+            in_range = any(
+                (self.start is None or ts >= self.start) and (self.end is None or ts <= self.end)
+                for ts in starts
+            )
+            if event.get("scheduled_range"):
+                # Bulk events carry the [first, last] start of the jobs they cover.
+                first, last = (_parse_ts(ts) for ts in event["scheduled_range"])
+                in_range = in_range or (
+                    (self.end is None or first <= self.end) and (self.start is None or last >= self.start)
+                )
+            if not in_range:
+                return False
+        return True
+
+    def _put(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow consumer: drop the backlog and tell the client to refetch.
+            self.overflowed = True
+
+    def push(self, event: dict):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    async def next_event(self, timeout: float | None = None) -> dict | None:
+        if self.overflowed:
+            self.overflowed = False
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            return {"topic": "resync"}
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBus:
+    def __init__(self, broker=None):
+        self.worker_id = uuid.uuid4().hex
+        self._subscribers: set[Subscription] = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self.broker = broker or LocalBroker()
+        self.broker.attach(self)
+
+    def subscribe(self, **filters) -> Subscription:
+        subscription = Subscription(asyncio.get_running_loop(), **filters)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def add_listener(self, callback):
+        """Register a synchronous in-process callback run for every delivered event."""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def publish(self, topic: str, action: str, entity_id: int, db: Session | None = None, **fields):
+        """Publish now, or when `db` commits if the write is still in an open transaction."""
+        event = jsonable_encoder(
+            {"topic": topic, "action": action, "id": entity_id, "origin": self.worker_id, **fields}
+        )
+        if db is None:
+            self.broker.publish(event)
+        else:
+            after_commit(db, lambda: self.broker.publish(event))
+
+    def deliver(self, event: dict):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback(event)
+        for subscription in subscribers:
+            if subscription.matches(event):
+                subscription.push(event)
+
+
+bus = EventBus()
+
+
+def publish_job(
+    job,
+    action: str,
+    changes: dict | None = None,
+    previous: dict | None = None,
+    db: Session | None = None,
+):
+    previous = previous or {}
+    bus.publish(
+        "job",
+        action,
+        job.id,
+        db=db,
+        crew_id=job.crew_id,
+        scheduled_start=job.scheduled_start,
+        previous_crew_id=previous.get("crew_id"),
+        previous_scheduled_start=previous.get("scheduled_start"),
+        changes=changes or {},
+    )
+
+
+def publish_task(job, task_id: int, action: str, changes: dict | None = None, db: Session | None = None):
+    bus.publish(
+        "task",
+        action,
+        task_id,
+        db=db,
+        job_id=job.id,
+        crew_id=job.crew_id,
+        scheduled_start=job.scheduled_start,
+        changes=changes or {},
+    )
+
+
+def publish_jobs_bulk(action: str, jobs: list[dict], changes: dict | None = None, db: Session | None = None):
+    """Publish one event per crew for a set-based write instead of one per job.
+
+    `jobs` are dicts with id, crew_id and scheduled_start keys.
+    """
+    by_crew: dict[int | None, list[dict]] = {}
+    for job in jobs:
+        by_crew.setdefault(job["crew_id"], []).append(job)
+    for crew_id, crew_jobs in by_crew.items():
+        starts = sorted(job["scheduled_start"] for job in crew_jobs if job["scheduled_start"])
+        bus.publish(
+            "job",
+            action,
+            None,
+            db=db,
+            crew_id=crew_id,
+            job_ids=[job["id"] for job in crew_jobs],
+            scheduled_range=[starts[0], starts[-1]] if starts else None,
+            changes=changes or {},
+        )
@@ -0,0 +1,284 @@
+import hashlib
+import threading
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import events, models, sync
+
+LOOKBACK_DAYS = 90
+DEFAULT_DURATION = timedelta(hours=1)
+PRODID = "-//ArborSoftAI//Crew Schedule//EN"
+UID_DOMAIN = "arborsoftai"
+
+_EVENT_STATUS = {"canceled": "CANCELLED"}
+
+
+def _escape(text: str | None) -> str:
+    return (
+        (text or "")
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def _fold(line: str) -> str:
+    """Fold a content line at 75 octets without splitting UTF-8 sequences (RFC 5545 3.1)."""
+    parts = []
+    current = ""
+    size = 0
+    limit = 75
+    for char in line:
+        width = len(char.encode("utf-8"))
+        if size + width > limit:
+            parts.append(current)
+            current = " "
+            size = 1
+        current += char
+        size += width
+    parts.append(current)
+    return "\r\n".join(parts) + "\r\n"
+
+
+def _utc(ts: datetime) -> str:
+    return ts.strftime("%Y%m%dT%H%M%SZ")
+
+
+def _local(ts: datetime) -> str:
+    # Schedules are naive local wall-clock times: "floating" times with no Z
+    # (RFC 5545 3.3.5), shown at the same hour in any calendar's time zone.
+    return ts.strftime("%Y%m%dT%H%M%S")
+
+
+def _header(crew_name: str) -> str:
+    return "".join(
+        _fold(line)
+        for line in [
+            "BEGIN:VCALENDAR",
+            "VERSION:2.0",
+            f"PRODID:{PRODID}",
+            "CALSCALE:GREGORIAN",
+            f"X-WR-CALNAME:{_escape(crew_name)}",
+        ]
+    )
+
+
+def _vevent(row) -> str:
+    job_id, status, start, end, address, notes, updated_at, customer_name, job_type = row
+    summary = f"{job_type}: {customer_name}" if job_type else customer_name
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:job-{job_id}@{UID_DOMAIN}",
+        f"DTSTAMP:{_utc(updated_at)}",
+        f"DTSTART:{_local(start)}",
+        f"DTEND:{_local(end if end and end > start else start + DEFAULT_DURATION)}",
+        f"SUMMARY:{_escape(summary)}",
+        f"LOCATION:{_escape(address)}",
+        f"DESCRIPTION:{_escape(notes)}",
+        f"STATUS:{_EVENT_STATUS.get(status, 'CONFIRMED')}",
+        "END:VEVENT",
+    ]
+    return "".join(_fold(line) for line in lines)
+
+
+def _cancelled_vevent(tombstone: models.Tombstone) -> str:
+    # Deleted jobs no longer have a start; the deletion time stands in for it.
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:job-{tombstone.entity_id}@{UID_DOMAIN}",
+        f"DTSTAMP:{_utc(tombstone.deleted_at)}",
+        f"DTSTART:{_utc(tombstone.deleted_at)}",
+        "STATUS:CANCELLED",
+        "END:VEVENT",
+    ]
+    return "".join(_fold(line) for line in lines)
+
+
+def _window_start() -> datetime:
+    # Day-aligned so the fingerprint (and ETag) is stable within a day.
+    today = date.today()
+    return datetime(today.year, today.month, today.day) - timedelta(days=LOOKBACK_DAYS)
+
+
+def _crew_job_filters(crew_id: int, since: datetime | None = None):
+    filters = [models.Job.crew_id == crew_id, models.Job.scheduled_start.isnot(None)]
+    if since is not None:
+        filters.append(models.Job.updated_at >= since)
+    else:
+        filters.append(models.Job.scheduled_start >= _window_start())
+    return filters
+
+
+def _crew_job_rows(db: Session, crew_id: int, since: datetime | None = None):
+    return (
+        db.query(
+            models.Job.id,
+            models.Job.status,
+            models.Job.scheduled_start,
+            models.Job.scheduled_end,
+            models.Job.service_address,
+            models.Job.notes,
+            models.Job.updated_at,
+            models.Customer.name,
+            models.JobType.name,
+        )
+        .join(models.Customer, models.Customer.id == models.Job.customer_id)
+        .outerjoin(models.JobType, models.JobType.id == models.Job.job_type_id)
+        .filter(*_crew_job_filters(crew_id, since))
+        .order_by(models.Job.scheduled_start, models.Job.id)
+        .all()
+    )
+
+
+def _fingerprint(db: Session, crew: models.Crew) -> str:
+    count, last_job_update, max_id, last_customer_update = (
+        db.query(
+            func.count(models.Job.id),
+            func.max(models.Job.updated_at),
+            func.max(models.Job.id),
+            func.max(models.Customer.updated_at),
+        )
+        .join(models.Customer, models.Customer.id == models.Job.customer_id)
+        .filter(*_crew_job_filters(crew.id))
+        .one()
+    )
+    # Job types carry no updated_at; the table is small enough to hash whole.
+    job_types = db.query(models.JobType.id, models.JobType.name).order_by(models.JobType.id).all()
+    raw = (
+        f"{crew.id}:{crew.name}:{_window_start()}:{count}:{last_job_update}:{max_id}:{last_customer_update}"
+        f":{job_types}"
+    )
+    return '"' + hashlib.sha1(raw.encode()).hexdigest()[:20] + '"'
+
+
+class CrewFeed:
+    def __init__(self, crew_id: int, crew_name: str, etag: str, token: str, rows=None):
+        self.crew_id = crew_id
+        self.crew_name = crew_name
+        self.etag = etag
+        self.token = token
+        self.rows = rows
+        self.body: str | None = None
+
+    def stream(self):
+        body, rows = self.body, self.rows
+        if body is not None:
+            yield body
+            return
+        chunks = [_header(self.crew_name)]
+        yield chunks[0]
+        for row in rows or []:
+            chunk = _vevent(row)
+            chunks.append(chunk)
+            yield chunk
+        chunks.append(_fold("END:VCALENDAR"))
+        yield chunks[-1]
+        self.body = "".join(chunks)
+        self.rows = None
+
+
+_cache: dict[int, CrewFeed] = {}
+_generations: dict[int, int] = {}
+_lock = threading.Lock()
+
+
+def invalidate(crew_id: int):
+    with _lock:
+        _cache.pop(crew_id, None)
+        _generations[crew_id] = _generations.get(crew_id, 0) + 1
+
+
+def _on_event(event: dict):
+    if event["topic"] not in {"job", "task"}:
+        return
+    for key in ("crew_id", "previous_crew_id"):
+        if event.get(key) is not None:
+            invalidate(event[key])
+
+
+events.bus.add_listener(_on_event)
+
+
+def get_feed(db: Session, crew_id: int, if_none_match: str | None = None) -> CrewFeed | None:
+    """Return the crew's feed, from cache while its fingerprint holds; None if the crew is unknown.
+
+    Every request re-fingerprints, so writes that publish no job event
+    (customer renames, job type edits) and the day rollover still change the
+    ETag; the cache only saves re-rendering the body.
+    """
+    crew = db.query(models.Crew).filter(models.Crew.id == crew_id).first()
+    if crew is None:
+        return None
+    with _lock:
+        generation = _generations.get(crew.id, 0)
+        feed = _cache.get(crew_id)
+    etag = _fingerprint(db, crew)
+    # An entry cached for a 304 holds no rows, so it can only answer revalidations.
+    if feed is not None and feed.etag == etag and (
+        etag == if_none_match or feed.rows is not None or feed.body is not None
+    ):
+        return feed
+    return build_feed(db, crew, if_none_match, etag, generation)
+
+
+def build_feed(
+    db: Session,
+    crew: models.Crew,
+    if_none_match: str | None = None,
+    etag: str | None = None,
+    generation: int | None = None,
+) -> CrewFeed:
+    """Fingerprint the crew's jobs and cache a feed for them.
+
+    Rows are only loaded when the client's ETag does not already match, so a
+    revalidation after a cache eviction costs one aggregate query.
+    """
+    if generation is None:
+        with _lock:
+            generation = _generations.get(crew.id, 0)
+    token = sync.next_token()
+    etag = etag or _fingerprint(db, crew)
+    rows = None if if_none_match == etag else _crew_job_rows(db, crew.id)
+    feed = CrewFeed(crew.id, crew.name, etag, token, rows)
+    with _lock:
+        # Skip caching if a job write invalidated this crew while we were querying.
+        if _generations.get(crew.id, 0) == generation:
+            _cache[crew.id] = feed
+    return feed
+
+
+def stream_delta(db: Session, crew: models.Crew, since: datetime):
+    """Yield a calendar holding only jobs changed since `since`, and those deleted
+    from or reassigned away from the crew, as CANCELLED."""
+    rows = _crew_job_rows(db, crew.id, since)
+    tombstones = (
+        db.query(models.Tombstone)
+        .filter(
+            models.Tombstone.entity_type.in_(("jobs", sync.REASSIGNED_JOBS)),
+            models.Tombstone.crew_id == crew.id,
+            models.Tombstone.deleted_at >= since,
+        )
+        .order_by(models.Tombstone.deleted_at, models.Tombstone.id)
+        .all()
+    )
+    # A job moved away and back again is current, not cancelled; cancel each job once.
+    current = {row[0] for row in rows}
+    gone = {}
+    for tombstone in tombstones:
+        if tombstone.entity_id not in current:
+            gone[tombstone.entity_id] = tombstone
+    crew_name = crew.name
+
+    def stream():
+        yield _header(crew_name)
+        for row in rows:
+            yield _vevent(row)
+        for tombstone in gone.values():
+            yield _cancelled_vevent(tombstone)
+        yield _fold("END:VCALENDAR")
+
+    return stream()
@@ -0,0 +1,254 @@
+import hashlib
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import event, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+from .db import get_db
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+TTL = timedelta(hours=int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24")))
+# A claim whose write never committed is taken to have died mid-flight after
+# this long; keep it well above the longest request (billing runs, imports).
+PENDING_TIMEOUT = timedelta(seconds=int(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT_SECONDS", "900")))
+EVICT_EVERY = timedelta(minutes=10)
+
+_last_eviction: datetime | None = None
+# (key, route) claimed by the request running in this context.
+_claimed: ContextVar[tuple[str, str] | None] = ContextVar("idempotency_claimed", default=None)
+
+
+def _session(app):
+    # Resolve the session the same way endpoints do, so dependency overrides apply.
+    return contextmanager(app.dependency_overrides.get(get_db, get_db))()
+
+
+def _digest(request: Request):
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {request.url.path}?{request.url.query}\n".encode())
+    return digest
+
+
+def _is_streamed(request: Request) -> bool:
+    # Uploads stream to disk; their bodies are hashed in passing, never buffered.
+    return request.headers.get("content-type", "").startswith("multipart/form-data")
+
+
+class _UploadDigest:
+    """Hashes a multipart body chunk by chunk without its boundary, which
+    clients pick afresh for every attempt."""
+
+    def __init__(self, digest, content_type: str):
+        boundary = content_type.partition("boundary=")[2].split(";")[0].strip().strip('"')
+        self.digest = digest
+        self.boundary = boundary.encode()
+        self.tail = b""
+
+    def update(self, chunk: bytes):
+        data = (self.tail + chunk).replace(self.boundary, b"") if self.boundary else chunk
+        # Hold back what could be the start of a boundary split across chunks.
+        keep = min(len(self.boundary) - 1, len(data)) if self.boundary else 0
+        self.tail = data[len(data) - keep :]
+        self.digest.update(data[: len(data) - keep])
+
+    def hexdigest(self) -> str:
+        digest = self.digest.copy()
+        digest.update(self.tail)
+        return digest.hexdigest()
+
+
+def _hash_through(request: Request, digest) -> dict:
+    """Feed the body into `digest` as the endpoint reads it; the returned dict
+    says whether the whole body went through."""
+    receive = request._receive
+    seen = {"complete": False}
+
+    async def hashing_receive():
+        message = await receive()
+        if message["type"] == "http.request":
+            digest.update(message.get("body", b""))
+            seen["complete"] = not message.get("more_body", False)
+        return message
+
+    request._receive = hashing_receive
+    return seen
+
+
+def _claim(app, key: str, route: str, request_hash: str, now: datetime):
+    """Return the stored row for (key, route), or None once this request owns the key."""
+    with _session(app) as db:
+        _evict(db, now)
+        record = (
+            db.query(models.IdempotencyKey)
+            .filter(models.IdempotencyKey.key == key, models.IdempotencyKey.route == route)
+            .first()
+        )
+        expired = record is not None and (
+            record.created_at < now - TTL
+            or (
+                record.status_code is None
+                and record.applied_at is None
+                and record.created_at < now - PENDING_TIMEOUT
+            )
+        )
+        if record is not None and not expired:
+            db.expunge(record)
+            return record
+        if record is not None:
+            db.delete(record)
+            db.flush()
+        db.add(models.IdempotencyKey(key=key, route=route, request_hash=request_hash, created_at=now))
+    return None
+
+
+def _stored_headers(raw) -> list[list[str]]:
+    # Raw pairs keep repeated headers such as Set-Cookie apart; Content-Length
+    # is set again for the replayed body.
+    return [
+        [name.decode("latin-1"), value.decode("latin-1")] for name, value in raw if name.lower() != b"content-length"
+    ]
+
+
+def _response(body: bytes, status_code: int, headers: list[list[str]], *extra: tuple[bytes, bytes]) -> Response:
+    response = Response(body, status_code=status_code)
+    response.raw_headers += [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+    response.raw_headers += extra
+    return response
+
+
+def _store(
+    app,
+    key: str,
+    route: str,
+    status_code: int | None,
+    headers: list[list[str]] | None,
+    body: bytes,
+    request_hash: str | None = None,
+):
+    with _session(app) as db:
+        record = (
+            db.query(models.IdempotencyKey)
+            .filter(models.IdempotencyKey.key == key, models.IdempotencyKey.route == route)
+            .first()
+        )
+        if record is None:
+            return
+        if status_code is None or status_code >= 500 or not request_hash:
+            # Failures that wrote nothing are not replayed; release the key so
+            # the client can retry for real. An applied claim stays, refusing retries.
+            if record.applied_at is None:
+                db.delete(record)
+                return
+            if status_code is None or not request_hash:
+                return
+        record.request_hash = request_hash
+        record.status_code = status_code
+        record.response_headers = headers
+        record.response_body = body
+
+
+@event.listens_for(Session, "before_commit")
+def _mark_applied(session: Session):
+    # Recorded in the request's own transaction: once its writes commit the
+    # key can never expire into a second run, even if the response is lost.
+    claimed = _claimed.get()
+    if claimed is not None:
+        key, route = claimed
+        session.execute(
+            update(models.IdempotencyKey)
+            .where(
+                models.IdempotencyKey.key == key,
+                models.IdempotencyKey.route == route,
+                models.IdempotencyKey.applied_at.is_(None),
+            )
+            .values(applied_at=datetime.utcnow()),
+            execution_options={"synchronize_session": False},
+        )
+
+
+def _evict(db, now: datetime):
+    global _last_eviction
+    if _last_eviction is not None and now - _last_eviction < EVICT_EVERY:
+        return
+    _last_eviction = now
+    db.query(models.IdempotencyKey).filter(models.IdempotencyKey.created_at < now - TTL).delete(
+        synchronize_session=False
+    )
+
+
+async def middleware(request: Request, call_next):
+    """Answer retried POSTs carrying an Idempotency-Key from the stored response.
+
+    The first request claims (key, route) with a pending row, runs normally,
+    and stores its status, headers and body; the commit of its own writes
+    marks the claim applied in the same transaction. Retries with the same body get the
+    stored response back without re-running the write; the same key with a
+    different body, or while the first request is still running, is refused.
+    Upload bodies are hashed as they stream rather than read up front.
+    """
+    key = request.headers.get(HEADER)
+    if request.method != "POST" or not key:
+        return await call_next(request)
+    if len(key) > MAX_KEY_LENGTH:
+        return JSONResponse({"detail": f"{HEADER} is too long"}, status_code=400)
+
+    app = request.app
+    route = f"{request.method} {request.url.path}"
+    digest = _digest(request)
+    streamed = _is_streamed(request)
+    request_hash = None
+    if streamed:
+        digest = _UploadDigest(digest, request.headers["content-type"])
+    else:
+        digest.update(await request.body())
+        request_hash = digest.hexdigest()
+    try:
+        record = await run_in_threadpool(_claim, app, key, route, request_hash or "", datetime.utcnow())
+    except IntegrityError:
+        return JSONResponse({"detail": "A request with this Idempotency-Key is in progress"}, status_code=409)
+    if record is not None:
+        if streamed and record.status_code is not None:
+            async for chunk in request.stream():
+                digest.update(chunk)
+            request_hash = digest.hexdigest()
+        if request_hash is not None and record.request_hash != request_hash:
+            return JSONResponse(
+                {"detail": f"{HEADER} was already used with a different request"}, status_code=422
+            )
+        if record.status_code is None:
+            detail = (
+                "A request with this Idempotency-Key was already applied; its response was not recorded"
+                if record.applied_at is not None
+                else "A request with this Idempotency-Key is in progress"
+            )
+            return JSONResponse({"detail": detail}, status_code=409)
+        headers = record.response_headers
+        if headers is None:
+            # Stored before whole header lists were kept.
+            headers = [["content-type", record.content_type]] if record.content_type else []
+        return _response(record.response_body, record.status_code, headers, (b"idempotent-replayed", b"true"))
+
+    body_read = _hash_through(request, digest) if streamed else {"complete": True}
+    token = _claimed.set((key, route))
+    try:
+        response = await call_next(request)
+        payload = b"".join([chunk async for chunk in response.body_iterator])
+    except Exception:
+        _claimed.reset(token)
+        await run_in_threadpool(_store, app, key, route, None, None, b"")
+        raise
+    _claimed.reset(token)
+    # A partly read upload cannot be matched against its retries; release it.
+    final_hash = digest.hexdigest() if body_read["complete"] else None
+    headers = _stored_headers(response.headers.raw)
+    await run_in_threadpool(_store, app, key, route, response.status_code, headers, payload, final_hash)
+    return _response(payload, response.status_code, headers)
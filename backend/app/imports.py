@@ -0,0 +1,233 @@
+import csv
+import io
+import re
+from itertools import islice
+
+from pydantic import ValidationError
+from sqlalchemy import func, insert, or_
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+
+CHUNK_SIZE = 2000
+MAX_REPORTED_ERRORS = 1000
+LEAD_STATUSES = {"new", "contacted", "qualified", "lost"}
+CUSTOMER_FIELDS = [
+    "name",
+    "company_name",
+    "phone",
+    "email",
+    "billing_address",
+    "service_address",
+    "notes",
+    "tags",
+]
+
+
+class InvalidImportFile(ValueError):
+    pass
+
+
+class ImportReport:
+    def __init__(self):
+        self.processed = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.errors = []
+
+    def reject(self, row: int, message: str, duplicate: bool = False):
+        if duplicate:
+            self.duplicates += 1
+        else:
+            self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "message": message})
+
+    def as_dict(self):
+        return {
+            "processed": self.processed,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "failed": self.failed,
+            "errors": sorted(self.errors, key=lambda error: error["row"]),
+            "errors_truncated": self.duplicates + self.failed > len(self.errors),
+        }
+
+
+def _rows(fileobj):
+    """Yield (line number, row) from a binary CSV stream, one line at a time."""
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(text)
+    if not reader.fieldnames:
+        raise InvalidImportFile("CSV file has no header row")
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    for row in reader:
+        yield reader.line_num, {
+            key: value.strip() for key, value in row.items() if key and isinstance(value, str) and value.strip()
+        }
+
+
+def _chunks(rows, size: int = CHUNK_SIZE):
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _describe(exc: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in exc.errors())
+
+
+def _run(db: Session, fileobj, model, process_chunk) -> dict:
+    report = ImportReport()
+    try:
+        for chunk in _chunks(_rows(fileobj)):
+            report.processed += len(chunk)
+            rows = process_chunk(db, chunk, report)
+            if rows:
+                db.execute(insert(model), rows)
+                report.inserted += len(rows)
+            db.commit()
+    except (UnicodeDecodeError, csv.Error) as exc:
+        db.rollback()
+        raise InvalidImportFile(f"Unreadable CSV after {report.inserted} rows were imported: {exc}") from exc
+    return report.as_dict()
+
+
+def _customer_chunk(db: Session, chunk, report: ImportReport):
+    candidates = []
+    for line, raw in chunk:
+        data = {key: raw[key] for key in CUSTOMER_FIELDS if key in raw}
+        if "tags" in data:
+            data["tags"] = [tag.strip() for tag in re.split(r"[;,|]", data["tags"]) if tag.strip()]
+        if "email" in data:
+            data["email"] = data["email"].lower()
+        try:
+            candidates.append((line, schemas.CustomerCreate(**data).model_dump()))
+        except ValidationError as exc:
+            report.reject(line, _describe(exc))
+
+    emails = {row["email"] for _, row in candidates if row["email"]}
+    phones = {row["phone"] for _, row in candidates if row["phone"]}
+    existing_emails, existing_phones = {}, {}
+    if emails or phones:
+        # Earlier chunks are already inserted, so this also catches duplicates across chunks.
+        lower_email = func.lower(models.Customer.email)
+        matches = db.query(models.Customer.id, lower_email, models.Customer.phone).filter(
+            or_(lower_email.in_(emails), models.Customer.phone.in_(phones))
+        )
+        for customer_id, email, phone in matches:
+            existing_emails.setdefault(email, f"customer #{customer_id}")
+            existing_phones.setdefault(phone, f"customer #{customer_id}")
+
+    rows = []
+    for line, row in candidates:
+        if row["email"] and row["email"] in existing_emails:
+            report.reject(line, f"Duplicate email of {existing_emails[row['email']]}", duplicate=True)
+        elif row["phone"] and row["phone"] in existing_phones:
+            report.reject(line, f"Duplicate phone of {existing_phones[row['phone']]}", duplicate=True)
+        else:
+            if row["email"]:
+                existing_emails[row["email"]] = f"row {line}"
+            if row["phone"]:
+                existing_phones[row["phone"]] = f"row {line}"
+            rows.append(row)
+    return rows
+
+
+def _lead_chunk(db: Session, chunk, report: ImportReport):
+    ids, emails, phones = set(), set(), set()
+    for _, raw in chunk:
+        if raw.get("customer_id", "").isdigit():
+            ids.add(int(raw["customer_id"]))
+        if raw.get("customer_email"):
+            emails.add(raw["customer_email"].lower())
+        if raw.get("customer_phone"):
+            phones.add(raw["customer_phone"])
+    by_id, by_email, by_phone = set(), {}, {}
+    if ids or emails or phones:
+        lower_email = func.lower(models.Customer.email)
+        matches = db.query(models.Customer.id, lower_email, models.Customer.phone).filter(
+            or_(
+                models.Customer.id.in_(ids),
+                lower_email.in_(emails),
+                models.Customer.phone.in_(phones),
+            )
+        )
+        for customer_id, email, phone in matches:
+            by_id.add(customer_id)
+            by_email.setdefault(email, customer_id)
+            by_phone.setdefault(phone, customer_id)
+
+    rows = []
+    for line, raw in chunk:
+        if raw.get("customer_id"):
+            customer_id = int(raw["customer_id"]) if raw["customer_id"].isdigit() else None
+            customer_id = customer_id if customer_id in by_id else None
+        else:
+            customer_id = by_email.get(raw.get("customer_email", "").lower()) or by_phone.get(
+                raw.get("customer_phone", "")
+            )
+        if customer_id is None:
+            report.reject(line, "Customer not found")
+            continue
+        data = {key: raw[key] for key in ["source", "status", "notes"] if key in raw}
+        try:
+            payload = schemas.LeadCreate(customer_id=customer_id, **data)
+        except ValidationError as exc:
+            report.reject(line, _describe(exc))
+            continue
+        if payload.status not in LEAD_STATUSES:
+            report.reject(line, "Invalid lead status")
+            continue
+        rows.append(payload.model_dump())
+    return rows
+
+
+def import_customers(db: Session, fileobj) -> dict:
+    """Import customers from CSV, skipping rows whose email or phone already exists."""
+    return _run(db, fileobj, models.Customer, _customer_chunk)
+
+
+def import_leads(db: Session, fileobj) -> dict:
+    """Import leads from CSV; rows reference customers by customer_id, customer_email or customer_phone."""
+    return _run(db, fileobj, models.Lead, _lead_chunk)
+
+
+def parse_payment_lines(raw_lines) -> tuple[list, list]:
+    """Validate (line number, dict) pairs as payments.
+
+    Returns (valid (line, PaymentCreate) pairs, rejected line results).
+    """
+    valid, rejected = [], []
+    for line, raw in raw_lines:
+        try:
+            valid.append((line, schemas.PaymentCreate(**raw)))
+        except ValidationError as exc:
+            rejected.append({"line": line, "status": "rejected", "message": _describe(exc)})
+    return valid, rejected
+
+
+def payment_file_lines(fileobj):
+    """Yield (line number, row) pairs from a deposit/lockbox CSV.
+
+    Expected columns: invoice_id, amount, and optionally method, paid_at, note.
+    """
+    try:
+        yield from _rows(fileobj)
+    except (UnicodeDecodeError, csv.Error) as exc:
+        raise InvalidImportFile(f"Unreadable CSV: {exc}") from exc
+
+
+def bank_statement_lines(fileobj):
+    """Yield (line number, row) pairs from a bank export CSV.
+
+    Expected columns: date and amount (or credit/deposit), and optionally a
+    description, memo or payee.
+    """
+    try:
+        yield from _rows(fileobj)
+    except (UnicodeDecodeError, csv.Error) as exc:
+        raise InvalidImportFile(f"Unreadable CSV: {exc}") from exc
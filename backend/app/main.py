@@ -1,17 +1,49 @@
+import json
+from contextlib import asynccontextmanager
 from datetime import date, datetime, timedelta
 
-from fastapi import Depends, FastAPI, HTTPException, Query, status
+from fastapi import (
+    Depends,
+    FastAPI,
+    File,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
+from pydantic import ValidationError
 from sqlalchemy import func
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from . import ai, crud, models, schemas
-from .db import get_db
+from . import billing, crud, documents, durations, events, ical, idempotency, imports, models, outbox, reconcile, recurring, reports, rollups, schemas, snapshots, storage, sync, tasks
+from .db import after_commit, get_db, separate_session
 from .security import create_access_token, get_current_user, hash_password, require_roles, verify_password
 
-app = FastAPI(title="ArborSoftAI Core")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    durations.start_background_refresh()
+    outbox.start_dispatcher()
+    tasks.worker.start()
+    rollups.start_background_refresh()
+    yield
+    rollups.stop_background_refresh()
+    tasks.worker.stop()
+    outbox.stop_dispatcher()
+    documents.shutdown()
+    durations.stop_background_refresh()
+
+
+app = FastAPI(title="ArborSoftAI Core", lifespan=lifespan)
+
+app.middleware("http")(idempotency.middleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -33,6 +65,61 @@ def validate_status(value: str, allowed: set[str], field_name: str):
         raise HTTPException(status_code=400, detail=f"Invalid {field_name} status")
 
 
+def validate_commission_rules(rules: schemas.CommissionRules | None):
+    if rules is None:
+        return
+    if rules.basis not in reports.COMMISSION_BASES:
+        raise HTTPException(status_code=400, detail=f"basis must be one of {', '.join(reports.COMMISSION_BASES)}")
+    if any(tier.threshold < 0 or not 0 <= tier.rate <= 1 for tier in rules.tiers):
+        raise HTTPException(status_code=400, detail="Tier thresholds must be zero or more and rates between 0 and 1")
+
+
+def pdf_response(rendered: tuple[str, bytes | None], filename: str):
+    key, data = rendered
+    headers = {"ETag": f'"{key}"', "Cache-Control": "no-cache"}
+    if data is None:
+        return Response(status_code=304, headers=headers)
+    headers["Content-Disposition"] = f'inline; filename="{filename}"'
+    return Response(data, media_type="application/pdf", headers=headers)
+
+
+def file_response(path, media_type: str, key: str, request: Request):
+    """Serve an immutable stored file; FileResponse (zero-copy where the server supports it) or a 206 range.
+
+    Raster images are shown inline; every other type is sent as a download, never sniffed.
+    """
+    etag = f'"{key}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "X-Content-Type-Options": "nosniff",
+    }
+    if media_type not in storage.INLINE_TYPES:
+        headers["Content-Disposition"] = "attachment"
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    size = path.stat().st_size
+    try:
+        byte_range = storage.parse_range(request.headers.get("range"), size)
+    except storage.RangeNotSatisfiable:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if byte_range is None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(storage.iter_file(path, start, end), status_code=206, media_type=media_type, headers=headers)
+
+
+def report_response(report: str, params: dict, schema, compute, ttl: int | None = None):
+    """Serve a report from the result cache, computing and serializing it through `schema` on a miss."""
+    body, hit = reports.cache.get_or_compute(
+        report, params, lambda: schema.model_validate(compute()).model_dump_json().encode(), ttl=ttl
+    )
+    return Response(body, media_type="application/json", headers={"X-Cache": "HIT" if hit else "MISS"})
+
+
 @app.get("/health")
 def health():
     return {"ok": True}
@@ -97,9 +184,12 @@ def create_customer(payload: schemas.CustomerCreate, db: Session = Depends(get_d
 def list_customers(
     q: str | None = None,
     tag: str | None = None,
+    sort: str | None = None,
     db: Session = Depends(get_db),
 ):
-    return crud.list_customers(db, q=q, tag=tag)
+    if sort is not None and sort not in crud.CUSTOMER_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(crud.CUSTOMER_SORTS)}")
+    return crud.list_customers(db, q=q, tag=tag, sort=sort)
 
 
 @app.get("/customers/{customer_id}", response_model=schemas.CustomerOut)
@@ -144,6 +234,23 @@ def update_lead(lead_id: int, payload: schemas.LeadUpdate, db: Session = Depends
     return crud.update_lead(db, lead, **updates)
 
 
+# Imports
+@app.post("/import/customers", response_model=schemas.ImportResultOut)
+def import_customers(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    try:
+        return imports.import_customers(db, file.file)
+    except imports.InvalidImportFile as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+@app.post("/import/leads", response_model=schemas.ImportResultOut)
+def import_leads(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    try:
+        return imports.import_leads(db, file.file)
+    except imports.InvalidImportFile as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
 # Estimates
 @app.post("/estimates", response_model=schemas.EstimateOut)
 def create_estimate(payload: schemas.EstimateCreate, db: Session = Depends(get_db)):
@@ -175,6 +282,14 @@ def get_estimate(estimate_id: int, db: Session = Depends(get_db)):
     return get_or_404(db, models.Estimate, estimate_id, "Estimate")
 
 
+@app.get("/estimates/{estimate_id}/pdf")
+def estimate_pdf(estimate_id: int, request: Request, db: Session = Depends(get_db)):
+    rendered = documents.estimate_pdf(db, estimate_id, request.headers.get("if-none-match"))
+    if rendered is None:
+        raise HTTPException(status_code=404, detail="Estimate not found")
+    return pdf_response(rendered, f"estimate-{estimate_id}.pdf")
+
+
 @app.put("/estimates/{estimate_id}", response_model=schemas.EstimateOut)
 def update_estimate(estimate_id: int, payload: schemas.EstimateUpdate, db: Session = Depends(get_db)):
     estimate = get_or_404(db, models.Estimate, estimate_id, "Estimate")
@@ -201,13 +316,22 @@ def convert_estimate_to_job(
         if not estimate.approved_at:
             estimate.approved_at = datetime.utcnow()
     validate_status(payload.status, {"scheduled", "in_progress", "completed", "canceled"}, "job")
+    if payload.job_type_id:
+        get_or_404(db, models.JobType, payload.job_type_id, "Job type")
+    scheduled_end = payload.scheduled_end
+    if payload.scheduled_start and not scheduled_end:
+        durations.model.ensure_fresh(db)
+        duration = durations.model.estimate(payload.job_type_id, payload.crew_id)
+        if duration:
+            scheduled_end = payload.scheduled_start + timedelta(hours=duration["p50_hours"])
     job_payload = schemas.JobCreate(
         customer_id=estimate.customer_id,
         estimate_id=estimate.id,
         status=payload.status,
         scheduled_start=payload.scheduled_start,
-        scheduled_end=payload.scheduled_end,
+        scheduled_end=scheduled_end,
         crew_id=payload.crew_id,
+        job_type_id=payload.job_type_id,
         service_address=estimate.service_address,
         total=estimate.total,
         notes=payload.notes,
@@ -245,8 +369,6 @@ def approve_estimate_and_invoice(
         db.add(job)
         db.flush()
     if job.invoice:
-        db.commit()
-        db.refresh(job.invoice)
         return job.invoice
 
     subtotal = max(estimate.total - estimate.tax, 0.0)
@@ -263,8 +385,8 @@ def approve_estimate_and_invoice(
         notes=estimate.notes,
     )
     db.add(invoice)
-    db.commit()
-    db.refresh(invoice)
+    db.flush()
+    outbox.invoice_issued(db, [invoice])
     return invoice
 
 
@@ -311,6 +433,34 @@ def list_jobs(
     )
 
 
+@app.post("/jobs/bulk", response_model=schemas.JobBulkUpdateOut)
+def bulk_update_jobs(payload: schemas.JobBulkUpdate, db: Session = Depends(get_db)):
+    job_ids = list(dict.fromkeys(payload.job_ids))
+    if not job_ids:
+        raise HTTPException(status_code=400, detail="No jobs selected")
+    found = {job_id for (job_id,) in db.query(models.Job.id).filter(models.Job.id.in_(job_ids))}
+    if len(found) != len(job_ids):
+        raise HTTPException(status_code=404, detail="Job not found")
+    if payload.status:
+        validate_status(payload.status, {"scheduled", "in_progress", "completed", "canceled"}, "job")
+    if payload.crew_id:
+        get_or_404(db, models.Crew, payload.crew_id, "Crew")
+    jobs, conflicts, applied = crud.bulk_update_jobs(
+        db,
+        job_ids,
+        shift_days=payload.shift_days,
+        crew_id=payload.crew_id,
+        status=payload.status,
+        allow_conflicts=payload.allow_conflicts,
+    )
+    if not applied:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Schedule conflicts", "conflicts": conflicts},
+        )
+    return schemas.JobBulkUpdateOut(applied=applied, jobs=jobs, conflicts=conflicts)
+
+
 @app.get("/jobs/{job_id}", response_model=schemas.JobOut)
 def get_job(job_id: int, db: Session = Depends(get_db)):
     return get_or_404(db, models.Job, job_id, "Job")
@@ -349,8 +499,8 @@ def add_job_task(job_id: int, payload: schemas.JobTaskCreate, db: Session = Depe
         sort_order=payload.sort_order,
     )
     db.add(task)
-    db.commit()
-    db.refresh(task)
+    db.flush()
+    events.publish_task(job, task.id, "created", payload.model_dump(), db=db)
     return task
 
 
@@ -359,10 +509,11 @@ def update_job_task(job_id: int, task_id: int, payload: schemas.JobTaskUpdate, d
     task = get_or_404(db, models.JobTask, task_id, "Task")
     if task.job_id != job_id:
         raise HTTPException(status_code=400, detail="Task does not belong to job")
-    for key, value in payload.model_dump(exclude_unset=True).items():
+    changes = payload.model_dump(exclude_unset=True)
+    for key, value in changes.items():
         setattr(task, key, value)
-    db.commit()
-    db.refresh(task)
+    db.flush()
+    events.publish_task(task.job, task.id, "updated", changes, db=db)
     return task
 
 
@@ -371,8 +522,9 @@ def delete_job_task(job_id: int, task_id: int, db: Session = Depends(get_db)):
     task = get_or_404(db, models.JobTask, task_id, "Task")
     if task.job_id != job_id:
         raise HTTPException(status_code=400, detail="Task does not belong to job")
+    job = task.job
     db.delete(task)
-    db.commit()
+    events.publish_task(job, task_id, "deleted", db=db)
     return {"ok": True}
 
 
@@ -389,9 +541,8 @@ def assign_job_equipment(job_id: int, payload: schemas.JobEquipmentAssign, db: S
         .first()
     )
     if not existing:
-        db.add(models.JobEquipment(job_id=job.id, equipment_id=payload.equipment_id))
-        db.commit()
-    db.refresh(job)
+        job.equipment_links.append(models.JobEquipment(equipment_id=payload.equipment_id))
+        db.flush()
     return job
 
 
@@ -404,9 +555,8 @@ def remove_job_equipment(job_id: int, equipment_id: int, db: Session = Depends(g
         .first()
     )
     if link:
-        db.delete(link)
-        db.commit()
-    db.refresh(job)
+        job.equipment_links.remove(link)
+        db.flush()
     return job
 
 
@@ -416,9 +566,9 @@ def complete_job(job_id: int, payload: schemas.JobCompleteRequest, db: Session =
     job.status = "completed"
     if not job.completed_at:
         job.completed_at = datetime.utcnow()
+    changes = {"status": job.status, "completed_at": job.completed_at}
     if job.invoice:
-        db.commit()
-        db.refresh(job.invoice)
+        events.publish_job(job, "updated", changes, db=db)
         return job.invoice
     subtotal = job.total
     tax = payload.invoice_tax
@@ -435,11 +585,96 @@ def complete_job(job_id: int, payload: schemas.JobCompleteRequest, db: Session =
         notes=payload.invoice_notes,
     )
     db.add(invoice)
-    db.commit()
-    db.refresh(invoice)
+    db.flush()
+    outbox.invoice_issued(db, [invoice])
+    events.publish_job(job, "updated", changes, db=db)
     return invoice
 
 
+# Job durations
+@app.get("/durations/estimate", response_model=schemas.DurationEstimateOut)
+def estimate_job_duration(
+    job_type_id: int | None = None,
+    crew_id: int | None = None,
+    db: Session = Depends(get_db),
+):
+    durations.model.ensure_fresh(db)
+    estimate = durations.model.estimate(job_type_id, crew_id) or {}
+    return schemas.DurationEstimateOut(
+        job_type_id=job_type_id,
+        crew_id=crew_id,
+        trained_at=durations.model.trained_at,
+        **estimate,
+    )
+
+
+@app.post("/durations/retrain", response_model=schemas.DurationEstimateOut)
+def retrain_job_durations(db: Session = Depends(get_db)):
+    durations.model.refresh(db, full=True)
+    estimate = durations.model.estimate() or {}
+    return schemas.DurationEstimateOut(trained_at=durations.model.trained_at, **estimate)
+
+
+# Recurring jobs
+def validate_rrule(rule: str):
+    try:
+        recurring.parse_rule(rule)
+    except recurring.InvalidRule:
+        raise HTTPException(status_code=400, detail="Invalid recurrence rule")
+
+
+@app.post("/recurring-jobs", response_model=schemas.RecurringJobTemplateOut)
+def create_recurring_job(payload: schemas.RecurringJobTemplateCreate, db: Session = Depends(get_db)):
+    customer = get_or_404(db, models.Customer, payload.customer_id, "Customer")
+    if payload.crew_id:
+        get_or_404(db, models.Crew, payload.crew_id, "Crew")
+    if payload.sales_rep_id:
+        get_or_404(db, models.SalesRep, payload.sales_rep_id, "Sales rep")
+    if payload.job_type_id:
+        get_or_404(db, models.JobType, payload.job_type_id, "Job type")
+    validate_rrule(payload.rrule)
+    if not payload.service_address:
+        payload = payload.model_copy(update={"service_address": customer.service_address})
+    return crud.create_recurring_template(db, payload)
+
+
+@app.get("/recurring-jobs", response_model=list[schemas.RecurringJobTemplateOut])
+def list_recurring_jobs(customer_id: int | None = None, active: bool | None = None, db: Session = Depends(get_db)):
+    return crud.list_recurring_templates(db, customer_id=customer_id, active=active)
+
+
+@app.post("/recurring-jobs/materialize", response_model=schemas.MaterializeOut)
+def materialize_recurring_jobs(
+    horizon_days: int = Query(recurring.DEFAULT_HORIZON_DAYS, ge=1, le=3660),
+    db: Session = Depends(get_db),
+):
+    return recurring.materialize(db, horizon_days=horizon_days)
+
+
+@app.get("/recurring-jobs/{template_id}", response_model=schemas.RecurringJobTemplateOut)
+def get_recurring_job(template_id: int, db: Session = Depends(get_db)):
+    return get_or_404(db, models.RecurringJobTemplate, template_id, "Recurring job")
+
+
+@app.put("/recurring-jobs/{template_id}", response_model=schemas.RecurringJobTemplateOut)
+def update_recurring_job(
+    template_id: int,
+    payload: schemas.RecurringJobTemplateUpdate,
+    db: Session = Depends(get_db),
+):
+    template = get_or_404(db, models.RecurringJobTemplate, template_id, "Recurring job")
+    updates = payload.model_dump(exclude_unset=True)
+    if updates.get("rrule"):
+        validate_rrule(updates["rrule"])
+    if updates.get("crew_id"):
+        get_or_404(db, models.Crew, updates["crew_id"], "Crew")
+    if updates.get("sales_rep_id"):
+        get_or_404(db, models.SalesRep, updates["sales_rep_id"], "Sales rep")
+    if updates.get("job_type_id"):
+        get_or_404(db, models.JobType, updates["job_type_id"], "Job type")
+    return crud.update_recurring_template(db, template, **updates)
+
+
 # Invoices
 @app.post("/invoices", response_model=schemas.InvoiceOut)
 def create_invoice(payload: schemas.InvoiceCreate, db: Session = Depends(get_db)):
@@ -468,6 +703,49 @@ def list_invoices(
     return crud.list_invoices(db, q=q, status=status_filter, customer_id=customer_id, job_id=job_id)
 
 
+@app.post("/billing/run", response_model=schemas.BillingRunOut | schemas.TaskOut)
+def run_billing(
+    payload: schemas.BillingRunRequest,
+    response: Response,
+    background: bool = False,
+    db: Session = Depends(get_db),
+):
+    if payload.due_in_days is not None and payload.due_in_days < 0:
+        raise HTTPException(status_code=400, detail="due_in_days must be zero or more")
+    if background:
+        response.status_code = status.HTTP_202_ACCEPTED
+        return tasks.enqueue(db, "billing.run", payload.model_dump(), priority="low")
+    return billing.run(
+        db,
+        dry_run=payload.dry_run,
+        completed_before=payload.completed_before,
+        due_in_days=payload.due_in_days,
+    )
+
+
+@app.get("/invoices/pdf")
+def invoices_pdf_zip(month: str = Query(..., pattern=r"^\d{4}-\d{2}$"), db: Session = Depends(get_db)):
+    year, month_number = (int(part) for part in month.split("-"))
+    if not 1 <= month_number <= 12:
+        raise HTTPException(status_code=400, detail="Invalid month")
+    start = datetime(year, month_number, 1)
+    end = datetime(year + month_number // 12, month_number % 12 + 1, 1)
+    snapshots = documents.month_invoice_snapshots(db, start, end)
+    return StreamingResponse(
+        documents.stream_zip(snapshots),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="invoices-{month}.zip"'},
+    )
+
+
+@app.get("/invoices/{invoice_id}/pdf")
+def invoice_pdf(invoice_id: int, request: Request, db: Session = Depends(get_db)):
+    rendered = documents.invoice_pdf(db, invoice_id, request.headers.get("if-none-match"))
+    if rendered is None:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    return pdf_response(rendered, f"invoice-{invoice_id}.pdf")
+
+
 @app.get("/invoices/{invoice_id}", response_model=schemas.InvoiceOut)
 def get_invoice(invoice_id: int, db: Session = Depends(get_db)):
     return get_or_404(db, models.Invoice, invoice_id, "Invoice")
@@ -495,6 +773,40 @@ def add_payment(invoice_id: int, payload: schemas.PaymentCreate, db: Session = D
     return invoice
 
 
+@app.post("/payments/batch", response_model=schemas.PaymentBatchOut)
+def post_payment_batch(payload: schemas.PaymentBatchIn, db: Session = Depends(get_db)):
+    lines, rejected = imports.parse_payment_lines(enumerate(payload.payments, start=1))
+    return crud.record_payments_batch(db, lines, rejected)
+
+
+@app.post("/payments/batch/upload", response_model=schemas.PaymentBatchOut)
+def upload_payment_batch(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    try:
+        lines, rejected = imports.parse_payment_lines(imports.payment_file_lines(file.file))
+    except imports.InvalidImportFile as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return crud.record_payments_batch(db, lines, rejected)
+
+
+# Bank reconciliation
+@app.post("/reconciliation/statements", response_model=schemas.ReconciliationOut)
+def reconcile_statement(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    statement = reconcile.statement_digest(file.file)
+    try:
+        deposits, rejected = reconcile.parse_statement(imports.bank_statement_lines(file.file))
+    except imports.InvalidImportFile as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return {**reconcile.propose(db, deposits, statement), "rejected": rejected}
+
+
+@app.post("/reconciliation/approve", response_model=schemas.PaymentBatchOut)
+def approve_reconciliation(payload: schemas.ReconciliationApproveIn, db: Session = Depends(get_db)):
+    try:
+        return reconcile.approve(db, payload.statement, payload.matches, payload.method)
+    except reconcile.AlreadyReconciled as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+
+
 # Crews
 @app.post("/crews", response_model=schemas.CrewOut)
 def create_crew(payload: schemas.CrewCreate, db: Session = Depends(get_db)):
@@ -518,14 +830,16 @@ def update_crew(crew_id: int, payload: schemas.CrewUpdate, db: Session = Depends
     crew = get_or_404(db, models.Crew, crew_id, "Crew")
     if payload.type and payload.type not in {"GTC", "PHC"}:
         raise HTTPException(status_code=400, detail="Invalid crew type")
-    return crud.update_crew(db, crew, payload)
+    crew = crud.update_crew(db, crew, payload)
+    after_commit(db, lambda: ical.invalidate(crew_id))
+    return crew
 
 
 @app.delete("/crews/{crew_id}")
 def delete_crew(crew_id: int, db: Session = Depends(get_db)):
     crew = get_or_404(db, models.Crew, crew_id, "Crew")
     db.delete(crew)
-    db.commit()
+    after_commit(db, lambda: ical.invalidate(crew_id))
     return {"ok": True}
 
 
@@ -559,13 +873,13 @@ def update_equipment(equipment_id: int, payload: schemas.EquipmentUpdate, db: Se
 def delete_equipment(equipment_id: int, db: Session = Depends(get_db)):
     equipment = get_or_404(db, models.Equipment, equipment_id, "Equipment")
     db.delete(equipment)
-    db.commit()
     return {"ok": True}
 
 
 # Sales reps
 @app.post("/sales-reps", response_model=schemas.SalesRepOut)
 def create_sales_rep(payload: schemas.SalesRepCreate, db: Session = Depends(get_db)):
+    validate_commission_rules(payload.commission_rules)
     return crud.create_sales_rep(db, payload)
 
 
@@ -582,6 +896,7 @@ def get_sales_rep(sales_rep_id: int, db: Session = Depends(get_db)):
 @app.put("/sales-reps/{sales_rep_id}", response_model=schemas.SalesRepOut)
 def update_sales_rep(sales_rep_id: int, payload: schemas.SalesRepUpdate, db: Session = Depends(get_db)):
     sales_rep = get_or_404(db, models.SalesRep, sales_rep_id, "Sales rep")
+    validate_commission_rules(payload.commission_rules)
     return crud.update_sales_rep(db, sales_rep, payload)
 
 
@@ -589,7 +904,6 @@ def update_sales_rep(sales_rep_id: int, payload: schemas.SalesRepUpdate, db: Ses
 def delete_sales_rep(sales_rep_id: int, db: Session = Depends(get_db)):
     sales_rep = get_or_404(db, models.SalesRep, sales_rep_id, "Sales rep")
     db.delete(sales_rep)
-    db.commit()
     return {"ok": True}
 
 
@@ -622,7 +936,6 @@ def update_job_type(job_type_id: int, payload: schemas.JobTypeUpdate, db: Sessio
 def delete_job_type(job_type_id: int, db: Session = Depends(get_db)):
     job_type = get_or_404(db, models.JobType, job_type_id, "Job type")
     db.delete(job_type)
-    db.commit()
     return {"ok": True}
 
 
@@ -637,6 +950,60 @@ def list_attachments(entity_type: str, entity_id: int, db: Session = Depends(get
     return crud.list_attachments(db, entity_type, entity_id)
 
 
+def _attach_upload(db: Session, fields: dict[str, str], upload: storage.BlobWriter):
+    try:
+        payload = schemas.AttachmentCreate(
+            entity_type=fields.get("entity_type"),
+            entity_id=fields.get("entity_id"),
+            url=f"/attachments/files/{upload.sha256}",
+            caption=fields.get("caption") or None,
+        )
+    except ValidationError as exc:
+        raise HTTPException(status_code=422, detail=exc.errors(include_url=False))
+    blob, created = storage.store(db, upload)
+    if created and blob.previews == "pending":
+        tasks.enqueue(db, "attachments.previews", {"sha256": blob.sha256}, priority="low")
+    return crud.create_attachment(db, payload, sha256=upload.sha256, filename=upload.filename)
+
+
+@app.post("/attachments/upload", response_model=schemas.AttachmentOut)
+async def upload_attachment(request: Request, db: Session = Depends(get_db)):
+    """Multipart upload with fields entity_type, entity_id, caption and one file part."""
+    try:
+        fields, files = await storage.receive_upload(request)
+    except storage.UploadError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    try:
+        if len(files) != 1:
+            raise HTTPException(status_code=400, detail="Upload exactly one file")
+        return await run_in_threadpool(_attach_upload, db, fields, files[0])
+    except Exception:
+        # Uploads that never reached storage.store leave no temp file behind.
+        for upload in files:
+            upload.close()
+        raise
+
+
+@app.get("/attachments/files/{sha256}")
+def download_attachment_file(
+    sha256: str, request: Request, variant: str = "original", db: Session = Depends(get_db)
+):
+    if variant != "original" and variant not in storage.VARIANTS:
+        raise HTTPException(status_code=400, detail="Invalid variant")
+    blob = db.query(models.Blob).filter(models.Blob.sha256 == sha256).first()
+    if not blob:
+        raise HTTPException(status_code=404, detail="File not found")
+    if variant == "original":
+        path, media_type = storage.blob_path(sha256), blob.content_type
+    elif blob.previews == "ready":
+        path, media_type = storage.variant_path(sha256, variant), "image/jpeg"
+    else:
+        raise HTTPException(status_code=404, detail="Preview not available")
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="File not found")
+    return file_response(path, media_type, f"{sha256}-{variant}", request)
+
+
 # Calendar
 @app.get("/calendar", response_model=list[schemas.JobOut])
 def calendar(
@@ -647,15 +1014,177 @@ def calendar(
     return crud.list_jobs(db, start=start, end=end)
 
 
+@app.get("/calendar/crews/{crew_id}.ics")
+def crew_calendar_feed(crew_id: int, request: Request, since: str | None = None, db: Session = Depends(get_db)):
+    media_type = "text/calendar; charset=utf-8"
+    if since:
+        try:
+            since_ts = sync.decode_token(since)
+        except sync.InvalidSyncToken:
+            raise HTTPException(status_code=400, detail="Invalid sync token")
+        crew = get_or_404(db, models.Crew, crew_id, "Crew")
+        token = sync.next_token()
+        return StreamingResponse(
+            ical.stream_delta(db, crew, since_ts), media_type=media_type, headers={"X-Sync-Token": token}
+        )
+    if_none_match = request.headers.get("if-none-match")
+    feed = ical.get_feed(db, crew_id, if_none_match)
+    if feed is None:
+        raise HTTPException(status_code=404, detail="Crew not found")
+    headers = {"ETag": feed.etag, "X-Sync-Token": feed.token, "Cache-Control": "no-cache"}
+    if if_none_match == feed.etag:
+        return Response(status_code=304, headers=headers)
+    return StreamingResponse(feed.stream(), media_type=media_type, headers=headers)
+
+
+# Sync
+@app.get("/sync", response_model=schemas.SyncOut)
+def sync_changes(since: str | None = None, db: Session = Depends(get_db)):
+    try:
+        since_ts = sync.decode_token(since) if since else None
+    except sync.InvalidSyncToken:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    token, changes, deleted = sync.changes_since(db, since_ts)
+    return schemas.SyncOut(token=token, deleted=deleted, **changes)
+
+
+# Events
+def _event_subscription_filters(
+    topics: str | None = None,
+    crew_id: int | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+):
+    return {
+        "topics": {t.strip() for t in topics.split(",") if t.strip()} if topics else None,
+        "crew_id": crew_id,
+        "start": start,
+        "end": end,
+    }
+
+
+@app.get("/events")
+async def event_stream(request: Request, filters: dict = Depends(_event_subscription_filters)):
+    subscription = events.bus.subscribe(**filters)
+
+    async def stream():
+        try:
+            while not await request.is_disconnected():
+                event = await subscription.next_event(timeout=events.KEEPALIVE_SECONDS)
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['topic']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            events.bus.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.websocket("/events")
+async def event_socket(websocket: WebSocket, filters: dict = Depends(_event_subscription_filters)):
+    subscription = events.bus.subscribe(**filters)
+    await websocket.accept()
+    try:
+        while True:
+            event = await subscription.next_event(timeout=events.KEEPALIVE_SECONDS)
+            await websocket.send_json(event if event is not None else {"topic": "keepalive"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        events.bus.unsubscribe(subscription)
+
+
+# Outbox
+@app.get("/outbox", response_model=list[schemas.OutboxMessageOut])
+def list_outbox(
+    status_filter: str | None = Query(None, alias="status"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+):
+    query = db.query(models.OutboxMessage)
+    if status_filter:
+        validate_status(status_filter, {"pending", "sent", "failed", "skipped"}, "outbox")
+        query = query.filter(models.OutboxMessage.status == status_filter)
+    return query.order_by(models.OutboxMessage.id.desc()).limit(limit).all()
+
+
+@app.post("/outbox/dispatch", response_model=schemas.OutboxDispatchOut)
+def dispatch_outbox(db: Session = Depends(get_db)):
+    # Dispatch commits its claim before delivering, so it runs outside the request's unit of work.
+    session = separate_session(db)
+    try:
+        return outbox.dispatch_once(session)
+    finally:
+        session.close()
+
+
+# Background tasks
+@app.post("/tasks", response_model=schemas.TaskOut, status_code=status.HTTP_202_ACCEPTED)
+def enqueue_task(payload: schemas.TaskCreate, db: Session = Depends(get_db)):
+    if payload.priority not in tasks.PRIORITIES:
+        raise HTTPException(status_code=400, detail="Invalid task priority")
+    if payload.max_attempts < 1:
+        raise HTTPException(status_code=400, detail="max_attempts must be at least 1")
+    try:
+        return tasks.enqueue(db, payload.name, payload.payload, payload.priority, payload.max_attempts)
+    except tasks.UnknownTask:
+        raise HTTPException(status_code=400, detail="Unknown task")
+    except ValidationError as exc:
+        raise HTTPException(status_code=422, detail=exc.errors(include_url=False))
+
+
+@app.get("/tasks", response_model=list[schemas.TaskOut])
+def list_tasks(
+    status_filter: str | None = Query(None, alias="status"),
+    name: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+):
+    query = db.query(models.BackgroundTask)
+    if status_filter:
+        validate_status(status_filter, {"queued", "running", "succeeded", "failed"}, "task")
+        query = query.filter(models.BackgroundTask.status == status_filter)
+    if name:
+        query = query.filter(models.BackgroundTask.name == name)
+    return query.order_by(models.BackgroundTask.id.desc()).limit(limit).all()
+
+
+@app.get("/tasks/{task_id}", response_model=schemas.TaskOut)
+def get_task(task_id: int, db: Session = Depends(get_db)):
+    return get_or_404(db, models.BackgroundTask, task_id, "Task")
+
+
+@app.get("/tasks/{task_id}/result")
+def get_task_result(task_id: int, db: Session = Depends(get_db)):
+    task = get_or_404(db, models.BackgroundTask, task_id, "Task")
+    if task.status == "failed":
+        raise HTTPException(status_code=409, detail=f"Task failed: {task.error}")
+    if task.status != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Task is {task.status}")
+    return task.result
+
+
 # Reports
 @app.get("/reports/revenue", response_model=schemas.RevenueReportOut)
-def revenue_report(start: datetime, end: datetime, db: Session = Depends(get_db)):
-    total = (
-        db.query(func.coalesce(func.sum(models.Payment.amount), 0.0))
-        .filter(models.Payment.paid_at >= start, models.Payment.paid_at <= end)
-        .scalar()
-    )
-    return schemas.RevenueReportOut(start=start, end=end, total_revenue=total or 0.0)
+def revenue_report(
+    start: datetime,
+    end: datetime,
+    granularity: str | None = None,
+    breakdown: str | None = None,
+    db: Session = Depends(get_db),
+):
+    params = {"start": start, "end": end, "granularity": granularity, "breakdown": breakdown}
+    try:
+        return report_response(
+            "revenue", params, schemas.RevenueReportOut, lambda: reports.revenue(db, **params)
+        )
+    except reports.InvalidReport as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
 
 @app.get("/reports/outstanding-invoices", response_model=list[schemas.OutstandingInvoiceOut])
@@ -676,38 +1205,95 @@ def outstanding_invoices(db: Session = Depends(get_db)):
     return results
 
 
+@app.get("/reports/ar-aging", response_model=schemas.AgingReportOut)
+def ar_aging_report(
+    as_of: datetime | None = None,
+    basis: str = "due",
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+):
+    try:
+        return reports.aging(db, as_of=as_of, basis=basis, limit=limit, offset=offset)
+    except reports.InvalidReport as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+@app.get("/reports/funnel", response_model=schemas.FunnelReportOut)
+def funnel_report(start: datetime, end: datetime, db: Session = Depends(get_db)):
+    params = {"start": start, "end": end}
+    return report_response("funnel", params, schemas.FunnelReportOut, lambda: reports.funnel(db, **params))
+
+
+@app.get("/reports/utilization", response_model=schemas.UtilizationReportOut)
+def utilization_report(
+    start: date,
+    end: date,
+    hours_per_day: float = Query(8.0, gt=0, le=24),
+    db: Session = Depends(get_db),
+):
+    params = {"start": start, "end": end, "hours_per_day": hours_per_day}
+    try:
+        return report_response(
+            "utilization", params, schemas.UtilizationReportOut, lambda: reports.utilization(db, **params)
+        )
+    except reports.InvalidReport as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
 @app.get("/reports/estimate-conversion", response_model=schemas.EstimateConversionOut)
 def estimate_conversion(start: datetime, end: datetime, db: Session = Depends(get_db)):
-    total = (
-        db.query(func.count(models.Estimate.id))
-        .filter(models.Estimate.created_at >= start, models.Estimate.created_at <= end)
-        .scalar()
+    params = {"start": start, "end": end}
+    return report_response(
+        "estimate_conversion",
+        params,
+        schemas.EstimateConversionOut,
+        lambda: reports.estimate_conversion(db, **params),
     )
-    approved = (
-        db.query(func.count(models.Estimate.id))
-        .filter(
-            models.Estimate.created_at >= start,
-            models.Estimate.created_at <= end,
-            models.Estimate.status == "approved",
+
+
+@app.get("/reports/sales-reps", response_model=schemas.SalesRepReportOut)
+def sales_rep_report(start: datetime, end: datetime, rank_by: str = "collected", db: Session = Depends(get_db)):
+    params = {"start": start, "end": end, "rank_by": rank_by}
+    closed = reports.closed_period(end)
+    try:
+        return report_response(
+            "sales_reps",
+            params,
+            schemas.SalesRepReportOut,
+            lambda: reports.sales_reps(db, **params),
+            ttl=reports.CLOSED_PERIOD_CACHE_SECONDS if closed else None,
         )
-        .scalar()
-    )
-    total = total or 0
-    approved = approved or 0
-    rate = (approved / total) if total else 0.0
-    return schemas.EstimateConversionOut(
-        start=start,
-        end=end,
-        total_estimates=total,
-        approved_estimates=approved,
-        conversion_rate=rate,
-    )
+    except reports.InvalidReport as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+@app.post("/reports/rollups/refresh", response_model=schemas.TaskOut, status_code=202)
+def refresh_rollups(full: bool = False, db: Session = Depends(get_db)):
+    return tasks.enqueue(db, "rollups.refresh", {"full": full}, priority="low")
+
+
+# Analytics snapshots
+@app.post("/exports/snapshots", response_model=schemas.TaskOut, status_code=202)
+def export_snapshot(payload: schemas.SnapshotExportRequest, db: Session = Depends(get_db)):
+    if payload.format is not None and payload.format not in snapshots.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(snapshots.FORMATS)}")
+    return tasks.enqueue(db, "snapshots.export", payload.model_dump(), priority="low")
+
+
+@app.get("/exports/snapshots", response_model=schemas.SnapshotManifestOut)
+def snapshot_manifest():
+    return snapshots.read_manifest()
 
 
 # Dashboard
 @app.get("/dashboard", response_model=schemas.DashboardOut)
 def dashboard(db: Session = Depends(get_db)):
     today = date.today()
+    return report_response("dashboard", {"today": today}, schemas.DashboardOut, lambda: _dashboard(db, today))
+
+
+def _dashboard(db: Session, today: date) -> schemas.DashboardOut:
     tomorrow = today + timedelta(days=1)
     month_start = date(today.year, today.month, 1)
     todays_jobs = (
@@ -730,21 +1316,11 @@ def dashboard(db: Session = Depends(get_db)):
         .filter(models.Invoice.status.in_(["unpaid", "partial"]))
         .scalar()
     )
-    month_revenue = (
-        db.query(func.coalesce(func.sum(models.Payment.amount), 0.0))
-        .filter(models.Payment.paid_at >= month_start)
-        .scalar()
-    )
-    jobs_completed = (
-        db.query(func.count(models.Job.id))
-        .filter(models.Job.status == "completed", models.Job.completed_at >= month_start)
-        .scalar()
-    )
-    avg_job_value = (
-        db.query(func.coalesce(func.avg(models.Job.total), 0.0))
-        .filter(models.Job.status == "completed", models.Job.completed_at >= month_start)
-        .scalar()
-    )
+    month_start_at = datetime.combine(month_start, datetime.min.time())
+    month_end_at = reports.next_bucket(month_start_at, "month") - timedelta(microseconds=1)
+    month_revenue = reports.revenue(db, month_start_at, month_end_at)["total_revenue"]
+    jobs_completed, completed_total = reports.completed_jobs(db, month_start_at, month_end_at)
+    avg_job_value = completed_total / jobs_completed if jobs_completed else 0.0
     return schemas.DashboardOut(
         todays_jobs=todays_jobs or 0,
         upcoming_jobs=upcoming_jobs or 0,
@@ -764,49 +1340,49 @@ def get_settings(db: Session = Depends(get_db)):
 
 @app.put("/settings", response_model=schemas.SettingsOut)
 def update_settings(payload: schemas.SettingsUpdate, db: Session = Depends(get_db)):
+    validate_commission_rules(payload.commission_rules)
     settings = crud.ensure_settings(db)
     for key, value in payload.model_dump(exclude_unset=True).items():
         setattr(settings, key, value)
-    db.commit()
-    db.refresh(settings)
+    db.flush()
     return settings
 
 
 # AI endpoints
+def _run_or_enqueue(db: Session, response: Response, name: str, payload: dict, background: bool):
+    if not background:
+        run, _ = tasks.HANDLERS[name]
+        return run(db, payload)
+    response.status_code = status.HTTP_202_ACCEPTED
+    return schemas.TaskOut.model_validate(tasks.enqueue(db, name, payload))
+
+
 @app.post("/ai/estimate")
-def ai_estimate(payload: schemas.AiEstimateRequest, db: Session = Depends(get_db)):
-    hist = db.query(models.Estimate).order_by(models.Estimate.id.desc()).limit(50).all()
-    historical_jobs = [
-        {
-            "scope": e.scope,
-            "hazards": e.hazards,
-            "equipment": e.equipment,
-            "final_price": e.total,
-            "suggested_price": e.suggested_price,
-        }
-        for e in hist
-        if (e.total or 0) > 0
-    ]
-    return ai.suggest_estimate(payload.model_dump(), historical_jobs)
+def ai_estimate(
+    payload: schemas.AiEstimateRequest,
+    response: Response,
+    background: bool = False,
+    db: Session = Depends(get_db),
+):
+    return _run_or_enqueue(db, response, "ai.estimate", payload.model_dump(), background)
 
 
 @app.post("/ai/notes")
-def ai_notes(payload: schemas.AiNotesRequest):
-    return ai.structure_notes(payload.raw_notes)
+def ai_notes(
+    payload: schemas.AiNotesRequest,
+    response: Response,
+    background: bool = False,
+    db: Session = Depends(get_db),
+):
+    return _run_or_enqueue(db, response, "ai.notes", payload.model_dump(), background)
 
 
 @app.post("/ai/schedule")
-def ai_schedule(payload: schemas.AiScheduleRequest, db: Session = Depends(get_db)):
-    est = db.query(models.Estimate).filter(models.Estimate.id == payload.estimate_id).first()
-    if not est:
-        raise HTTPException(status_code=404, detail="Estimate not found")
-    estimate_dict = {
-        "id": est.id,
-        "scope": est.scope,
-        "hazards": est.hazards,
-        "equipment": est.equipment,
-        "suggested_price": est.suggested_price,
-        "final_price": est.total,
-        "status": est.status,
-    }
-    return ai.suggest_schedule(estimate_dict, payload.preferred_window, payload.crew_options)
+def ai_schedule(
+    payload: schemas.AiScheduleRequest,
+    response: Response,
+    background: bool = False,
+    db: Session = Depends(get_db),
+):
+    get_or_404(db, models.Estimate, payload.estimate_id, "Estimate")
+    return _run_or_enqueue(db, response, "ai.schedule", payload.model_dump(), background)
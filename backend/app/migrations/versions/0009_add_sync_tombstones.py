@@ -0,0 +1,57 @@
+"""add sync tombstones and updated_at indexes
+
+Revision ID: 0009_add_sync_tombstones
+Revises: 0008_add_service_address_job_invoice
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009_add_sync_tombstones"
+down_revision = "0008_add_service_address_job_invoice"
+branch_labels = None
+depends_on = None
+
+SYNC_TABLES = ["customers", "jobs", "job_tasks", "equipment", "attachments"]
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    attachment_cols = [col["name"] for col in inspector.get_columns("attachments")]
+    if "updated_at" not in attachment_cols:
+        op.add_column("attachments", sa.Column("updated_at", sa.DateTime(), nullable=True))
+        op.execute("UPDATE attachments SET updated_at = created_at")
+
+    for table in SYNC_TABLES:
+        indexes = [idx["name"] for idx in inspector.get_indexes(table)]
+        if f"ix_{table}_updated_at" not in indexes:
+            op.create_index(f"ix_{table}_updated_at", table, ["updated_at"])
+
+    tables = inspector.get_table_names()
+    if "tombstones" not in tables:
+        op.create_table(
+            "tombstones",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("entity_type", sa.String(length=100), nullable=False),
+            sa.Column("entity_id", sa.Integer(), nullable=False),
+            sa.Column("deleted_at", sa.DateTime(), nullable=False),
+        )
+        op.create_index("ix_tombstones_deleted_at", "tombstones", ["deleted_at"])
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    tables = inspector.get_table_names()
+    if "tombstones" in tables:
+        op.drop_index("ix_tombstones_deleted_at", table_name="tombstones")
+        op.drop_table("tombstones")
+    for table in SYNC_TABLES:
+        indexes = [idx["name"] for idx in inspector.get_indexes(table)]
+        if f"ix_{table}_updated_at" in indexes:
+            op.drop_index(f"ix_{table}_updated_at", table_name=table)
+    attachment_cols = [col["name"] for col in inspector.get_columns("attachments")]
+    if "updated_at" in attachment_cols:
+        op.drop_column("attachments", "updated_at")
@@ -0,0 +1,70 @@
+"""add recurring job templates
+
+Revision ID: 0010_add_recurring_job_templates
+Revises: 0009_add_sync_tombstones
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0010_add_recurring_job_templates"
+down_revision = "0009_add_sync_tombstones"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    tables = inspector.get_table_names()
+    if "recurring_job_templates" not in tables:
+        op.create_table(
+            "recurring_job_templates",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("customer_id", sa.Integer(), sa.ForeignKey("customers.id"), nullable=False),
+            sa.Column("crew_id", sa.Integer(), sa.ForeignKey("crews.id"), nullable=True),
+            sa.Column("sales_rep_id", sa.Integer(), sa.ForeignKey("sales_reps.id"), nullable=True),
+            sa.Column("job_type_id", sa.Integer(), sa.ForeignKey("job_types.id"), nullable=True),
+            sa.Column("rrule", sa.String(length=255), nullable=False),
+            sa.Column("dtstart", sa.DateTime(), nullable=False),
+            sa.Column("duration_minutes", sa.Integer(), nullable=True),
+            sa.Column("service_address", sa.Text(), nullable=False),
+            sa.Column("total", sa.Float(), nullable=False),
+            sa.Column("notes", sa.Text(), nullable=False),
+            sa.Column("task_titles", sa.JSON(), nullable=False),
+            sa.Column("active", sa.Boolean(), nullable=False),
+            sa.Column("materialized_through", sa.DateTime(), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+            sa.Column("updated_at", sa.DateTime(), nullable=False),
+        )
+
+    job_cols = [col["name"] for col in inspector.get_columns("jobs")]
+    if "recurring_template_id" not in job_cols:
+        op.add_column("jobs", sa.Column("recurring_template_id", sa.Integer(), nullable=True))
+    if "occurrence_at" not in job_cols:
+        op.add_column("jobs", sa.Column("occurrence_at", sa.DateTime(), nullable=True))
+    indexes = [idx["name"] for idx in inspector.get_indexes("jobs")]
+    if "uq_jobs_recurring_occurrence" not in indexes:
+        op.create_index(
+            "uq_jobs_recurring_occurrence",
+            "jobs",
+            ["recurring_template_id", "occurrence_at"],
+            unique=True,
+        )
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = [idx["name"] for idx in inspector.get_indexes("jobs")]
+    if "uq_jobs_recurring_occurrence" in indexes:
+        op.drop_index("uq_jobs_recurring_occurrence", table_name="jobs")
+    job_cols = [col["name"] for col in inspector.get_columns("jobs")]
+    if "occurrence_at" in job_cols:
+        op.drop_column("jobs", "occurrence_at")
+    if "recurring_template_id" in job_cols:
+        op.drop_column("jobs", "recurring_template_id")
+    tables = inspector.get_table_names()
+    if "recurring_job_templates" in tables:
+        op.drop_table("recurring_job_templates")
@@ -0,0 +1,29 @@
+"""add index on jobs.completed_at
+
+Revision ID: 0011_add_job_completed_at_index
+Revises: 0010_add_recurring_job_templates
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0011_add_job_completed_at_index"
+down_revision = "0010_add_recurring_job_templates"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = [idx["name"] for idx in inspector.get_indexes("jobs")]
+    if "ix_jobs_completed_at" not in indexes:
+        op.create_index("ix_jobs_completed_at", "jobs", ["completed_at"])
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = [idx["name"] for idx in inspector.get_indexes("jobs")]
+    if "ix_jobs_completed_at" in indexes:
+        op.drop_index("ix_jobs_completed_at", table_name="jobs")
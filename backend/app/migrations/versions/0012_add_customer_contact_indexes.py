@@ -0,0 +1,33 @@
+"""add customer email and phone indexes
+
+Revision ID: 0012_add_customer_contact_indexes
+Revises: 0011_add_job_completed_at_index
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0012_add_customer_contact_indexes"
+down_revision = "0011_add_job_completed_at_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = [idx["name"] for idx in inspector.get_indexes("customers")]
+    if "ix_customers_email" not in indexes:
+        op.create_index("ix_customers_email", "customers", ["email"])
+    if "ix_customers_phone" not in indexes:
+        op.create_index("ix_customers_phone", "customers", ["phone"])
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = [idx["name"] for idx in inspector.get_indexes("customers")]
+    if "ix_customers_phone" in indexes:
+        op.drop_index("ix_customers_phone", table_name="customers")
+    if "ix_customers_email" in indexes:
+        op.drop_index("ix_customers_email", table_name="customers")
@@ -0,0 +1,29 @@
+"""add index on payments.invoice_id
+
+Revision ID: 0013_add_payment_invoice_index
+Revises: 0012_add_customer_contact_indexes
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0013_add_payment_invoice_index"
+down_revision = "0012_add_customer_contact_indexes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = [idx["name"] for idx in inspector.get_indexes("payments")]
+    if "ix_payments_invoice_id" not in indexes:
+        op.create_index("ix_payments_invoice_id", "payments", ["invoice_id"])
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = [idx["name"] for idx in inspector.get_indexes("payments")]
+    if "ix_payments_invoice_id" in indexes:
+        op.drop_index("ix_payments_invoice_id", table_name="payments")
@@ -0,0 +1,29 @@
+"""add index on invoices.job_id
+
+Revision ID: 0014_add_invoice_job_index
+Revises: 0013_add_payment_invoice_index
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0014_add_invoice_job_index"
+down_revision = "0013_add_payment_invoice_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = [idx["name"] for idx in inspector.get_indexes("invoices")]
+    if "ix_invoices_job_id" not in indexes:
+        op.create_index("ix_invoices_job_id", "invoices", ["job_id"])
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = [idx["name"] for idx in inspector.get_indexes("invoices")]
+    if "ix_invoices_job_id" in indexes:
+        op.drop_index("ix_invoices_job_id", table_name="invoices")
@@ -0,0 +1,40 @@
+"""add idempotency keys
+
+Revision ID: 0015_add_idempotency_keys
+Revises: 0014_add_invoice_job_index
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0015_add_idempotency_keys"
+down_revision = "0014_add_invoice_job_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "idempotency_keys" not in inspector.get_table_names():
+        op.create_table(
+            "idempotency_keys",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("key", sa.String(length=255), nullable=False),
+            sa.Column("route", sa.String(length=255), nullable=False),
+            sa.Column("request_hash", sa.String(length=64), nullable=False),
+            sa.Column("status_code", sa.Integer(), nullable=True),
+            sa.Column("content_type", sa.String(length=100), nullable=True),
+            sa.Column("response_body", sa.LargeBinary(), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+            sa.UniqueConstraint("key", "route", name="uq_idempotency_key_route"),
+        )
+        op.create_index("ix_idempotency_keys_created_at", "idempotency_keys", ["created_at"])
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "idempotency_keys" in inspector.get_table_names():
+        op.drop_index("ix_idempotency_keys_created_at", table_name="idempotency_keys")
+        op.drop_table("idempotency_keys")
@@ -0,0 +1,41 @@
+"""add outbox
+
+Revision ID: 0016_add_outbox
+Revises: 0015_add_idempotency_keys
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0016_add_outbox"
+down_revision = "0015_add_idempotency_keys"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "outbox" not in inspector.get_table_names():
+        op.create_table(
+            "outbox",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("kind", sa.String(length=20), nullable=False),
+            sa.Column("topic", sa.String(length=100), nullable=False),
+            sa.Column("payload", sa.JSON(), nullable=False),
+            sa.Column("status", sa.String(length=20), nullable=False),
+            sa.Column("attempts", sa.Integer(), nullable=False),
+            sa.Column("next_attempt_at", sa.DateTime(), nullable=False),
+            sa.Column("last_error", sa.Text(), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+            sa.Column("sent_at", sa.DateTime(), nullable=True),
+        )
+        op.create_index("ix_outbox_status_next_attempt", "outbox", ["status", "next_attempt_at"])
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "outbox" in inspector.get_table_names():
+        op.drop_index("ix_outbox_status_next_attempt", table_name="outbox")
+        op.drop_table("outbox")
@@ -0,0 +1,47 @@
+"""add background tasks
+
+Revision ID: 0017_add_background_tasks
+Revises: 0016_add_outbox
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0017_add_background_tasks"
+down_revision = "0016_add_outbox"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "background_tasks" not in inspector.get_table_names():
+        op.create_table(
+            "background_tasks",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(length=100), nullable=False),
+            sa.Column("payload", sa.JSON(), nullable=False),
+            sa.Column("priority", sa.Integer(), nullable=False),
+            sa.Column("status", sa.String(length=20), nullable=False),
+            sa.Column("attempts", sa.Integer(), nullable=False),
+            sa.Column("max_attempts", sa.Integer(), nullable=False),
+            sa.Column("available_at", sa.DateTime(), nullable=False),
+            sa.Column("locked_by", sa.String(length=100), nullable=True),
+            sa.Column("result", sa.JSON(), nullable=True),
+            sa.Column("error", sa.Text(), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+            sa.Column("started_at", sa.DateTime(), nullable=True),
+            sa.Column("finished_at", sa.DateTime(), nullable=True),
+        )
+        op.create_index(
+            "ix_background_tasks_status_available", "background_tasks", ["status", "available_at"]
+        )
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "background_tasks" in inspector.get_table_names():
+        op.drop_index("ix_background_tasks_status_available", table_name="background_tasks")
+        op.drop_table("background_tasks")
@@ -0,0 +1,47 @@
+"""add attachment blobs
+
+Revision ID: 0018_add_attachment_blobs
+Revises: 0017_add_background_tasks
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0018_add_attachment_blobs"
+down_revision = "0017_add_background_tasks"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "blobs" not in inspector.get_table_names():
+        op.create_table(
+            "blobs",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("sha256", sa.String(length=64), nullable=False, unique=True),
+            sa.Column("size", sa.Integer(), nullable=False),
+            sa.Column("content_type", sa.String(length=100), nullable=False),
+            sa.Column("previews", sa.String(length=20), nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+        )
+    columns = [col["name"] for col in inspector.get_columns("attachments")]
+    if "sha256" not in columns:
+        op.add_column("attachments", sa.Column("sha256", sa.String(length=64), nullable=True))
+        op.create_index("ix_attachments_sha256", "attachments", ["sha256"])
+    if "filename" not in columns:
+        op.add_column("attachments", sa.Column("filename", sa.Text(), nullable=True))
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = [col["name"] for col in inspector.get_columns("attachments")]
+    if "filename" in columns:
+        op.drop_column("attachments", "filename")
+    if "sha256" in columns:
+        op.drop_index("ix_attachments_sha256", table_name="attachments")
+        op.drop_column("attachments", "sha256")
+    if "blobs" in inspector.get_table_names():
+        op.drop_table("blobs")
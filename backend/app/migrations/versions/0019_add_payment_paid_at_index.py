@@ -0,0 +1,29 @@
+"""add covering index on payments.paid_at
+
+Revision ID: 0019_add_payment_paid_at_index
+Revises: 0018_add_attachment_blobs
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0019_add_payment_paid_at_index"
+down_revision = "0018_add_attachment_blobs"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = [idx["name"] for idx in inspector.get_indexes("payments")]
+    if "ix_payments_paid_at_method_amount" not in indexes:
+        op.create_index("ix_payments_paid_at_method_amount", "payments", ["paid_at", "method", "amount"])
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = [idx["name"] for idx in inspector.get_indexes("payments")]
+    if "ix_payments_paid_at_method_amount" in indexes:
+        op.drop_index("ix_payments_paid_at_method_amount", table_name="payments")
@@ -0,0 +1,33 @@
+"""replace payments.invoice_id index with a covering balance index
+
+Revision ID: 0020_add_payment_balance_index
+Revises: 0019_add_payment_paid_at_index
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0020_add_payment_balance_index"
+down_revision = "0019_add_payment_paid_at_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = [idx["name"] for idx in inspector.get_indexes("payments")]
+    if "ix_payments_invoice_paid_at_amount" not in indexes:
+        op.create_index("ix_payments_invoice_paid_at_amount", "payments", ["invoice_id", "paid_at", "amount"])
+    if "ix_payments_invoice_id" in indexes:
+        op.drop_index("ix_payments_invoice_id", table_name="payments")
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = [idx["name"] for idx in inspector.get_indexes("payments")]
+    if "ix_payments_invoice_id" not in indexes:
+        op.create_index("ix_payments_invoice_id", "payments", ["invoice_id"])
+    if "ix_payments_invoice_paid_at_amount" in indexes:
+        op.drop_index("ix_payments_invoice_paid_at_amount", table_name="payments")
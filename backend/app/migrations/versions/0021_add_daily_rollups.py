@@ -0,0 +1,81 @@
+"""add daily report rollups
+
+Revision ID: 0021_add_daily_rollups
+Revises: 0020_add_payment_balance_index
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0021_add_daily_rollups"
+down_revision = "0020_add_payment_balance_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    tables = inspector.get_table_names()
+    if "daily_payments" not in tables:
+        op.create_table(
+            "daily_payments",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("day", sa.Date(), nullable=False),
+            sa.Column("method", sa.String(length=50), nullable=False),
+            sa.Column("crew_id", sa.Integer(), nullable=True),
+            sa.Column("sales_rep_id", sa.Integer(), nullable=True),
+            sa.Column("job_type_id", sa.Integer(), nullable=True),
+            sa.Column("payments", sa.Integer(), nullable=False),
+            sa.Column("amount", sa.Float(), nullable=False),
+        )
+        op.create_index("ix_daily_payments_day", "daily_payments", ["day"])
+    if "daily_estimates" not in tables:
+        op.create_table(
+            "daily_estimates",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("day", sa.Date(), nullable=False),
+            sa.Column("status", sa.String(length=50), nullable=False),
+            sa.Column("estimates", sa.Integer(), nullable=False),
+            sa.Column("total", sa.Float(), nullable=False),
+        )
+        op.create_index("ix_daily_estimates_day", "daily_estimates", ["day"])
+    if "daily_jobs_completed" not in tables:
+        op.create_table(
+            "daily_jobs_completed",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("day", sa.Date(), nullable=False),
+            sa.Column("job_type_id", sa.Integer(), nullable=True),
+            sa.Column("crew_id", sa.Integer(), nullable=True),
+            sa.Column("jobs", sa.Integer(), nullable=False),
+            sa.Column("total", sa.Float(), nullable=False),
+        )
+        op.create_index("ix_daily_jobs_completed_day", "daily_jobs_completed", ["day"])
+    if "rollup_state" not in tables:
+        op.create_table(
+            "rollup_state",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("high_water_mark", sa.DateTime(), nullable=True),
+            sa.Column("closed_through", sa.Date(), nullable=True),
+            sa.Column("refreshed_at", sa.DateTime(), nullable=True),
+        )
+    for table in ("payments", "estimates"):
+        indexes = [idx["name"] for idx in inspector.get_indexes(table)]
+        if f"ix_{table}_updated_at" not in indexes:
+            op.create_index(f"ix_{table}_updated_at", table, ["updated_at"])
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    for table in ("payments", "estimates"):
+        indexes = [idx["name"] for idx in inspector.get_indexes(table)]
+        if f"ix_{table}_updated_at" in indexes:
+            op.drop_index(f"ix_{table}_updated_at", table_name=table)
+    tables = inspector.get_table_names()
+    if "rollup_state" in tables:
+        op.drop_table("rollup_state")
+    for table in ("daily_jobs_completed", "daily_estimates", "daily_payments"):
+        if table in tables:
+            op.drop_index(f"ix_{table}_day", table_name=table)
+            op.drop_table(table)
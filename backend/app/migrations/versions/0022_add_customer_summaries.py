@@ -0,0 +1,82 @@
+"""add customer summaries
+
+Revision ID: 0022_add_customer_summaries
+Revises: 0021_add_daily_rollups
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0022_add_customer_summaries"
+down_revision = "0021_add_daily_rollups"
+branch_labels = None
+depends_on = None
+
+# The full rebuild from app.summaries.refresh(), as plain SQL.
+BACKFILL = """
+INSERT INTO customer_summaries (
+    customer_id, job_count, last_job_at, invoice_count,
+    invoiced_total, lifetime_revenue, open_balance, updated_at
+)
+SELECT
+    customers.id,
+    coalesce(jobs.jobs, 0),
+    jobs.last_job_at,
+    coalesce(invoices.invoices, 0),
+    coalesce(invoices.invoiced, 0.0),
+    coalesce(invoices.paid, 0.0),
+    coalesce(invoices.balance, 0.0),
+    CURRENT_TIMESTAMP
+FROM customers
+LEFT OUTER JOIN (
+    SELECT customer_id, count(id) AS jobs, max(completed_at) AS last_job_at
+    FROM jobs
+    WHERE status != 'canceled'
+    GROUP BY customer_id
+) AS jobs ON jobs.customer_id = customers.id
+LEFT OUTER JOIN (
+    SELECT
+        invoices.customer_id,
+        count(invoices.id) AS invoices,
+        sum(invoices.total) AS invoiced,
+        sum(coalesce(paid.paid, 0.0)) AS paid,
+        sum(
+            CASE WHEN invoices.total > coalesce(paid.paid, 0.0)
+            THEN invoices.total - coalesce(paid.paid, 0.0) ELSE 0.0 END
+        ) AS balance
+    FROM invoices
+    LEFT OUTER JOIN (
+        SELECT invoice_id, sum(amount) AS paid FROM payments GROUP BY invoice_id
+    ) AS paid ON paid.invoice_id = invoices.id
+    GROUP BY invoices.customer_id
+) AS invoices ON invoices.customer_id = customers.id
+"""
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "customer_summaries" not in inspector.get_table_names():
+        op.create_table(
+            "customer_summaries",
+            sa.Column("customer_id", sa.Integer(), sa.ForeignKey("customers.id"), primary_key=True),
+            sa.Column("job_count", sa.Integer(), nullable=False),
+            sa.Column("last_job_at", sa.DateTime(), nullable=True),
+            sa.Column("invoice_count", sa.Integer(), nullable=False),
+            sa.Column("invoiced_total", sa.Float(), nullable=False),
+            sa.Column("lifetime_revenue", sa.Float(), nullable=False),
+            sa.Column("open_balance", sa.Float(), nullable=False),
+            sa.Column("updated_at", sa.DateTime(), nullable=False),
+        )
+        op.create_index("ix_customer_summaries_lifetime_revenue", "customer_summaries", ["lifetime_revenue"])
+        op.create_index("ix_customer_summaries_open_balance", "customer_summaries", ["open_balance"])
+        op.execute(BACKFILL)
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "customer_summaries" in inspector.get_table_names():
+        op.drop_index("ix_customer_summaries_open_balance", table_name="customer_summaries")
+        op.drop_index("ix_customer_summaries_lifetime_revenue", table_name="customer_summaries")
+        op.drop_table("customer_summaries")
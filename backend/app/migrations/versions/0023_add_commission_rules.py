@@ -0,0 +1,31 @@
+"""add commission rules
+
+Revision ID: 0023_add_commission_rules
+Revises: 0022_add_customer_summaries
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0023_add_commission_rules"
+down_revision = "0022_add_customer_summaries"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    for table in ("settings", "sales_reps"):
+        columns = [col["name"] for col in inspector.get_columns(table)]
+        if "commission_rules" not in columns:
+            op.add_column(table, sa.Column("commission_rules", sa.JSON(), nullable=True))
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    for table in ("sales_reps", "settings"):
+        columns = [col["name"] for col in inspector.get_columns(table)]
+        if "commission_rules" in columns:
+            op.drop_column(table, "commission_rules")
@@ -0,0 +1,31 @@
+"""add crew to tombstones
+
+Revision ID: 0024_add_tombstone_crew
+Revises: 0023_add_commission_rules
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0024_add_tombstone_crew"
+down_revision = "0023_add_commission_rules"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = [col["name"] for col in inspector.get_columns("tombstones")]
+    if "crew_id" not in columns:
+        op.add_column("tombstones", sa.Column("crew_id", sa.Integer(), nullable=True))
+        op.create_index("ix_tombstones_crew_id", "tombstones", ["crew_id"])
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = [col["name"] for col in inspector.get_columns("tombstones")]
+    if "crew_id" in columns:
+        op.drop_index("ix_tombstones_crew_id", table_name="tombstones")
+        op.drop_column("tombstones", "crew_id")
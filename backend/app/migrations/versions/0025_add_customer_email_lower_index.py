@@ -0,0 +1,22 @@
+"""add case-insensitive customer email index
+
+Revision ID: 0025_add_customer_email_lower_index
+Revises: 0024_add_tombstone_crew
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0025_add_customer_email_lower_index"
+down_revision = "0024_add_tombstone_crew"
+branch_labels = None
+depends_on = None
+
+
+# SQLite's inspector skips expression indexes, so guard with IF [NOT] EXISTS instead.
+def upgrade():
+    op.create_index("ix_customers_email_lower", "customers", [sa.text("lower(email)")], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index("ix_customers_email_lower", table_name="customers", if_exists=True)
@@ -0,0 +1,29 @@
+"""add applied_at to idempotency keys
+
+Revision ID: 0026_add_idempotency_applied_at
+Revises: 0025_add_customer_email_lower_index
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0026_add_idempotency_applied_at"
+down_revision = "0025_add_customer_email_lower_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = [col["name"] for col in inspector.get_columns("idempotency_keys")]
+    if "applied_at" not in columns:
+        op.add_column("idempotency_keys", sa.Column("applied_at", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = [col["name"] for col in inspector.get_columns("idempotency_keys")]
+    if "applied_at" in columns:
+        op.drop_column("idempotency_keys", "applied_at")
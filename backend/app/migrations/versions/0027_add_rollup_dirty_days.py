@@ -0,0 +1,33 @@
+"""add rollup dirty days
+
+Revision ID: 0027_add_rollup_dirty_days
+Revises: 0026_add_idempotency_applied_at
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0027_add_rollup_dirty_days"
+down_revision = "0026_add_idempotency_applied_at"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "rollup_dirty_days" not in inspector.get_table_names():
+        op.create_table(
+            "rollup_dirty_days",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("rollup", sa.String(length=50), nullable=False),
+            sa.Column("day", sa.Date(), nullable=False),
+            sa.Column("marked_at", sa.DateTime(), nullable=False),
+        )
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "rollup_dirty_days" in inspector.get_table_names():
+        op.drop_table("rollup_dirty_days")
@@ -0,0 +1,35 @@
+"""add reconciled bank statement lines
+
+Revision ID: 0028_add_reconciled_lines
+Revises: 0027_add_rollup_dirty_days
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0028_add_reconciled_lines"
+down_revision = "0027_add_rollup_dirty_days"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "reconciled_lines" not in inspector.get_table_names():
+        op.create_table(
+            "reconciled_lines",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("statement_sha256", sa.String(length=64), nullable=False),
+            sa.Column("line", sa.Integer(), nullable=False),
+            sa.Column("posted_on", sa.Date(), nullable=False),
+            sa.Column("reconciled_at", sa.DateTime(), nullable=False),
+            sa.UniqueConstraint("statement_sha256", "line", name="uq_reconciled_line"),
+        )
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "reconciled_lines" in inspector.get_table_names():
+        op.drop_table("reconciled_lines")
@@ -0,0 +1,29 @@
+"""add response_headers to idempotency keys
+
+Revision ID: 0029_add_idempotency_response_headers
+Revises: 0028_add_reconciled_lines
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0029_add_idempotency_response_headers"
+down_revision = "0028_add_reconciled_lines"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = [col["name"] for col in inspector.get_columns("idempotency_keys")]
+    if "response_headers" not in columns:
+        op.add_column("idempotency_keys", sa.Column("response_headers", sa.JSON(), nullable=True))
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = [col["name"] for col in inspector.get_columns("idempotency_keys")]
+    if "response_headers" in columns:
+        op.drop_column("idempotency_keys", "response_headers")
@@ -1,14 +1,18 @@
-from datetime import datetime
+from datetime import date, datetime
 from sqlalchemy import (
     Boolean,
+    Date,
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
     JSON,
+    LargeBinary,
     String,
     Text,
     UniqueConstraint,
+    func,
 )
 from sqlalchemy.ext.mutable import MutableList
 from sqlalchemy.orm import Mapped, mapped_column, relationship
@@ -34,19 +38,26 @@ class Customer(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(200))
     company_name: Mapped[str | None] = mapped_column(String(200), nullable=True)
-    phone: Mapped[str] = mapped_column(String(50), default="")
-    email: Mapped[str] = mapped_column(String(255), default="")
+    phone: Mapped[str] = mapped_column(String(50), default="", index=True)
+    email: Mapped[str] = mapped_column(String(255), default="", index=True)
     billing_address: Mapped[str] = mapped_column(Text, default="")
     service_address: Mapped[str] = mapped_column(Text, default="")
     notes: Mapped[str] = mapped_column(Text, default="")
     tags: Mapped[list[str]] = mapped_column(MutableList.as_mutable(JSON), default=list)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
 
     leads = relationship("Lead", back_populates="customer", cascade="all, delete-orphan")
     estimates = relationship("Estimate", back_populates="customer", cascade="all, delete-orphan")
     jobs = relationship("Job", back_populates="customer", cascade="all, delete-orphan")
     invoices = relationship("Invoice", back_populates="customer", cascade="all, delete-orphan")
+    summary = relationship("CustomerSummary", uselist=False, cascade="all, delete-orphan")
+
+
+# Contact matching (imports, lead lookup) compares emails case-insensitively.
+Index("ix_customers_email_lower", func.lower(Customer.email))
 
 
 class Lead(Base):
@@ -81,7 +92,9 @@ class Estimate(Base):
     approved_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     notes: Mapped[str] = mapped_column(Text, default="")
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
 
     customer = relationship("Customer", back_populates="estimates")
     lead = relationship("Lead", back_populates="estimates")
@@ -126,6 +139,8 @@ class SalesRep(Base):
     email: Mapped[str] = mapped_column(String(255), default="")
     phone: Mapped[str] = mapped_column(String(50), default="")
     notes: Mapped[str] = mapped_column(Text, default="")
+    # Overrides Settings.commission_rules for this rep when set.
+    commission_rules: Mapped[dict | None] = mapped_column(JSON, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -155,6 +170,9 @@ class CrewMember(Base):
 
 class Job(Base):
     __tablename__ = "jobs"
+    __table_args__ = (
+        Index("uq_jobs_recurring_occurrence", "recurring_template_id", "occurrence_at", unique=True),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     customer_id: Mapped[int] = mapped_column(ForeignKey("customers.id"))
     estimate_id: Mapped[int | None] = mapped_column(ForeignKey("estimates.id"), nullable=True)
@@ -168,8 +186,14 @@ class Job(Base):
     total: Mapped[float] = mapped_column(Float, default=0.0)
     notes: Mapped[str] = mapped_column(Text, default="")
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    completed_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
+    completed_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True, index=True)
+    recurring_template_id: Mapped[int | None] = mapped_column(
+        ForeignKey("recurring_job_templates.id"), nullable=True
+    )
+    occurrence_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
     customer = relationship("Customer", back_populates="jobs")
     estimate = relationship("Estimate", back_populates="jobs")
@@ -179,12 +203,36 @@ class Job(Base):
     tasks = relationship("JobTask", back_populates="job", cascade="all, delete-orphan")
     equipment_links = relationship("JobEquipment", back_populates="job", cascade="all, delete-orphan")
     invoice = relationship("Invoice", back_populates="job", uselist=False)
+    recurring_template = relationship("RecurringJobTemplate", back_populates="jobs")
 
     @property
     def equipment_ids(self):
         return [link.equipment_id for link in self.equipment_links]
 
 
+class RecurringJobTemplate(Base):
+    __tablename__ = "recurring_job_templates"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    customer_id: Mapped[int] = mapped_column(ForeignKey("customers.id"))
+    crew_id: Mapped[int | None] = mapped_column(ForeignKey("crews.id"), nullable=True)
+    sales_rep_id: Mapped[int | None] = mapped_column(ForeignKey("sales_reps.id"), nullable=True)
+    job_type_id: Mapped[int | None] = mapped_column(ForeignKey("job_types.id"), nullable=True)
+    rrule: Mapped[str] = mapped_column(String(255))
+    dtstart: Mapped[datetime] = mapped_column(DateTime)
+    duration_minutes: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    service_address: Mapped[str] = mapped_column(Text, default="")
+    total: Mapped[float] = mapped_column(Float, default=0.0)
+    notes: Mapped[str] = mapped_column(Text, default="")
+    task_titles: Mapped[list[str]] = mapped_column(MutableList.as_mutable(JSON), default=list)
+    active: Mapped[bool] = mapped_column(Boolean, default=True)
+    materialized_through: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    customer = relationship("Customer")
+    jobs = relationship("Job", back_populates="recurring_template")
+
+
 class JobTask(Base):
     __tablename__ = "job_tasks"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -193,7 +241,9 @@ class JobTask(Base):
     completed: Mapped[bool] = mapped_column(Boolean, default=False)
     sort_order: Mapped[int] = mapped_column(Integer, default=0)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
 
     job = relationship("Job", back_populates="tasks")
 
@@ -206,7 +256,9 @@ class Equipment(Base):
     status: Mapped[str] = mapped_column(String(50), default="available")
     notes: Mapped[str] = mapped_column(Text, default="")
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
 
     job_links = relationship("JobEquipment", back_populates="equipment", cascade="all, delete-orphan")
 
@@ -227,7 +279,7 @@ class Invoice(Base):
     __tablename__ = "invoices"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     customer_id: Mapped[int] = mapped_column(ForeignKey("customers.id"))
-    job_id: Mapped[int] = mapped_column(ForeignKey("jobs.id"))
+    job_id: Mapped[int] = mapped_column(ForeignKey("jobs.id"), index=True)
     status: Mapped[str] = mapped_column(String(50), default="unpaid")
     subtotal: Mapped[float] = mapped_column(Float, default=0.0)
     tax: Mapped[float] = mapped_column(Float, default=0.0)
@@ -246,6 +298,12 @@ class Invoice(Base):
 
 class Payment(Base):
     __tablename__ = "payments"
+    # Covering indexes: revenue reports scan by paid_at, balances (AR aging)
+    # sum amount per invoice up to a date. Both read only the index.
+    __table_args__ = (
+        Index("ix_payments_paid_at_method_amount", "paid_at", "method", "amount"),
+        Index("ix_payments_invoice_paid_at_amount", "invoice_id", "paid_at", "amount"),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     invoice_id: Mapped[int] = mapped_column(ForeignKey("invoices.id"))
     amount: Mapped[float] = mapped_column(Float, default=0.0)
@@ -253,7 +311,9 @@ class Payment(Base):
     paid_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     note: Mapped[str | None] = mapped_column(Text, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
 
     invoice = relationship("Invoice", back_populates="payments")
 
@@ -265,7 +325,169 @@ class Attachment(Base):
     entity_id: Mapped[int] = mapped_column(Integer)
     url: Mapped[str] = mapped_column(Text)
     caption: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # Set for uploaded files; the bytes live in content-addressed storage (see Blob).
+    sha256: Mapped[str | None] = mapped_column(String(64), nullable=True, index=True)
+    filename: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
+
+
+class ReconciledLine(Base):
+    """A bank statement line whose deposit was approved and posted as payments."""
+
+    __tablename__ = "reconciled_lines"
+    __table_args__ = (UniqueConstraint("statement_sha256", "line", name="uq_reconciled_line"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    statement_sha256: Mapped[str] = mapped_column(String(64))
+    line: Mapped[int] = mapped_column(Integer)
+    posted_on: Mapped[date] = mapped_column(Date)
+    reconciled_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class Blob(Base):
+    __tablename__ = "blobs"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    sha256: Mapped[str] = mapped_column(String(64), unique=True)
+    size: Mapped[int] = mapped_column(Integer)
+    content_type: Mapped[str] = mapped_column(String(100), default="application/octet-stream")
+    # pending | ready | unsupported | failed
+    previews: Mapped[str] = mapped_column(String(20), default="pending")
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class DailyPayment(Base):
+    """Payments rolled up per closed day, method and the paid job's crew, rep and type."""
+
+    __tablename__ = "daily_payments"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    day: Mapped[date] = mapped_column(Date, index=True)
+    method: Mapped[str] = mapped_column(String(50))
+    crew_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    sales_rep_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    job_type_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    payments: Mapped[int] = mapped_column(Integer, default=0)
+    amount: Mapped[float] = mapped_column(Float, default=0.0)
+
+
+class DailyEstimate(Base):
+    """Estimates rolled up per closed creation day and current status."""
+
+    __tablename__ = "daily_estimates"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    day: Mapped[date] = mapped_column(Date, index=True)
+    status: Mapped[str] = mapped_column(String(50))
+    estimates: Mapped[int] = mapped_column(Integer, default=0)
+    total: Mapped[float] = mapped_column(Float, default=0.0)
+
+
+class DailyJobCompletion(Base):
+    """Completed jobs rolled up per closed completion day, job type and crew."""
+
+    __tablename__ = "daily_jobs_completed"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    day: Mapped[date] = mapped_column(Date, index=True)
+    job_type_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    crew_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    jobs: Mapped[int] = mapped_column(Integer, default=0)
+    total: Mapped[float] = mapped_column(Float, default=0.0)
+
+
+class RollupDirtyDay(Base):
+    """A closed day a source row moved off or was deleted from; the next refresh re-rolls it."""
+
+    __tablename__ = "rollup_dirty_days"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    rollup: Mapped[str] = mapped_column(String(50))
+    day: Mapped[date] = mapped_column(Date)
+    marked_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class RollupState(Base):
+    __tablename__ = "rollup_state"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # Source rows updated after this are re-rolled on the next refresh.
+    high_water_mark: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # Last day the rollups are complete for; reports read raw rows after it.
+    closed_through: Mapped[date | None] = mapped_column(Date, nullable=True)
+    refreshed_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class CustomerSummary(Base):
+    """Per-customer job, invoice and payment totals, kept current on every commit that touches them."""
+
+    __tablename__ = "customer_summaries"
+    customer_id: Mapped[int] = mapped_column(ForeignKey("customers.id"), primary_key=True)
+    job_count: Mapped[int] = mapped_column(Integer, default=0)
+    last_job_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    invoice_count: Mapped[int] = mapped_column(Integer, default=0)
+    invoiced_total: Mapped[float] = mapped_column(Float, default=0.0)
+    lifetime_revenue: Mapped[float] = mapped_column(Float, default=0.0, index=True)
+    open_balance: Mapped[float] = mapped_column(Float, default=0.0, index=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class Tombstone(Base):
+    __tablename__ = "tombstones"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    entity_type: Mapped[str] = mapped_column(String(100))
+    entity_id: Mapped[int] = mapped_column(Integer)
+    # Jobs only: the crew the job was deleted from or reassigned away from.
+    crew_id: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)
+    deleted_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox"
+    __table_args__ = (Index("ix_outbox_status_next_attempt", "status", "next_attempt_at"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(20))
+    topic: Mapped[str] = mapped_column(String(100))
+    payload: Mapped[dict] = mapped_column(JSON, default=dict)
+    status: Mapped[str] = mapped_column(String(20), default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    sent_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class BackgroundTask(Base):
+    __tablename__ = "background_tasks"
+    __table_args__ = (Index("ix_background_tasks_status_available", "status", "available_at"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(100))
+    payload: Mapped[dict] = mapped_column(JSON, default=dict)
+    priority: Mapped[int] = mapped_column(Integer, default=1)
+    status: Mapped[str] = mapped_column(String(20), default="queued")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer, default=3)
+    available_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    locked_by: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    result: Mapped[dict | list | None] = mapped_column(JSON, nullable=True)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (UniqueConstraint("key", "route", name="uq_idempotency_key_route"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    key: Mapped[str] = mapped_column(String(255))
+    route: Mapped[str] = mapped_column(String(255))
+    request_hash: Mapped[str] = mapped_column(String(64))
+    status_code: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    # Only read for rows stored before response_headers existed.
+    content_type: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    # [name, value] pairs in order, so repeated headers replay as sent.
+    response_headers: Mapped[list | None] = mapped_column(JSON, nullable=True)
+    response_body: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    # Set in the same transaction as the request's own writes.
+    applied_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
 
 
 class Settings(Base):
@@ -274,5 +496,7 @@ class Settings(Base):
     company_name: Mapped[str] = mapped_column(String(200), default="ArborSoftAI Pro")
     company_logo_url: Mapped[str] = mapped_column(Text, default="")
     default_tax_rate: Mapped[float] = mapped_column(Float, default=0.0)
+    # {"basis": "collected", "tiers": [{"threshold": 0, "rate": 0.05}, ...]}; marginal rates per tier.
+    commission_rules: Mapped[dict | None] = mapped_column(JSON, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,283 @@
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+from . import models
+from .db import SessionLocal, after_commit
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 8
+BASE_BACKOFF = timedelta(seconds=30)
+MAX_BACKOFF = timedelta(hours=1)
+# Claimed messages are hidden from other dispatchers for this long while being delivered.
+LEASE = timedelta(minutes=5)
+POLL_SECONDS = int(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+
+
+class LocalSink:
+    """Stand-in transport that records deliveries in memory and logs them.
+
+    Real transports (SMTP, an SMS gateway, HTTP webhooks) implement the same
+    `send(messages)` method and return {message id: error} for failures.
+    """
+
+    def __init__(self, kind: str, keep: int = 1000):
+        self.kind = kind
+        self.delivered = deque(maxlen=keep)
+
+    def send(self, messages: list[dict]) -> dict[int, str]:
+        for message in messages:
+            logger.info("outbox %s %s -> %s", self.kind, message["topic"], message.get("to"))
+            self.delivered.append(message)
+        return {}
+
+
+sinks = {kind: LocalSink(kind) for kind in ("email", "sms", "webhook")}
+
+_wake = threading.Event()
+
+
+def _row(kind: str, topic: str, payload: dict, now: datetime) -> dict:
+    return {
+        "kind": kind,
+        "topic": topic,
+        "payload": jsonable_encoder(payload),
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now,
+    }
+
+
+def enqueue(db: Session, kind: str, topic: str, payload: dict):
+    """Add a message to the outbox inside the caller's transaction."""
+    enqueue_many(db, [(kind, topic, payload)])
+
+
+def enqueue_many(db: Session, messages: list[tuple[str, str, dict]]):
+    if not messages:
+        return
+    now = datetime.utcnow()
+    db.execute(insert(models.OutboxMessage), [_row(kind, topic, payload, now) for kind, topic, payload in messages])
+    after_commit(db, _wake.set)
+
+
+def invoice_issued(db: Session, invoices):
+    enqueue_many(
+        db,
+        [
+            (
+                "email",
+                "invoice.issued",
+                {
+                    "invoice_id": invoice.id,
+                    "customer_id": invoice.customer_id,
+                    "total": invoice.total,
+                    "due_date": invoice.due_date,
+                },
+            )
+            for invoice in invoices
+        ],
+    )
+
+
+def jobs_scheduled(db: Session, jobs):
+    enqueue_many(
+        db,
+        [
+            (
+                "sms",
+                "job.scheduled",
+                {"job_id": job.id, "customer_id": job.customer_id, "scheduled_start": job.scheduled_start},
+            )
+            for job in jobs
+            if job.scheduled_start
+        ],
+    )
+
+
+def payments_recorded(db: Session, payments):
+    enqueue_many(
+        db,
+        [
+            (
+                "webhook",
+                "payment.recorded",
+                {"payment_id": payment.id, "invoice_id": payment.invoice_id, "amount": payment.amount},
+            )
+            for payment in payments
+        ],
+    )
+
+
+def _backoff(attempts: int) -> timedelta:
+    return min(BASE_BACKOFF * 2 ** (attempts - 1), MAX_BACKOFF)
+
+
+def _address(messages: list[models.OutboxMessage], db: Session) -> dict[int, str | None]:
+    """Resolve customer email/phone for email and SMS messages with one query."""
+    customer_ids = {m.payload.get("customer_id") for m in messages if m.kind in {"email", "sms"}}
+    customer_ids.discard(None)
+    contacts = {}
+    if customer_ids:
+        contacts = {
+            row.id: row
+            for row in db.query(models.Customer.id, models.Customer.email, models.Customer.phone).filter(
+                models.Customer.id.in_(customer_ids)
+            )
+        }
+    addresses = {}
+    for message in messages:
+        contact = contacts.get(message.payload.get("customer_id"))
+        if message.kind == "email":
+            addresses[message.id] = contact.email if contact else None
+        elif message.kind == "sms":
+            addresses[message.id] = contact.phone if contact else None
+        else:
+            addresses[message.id] = os.getenv("OUTBOX_WEBHOOK_URL", "local")
+    return addresses
+
+
+def dispatch_once(db: Session, batch_size: int = BATCH_SIZE, now: datetime | None = None) -> dict:
+    """Deliver one batch of due messages and record the outcome.
+
+    Due rows are claimed with a conditional UPDATE ... RETURNING so concurrent
+    dispatchers never pick the same message; the claim counts the attempt, so
+    a dispatcher that dies mid-delivery still uses one up. Each sink gets its
+    messages in one call; failures are retried with exponential backoff until
+    MAX_ATTEMPTS. Commits twice (claim, outcome), so `db` must be a session of
+    its own, not a request's.
+    """
+    now = now or datetime.utcnow()
+    due = [
+        message_id
+        for (message_id,) in db.query(models.OutboxMessage.id)
+        .filter(models.OutboxMessage.status == "pending", models.OutboxMessage.next_attempt_at <= now)
+        .order_by(models.OutboxMessage.next_attempt_at, models.OutboxMessage.id)
+        .limit(batch_size)
+    ]
+    summary = {"claimed": 0, "sent": 0, "retried": 0, "failed": 0, "skipped": 0}
+    if not due:
+        return summary
+    claimed = [
+        message_id
+        for (message_id,) in db.execute(
+            update(models.OutboxMessage)
+            .where(
+                models.OutboxMessage.id.in_(due),
+                models.OutboxMessage.status == "pending",
+                models.OutboxMessage.next_attempt_at <= now,
+            )
+            .values(next_attempt_at=now + LEASE, attempts=models.OutboxMessage.attempts + 1)
+            .returning(models.OutboxMessage.id)
+        )
+    ]
+    db.commit()
+    summary["claimed"] = len(claimed)
+    if not claimed:
+        return summary
+
+    messages = (
+        db.query(models.OutboxMessage)
+        .populate_existing()
+        .filter(models.OutboxMessage.id.in_(claimed))
+        .order_by(models.OutboxMessage.id)
+        .all()
+    )
+    addresses = _address(messages, db)
+    attempts = {message.id: message.attempts for message in messages}
+    results = []
+
+    def record(message_id: int, status: str, error: str | None = None, retry_at: datetime | None = None):
+        results.append(
+            {
+                "id": message_id,
+                "status": status,
+                "attempts": attempts[message_id],
+                "next_attempt_at": retry_at or now,
+                "sent_at": datetime.utcnow() if status == "sent" else None,
+                "last_error": error,
+            }
+        )
+        summary["retried" if status == "pending" else status] += 1
+
+    by_kind: dict[str, list[dict]] = {}
+    for message in messages:
+        to = addresses[message.id]
+        if attempts[message.id] > MAX_ATTEMPTS:
+            # The last attempt was claimed but its dispatcher never recorded an outcome.
+            attempts[message.id] = MAX_ATTEMPTS
+            record(message.id, "failed", message.last_error or "Delivery interrupted")
+            continue
+        if to is None:
+            record(message.id, "skipped", "No recipient on file")
+            continue
+        by_kind.setdefault(message.kind, []).append(
+            {"id": message.id, "topic": message.topic, "to": to, "payload": message.payload}
+        )
+
+    for kind, batch in by_kind.items():
+        sink = sinks.get(kind)
+        try:
+            errors = sink.send(batch) if sink else {item["id"]: f"No sink for {kind}" for item in batch}
+        except Exception as exc:
+            logger.exception("Outbox %s sink failed", kind)
+            errors = {item["id"]: str(exc) for item in batch}
+        for item in batch:
+            message_id = item["id"]
+            error = errors.get(message_id)
+            if error is None:
+                record(message_id, "sent")
+            elif attempts[message_id] >= MAX_ATTEMPTS:
+                record(message_id, "failed", error)
+            else:
+                record(message_id, "pending", error, datetime.utcnow() + _backoff(attempts[message_id]))
+
+    db.execute(update(models.OutboxMessage), results)
+    db.commit()
+    return summary
+
+
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+
+
+def _dispatch_loop():
+    while not _stop.is_set():
+        _wake.wait(POLL_SECONDS)
+        _wake.clear()
+        if _stop.is_set():
+            return
+        db = SessionLocal()
+        try:
+            # Keep going while full batches come back so a backlog drains quickly.
+            while dispatch_once(db)["claimed"] == BATCH_SIZE and not _stop.is_set():
+                pass
+        except Exception:
+            logger.exception("Outbox dispatch failed")
+            db.rollback()
+        finally:
+            db.close()
+
+
+def start_dispatcher():
+    global _thread
+    if POLL_SECONDS <= 0 or (_thread is not None and _thread.is_alive()):
+        return
+    _stop.clear()
+    _wake.set()
+    _thread = threading.Thread(target=_dispatch_loop, name="outbox-dispatcher", daemon=True)
+    _thread.start()
+
+
+def stop_dispatcher():
+    _stop.set()
+    _wake.set()
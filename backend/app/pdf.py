@@ -0,0 +1,107 @@
+"""Minimal PDF writer: Letter pages, Helvetica text, rules and a flowing cursor.
+
+Only what invoices and estimates need, so documents can be rendered without
+third-party libraries. Output is deterministic for the same input, which
+keeps cache keys and ETags stable.
+"""
+import zlib
+
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+MARGIN = 54
+
+# Helvetica advance widths (per 1000 units) for the characters that matter
+# when right-aligning amounts; everything else uses an average width.
+_WIDTHS = {**{digit: 556 for digit in "0123456789"}, ".": 278, ",": 278, "$": 556, "-": 333, " ": 278}
+_AVERAGE_WIDTH = 520
+
+
+def text_width(text: str, size: float) -> float:
+    return sum(_WIDTHS.get(char, _AVERAGE_WIDTH) for char in text) * size / 1000
+
+
+def _escape(text: str) -> bytes:
+    raw = text.encode("cp1252", errors="replace")
+    return raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+class Document:
+    def __init__(self):
+        self.pages: list[list[bytes]] = []
+        self.y = 0.0
+        self.new_page()
+
+    def new_page(self):
+        self.pages.append([])
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def ensure_space(self, height: float):
+        if self.y - height < MARGIN:
+            self.new_page()
+
+    def text(self, x: float, y: float, text: str, size: float = 10, bold: bool = False, align: str = "left"):
+        if align == "right":
+            x -= text_width(text, size)
+        font = b"F2" if bold else b"F1"
+        self.pages[-1].append(
+            b"BT /%s %.1f Tf %.2f %.2f Td (%s) Tj ET" % (font, size, x, y, _escape(text))
+        )
+
+    def rule(self, x1: float, y1: float, x2: float, y2: float, width: float = 0.5):
+        self.pages[-1].append(b"%.2f w %.2f %.2f m %.2f %.2f l S" % (width, x1, y1, x2, y2))
+
+    def line(self, text: str = "", size: float = 10, bold: bool = False, x: float = MARGIN, gap: float = 4):
+        """Write one line at the cursor and move it down, breaking pages as needed."""
+        self.ensure_space(size + gap)
+        self.y -= size + gap
+        if text:
+            self.text(x, self.y, text, size=size, bold=bold)
+
+    def paragraph(self, text: str, size: float = 10, width: float = PAGE_WIDTH - 2 * MARGIN):
+        for raw_line in (text or "").splitlines() or [""]:
+            words, current = raw_line.split(), ""
+            for word in words:
+                candidate = f"{current} {word}".strip()
+                if current and text_width(candidate, size) > width:
+                    self.line(current, size=size)
+                    current = word
+                else:
+                    current = candidate
+            self.line(current, size=size)
+
+    def to_bytes(self) -> bytes:
+        objects: list[bytes] = []
+
+        def add(body: bytes) -> int:
+            objects.append(body)
+            return len(objects)
+
+        add(b"<< /Type /Catalog /Pages 2 0 R >>")
+        add(b"")  # page tree, filled in once page ids are known
+        regular = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        bold = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+        page_ids = []
+        for operations in self.pages:
+            stream = zlib.compress(b"\n".join(operations))
+            content = add(b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(stream), stream))
+            page_ids.append(
+                add(
+                    b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+                    b"/Resources << /Font << /F1 %d 0 R /F2 %d 0 R >> >> /Contents %d 0 R >>"
+                    % (PAGE_WIDTH, PAGE_HEIGHT, regular, bold, content)
+                )
+            )
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+        objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+        out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(out))
+            out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+        xref = len(out)
+        out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+        for offset in offsets:
+            out += b"%010d 00000 n \n" % offset
+        out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+        return bytes(out)
@@ -0,0 +1,420 @@
+"""Bank statement reconciliation.
+
+Deposits from a bank export are matched against open invoice balances held
+in memory and indexed three ways: by balance in cents, by customer name
+token, and by issue date. Each deposit is tried as:
+
+- reference: the description names open invoices ("INV 1042", "Invoice #1042")
+  whose balances cover the deposit; a bare "#1042" is usually a check or
+  deposit number, so it does not count
+- exact: one invoice's balance equals the deposit
+- split: several of one named customer's invoices sum to the deposit,
+  found by a bounded subset-sum search over that customer's balances
+- partial: the deposit is less than one named customer's invoice balance
+
+Candidates are scored from 0 to 1 on kind, customer name overlap and how
+close the deposit falls after the invoice date. Deposits are then assigned
+greedily, most confident first, against the balances still open, so two
+deposits never claim the same cents. Proposing writes nothing; `approve`
+posts the approved matches with `crud.record_payments_batch` and records
+each posted line (statement sha256 + line number) in reconciled_lines, so
+re-uploading the statement shows those lines as posted instead of matching
+them again.
+"""
+import bisect
+import hashlib
+import re
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import combinations
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import crud, models, schemas
+
+# Deposits are compared with invoices issued up to this long before them.
+DATE_WINDOW = timedelta(days=120)
+# Subset-sum bounds: at most this many invoices per split, searched among a
+# customer's oldest this-many open invoices, for this many named customers.
+MAX_SPLIT = 4
+MAX_SPLIT_INVOICES = 16
+MAX_NAMED_CUSTOMERS = 5
+CONFIDENT = 0.75
+# Below this a candidate is only offered as an alternative, never chosen.
+MIN_CONFIDENCE = 0.3
+MAX_ALTERNATIVES = 3
+STATUSES = ("matched", "review", "unmatched", "posted")
+
+_DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y")
+_DATE_COLUMNS = ("date", "posted", "posted_date", "transaction_date")
+_AMOUNT_COLUMNS = ("amount", "credit", "deposit")
+_DESCRIPTION_COLUMNS = ("description", "memo", "payee", "name", "details")
+_REFERENCE = re.compile(r"\binv(?:oice)?\.?\s*(?:no\.?\s*|#\s*)?(\d+)\b", re.IGNORECASE)
+_STOPWORDS = {
+    "ach", "and", "check", "co", "company", "corp", "deposit", "from", "inc",
+    "invoice", "llc", "ltd", "mobile", "online", "payment", "the", "transfer",
+}
+
+
+class InvalidStatementLine(ValueError):
+    pass
+
+
+class AlreadyReconciled(ValueError):
+    pass
+
+
+def to_cents(value: str) -> int:
+    text = value.replace("$", "").replace(",", "").strip()
+    negative = text.startswith("(") and text.endswith(")")
+    try:
+        amount = Decimal(text.strip("()"))
+    except InvalidOperation as exc:
+        raise InvalidStatementLine(f"Unreadable amount {value!r}") from exc
+    cents = int((amount * 100).quantize(Decimal(1)))
+    return -cents if negative else cents
+
+
+def _parse_date(value: str) -> date:
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise InvalidStatementLine(f"Unreadable date {value!r}")
+
+
+def _first(row: dict, columns) -> str | None:
+    return next((row[column] for column in columns if row.get(column)), None)
+
+
+def tokens(text: str | None) -> set[str]:
+    words = re.findall(r"[a-z0-9]+", (text or "").lower())
+    return {word for word in words if len(word) >= 3 and not word.isdigit() and word not in _STOPWORDS}
+
+
+class Deposit:
+    def __init__(self, line: int, day: date, cents: int, description: str):
+        self.line = line
+        self.day = day
+        self.cents = cents
+        self.description = description
+        self.tokens = tokens(description)
+        self.references = {int(number) for number in _REFERENCE.findall(description)}
+
+
+def statement_digest(fileobj) -> str:
+    """sha256 of an uploaded statement, rewound for reading; with a line number it names one deposit."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(1 << 16), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def posted_lines(db: Session, statement: str) -> set[int]:
+    return set(
+        db.scalars(select(models.ReconciledLine.line).where(models.ReconciledLine.statement_sha256 == statement))
+    )
+
+
+def parse_statement(raw_lines) -> tuple[list[Deposit], list[dict]]:
+    """Read (line number, row) pairs into deposits; withdrawals are skipped, bad lines rejected."""
+    deposits, rejected = [], []
+    for line, row in raw_lines:
+        try:
+            day, amount = _first(row, _DATE_COLUMNS), _first(row, _AMOUNT_COLUMNS)
+            if day is None or amount is None:
+                raise InvalidStatementLine("Missing date or amount")
+            cents = to_cents(amount)
+            if cents > 0:
+                deposits.append(Deposit(line, _parse_date(day), cents, _first(row, _DESCRIPTION_COLUMNS) or ""))
+        except InvalidStatementLine as exc:
+            rejected.append({"line": line, "status": "rejected", "message": str(exc)})
+    return deposits, rejected
+
+
+class OpenInvoice:
+    __slots__ = ("id", "customer_id", "customer_name", "cents", "issued", "tokens")
+
+    def __init__(self, invoice_id, customer_id, customer_name, cents, issued, name_tokens):
+        self.id = invoice_id
+        self.customer_id = customer_id
+        self.customer_name = customer_name
+        self.cents = cents
+        self.issued = issued
+        self.tokens = name_tokens
+
+
+class InvoiceIndex:
+    """Open balances keyed by cents, name token and customer, plus issue dates in order."""
+
+    def __init__(self, invoices: list[OpenInvoice]):
+        self.by_id = {invoice.id: invoice for invoice in invoices}
+        self.by_cents: dict[int, list[OpenInvoice]] = {}
+        self.by_token: dict[str, set[int]] = {}
+        self.by_customer: dict[int, list[OpenInvoice]] = {}
+        for invoice in sorted(invoices, key=lambda invoice: (invoice.issued, invoice.id)):
+            self.by_cents.setdefault(invoice.cents, []).append(invoice)
+            self.by_customer.setdefault(invoice.customer_id, []).append(invoice)
+            for token in invoice.tokens:
+                self.by_token.setdefault(token, set()).add(invoice.customer_id)
+        self._dated = sorted((invoice.issued, invoice.id) for invoice in invoices)
+
+    @classmethod
+    def load(cls, db: Session) -> "InvoiceIndex":
+        """Every invoice with a balance left, read with one grouped query."""
+        paid = (
+            select(models.Payment.invoice_id, func.sum(models.Payment.amount).label("paid"))
+            .group_by(models.Payment.invoice_id)
+            .subquery()
+        )
+        balance = models.Invoice.total - func.coalesce(paid.c.paid, 0.0)
+        rows = db.execute(
+            select(
+                models.Invoice.id,
+                models.Invoice.customer_id,
+                models.Customer.name,
+                models.Customer.company_name,
+                balance,
+                func.coalesce(models.Invoice.issued_at, models.Invoice.created_at),
+            )
+            .join(models.Customer, models.Customer.id == models.Invoice.customer_id)
+            .outerjoin(paid, paid.c.invoice_id == models.Invoice.id)
+            .where(balance > 0.005)
+        ).all()
+        return cls(
+            [
+                OpenInvoice(
+                    invoice_id,
+                    customer_id,
+                    name,
+                    round(remaining * 100),
+                    issued.date() if issued else date.min,
+                    tokens(name) | tokens(company),
+                )
+                for invoice_id, customer_id, name, company, remaining, issued in rows
+            ]
+        )
+
+    def issued_between(self, start: date, end: date) -> list[OpenInvoice]:
+        first = bisect.bisect_left(self._dated, (start, 0))
+        last = bisect.bisect_right(self._dated, (end, float("inf")))
+        return [self.by_id[invoice_id] for _, invoice_id in self._dated[first:last]]
+
+    def named_customers(self, deposit: Deposit) -> list[tuple[float, int]]:
+        """(name score, customer id) for customers sharing a token with the deposit, best first."""
+        customers = set()
+        for token in deposit.tokens:
+            customers |= self.by_token.get(token, set())
+        scored = [(_name_score(deposit, self.by_customer[customer][0]), customer) for customer in customers]
+        return sorted(scored, reverse=True)[:MAX_NAMED_CUSTOMERS]
+
+
+def _name_score(deposit: Deposit, invoice: OpenInvoice) -> float:
+    if not invoice.tokens:
+        return 0.0
+    return len(deposit.tokens & invoice.tokens) / len(invoice.tokens)
+
+
+def _date_score(deposit: Deposit, invoice: OpenInvoice) -> float:
+    age = deposit.day - invoice.issued
+    if age < timedelta(0) or age > DATE_WINDOW:
+        return 0.0
+    return 1 - age / DATE_WINDOW
+
+
+def _candidate(kind: str, confidence: float, allocations: list[tuple[OpenInvoice, int]]) -> dict:
+    return {"kind": kind, "confidence": round(min(confidence, 1.0), 3), "allocations": allocations}
+
+
+def subset_sum(items: list[OpenInvoice], target: int, max_items: int = MAX_SPLIT) -> list[OpenInvoice] | None:
+    """The fewest `items` (2 to `max_items`) whose cents add up to `target`, oldest first on ties."""
+    for size in range(2, max_items + 1):
+        for combo in combinations(items, size):
+            if sum(invoice.cents for invoice in combo) == target:
+                return list(combo)
+    return None
+
+
+def candidates(deposit: Deposit, index: InvoiceIndex) -> list[dict]:
+    """Every way this deposit could be applied, most confident first."""
+    found = []
+    referenced = [index.by_id[number] for number in sorted(deposit.references) if number in index.by_id]
+    if referenced:
+        name = max(_name_score(deposit, invoice) for invoice in referenced)
+        total = sum(invoice.cents for invoice in referenced)
+        if total == deposit.cents:
+            found.append(_candidate("reference", 0.9 + 0.1 * name, [(inv, inv.cents) for inv in referenced]))
+        elif len(referenced) == 1 and deposit.cents < total:
+            # Part-paying the named invoice is only confident when the payer's name agrees.
+            found.append(_candidate("partial", 0.5 + 0.35 * name, [(referenced[0], deposit.cents)]))
+
+    for invoice in index.by_cents.get(deposit.cents, []):
+        confidence = 0.45 + 0.35 * _name_score(deposit, invoice) + 0.2 * _date_score(deposit, invoice)
+        found.append(_candidate("exact", confidence, [(invoice, invoice.cents)]))
+
+    for name, customer in index.named_customers(deposit):
+        open_invoices = index.by_customer[customer][:MAX_SPLIT_INVOICES]
+        combo = subset_sum([invoice for invoice in open_invoices if invoice.cents < deposit.cents], deposit.cents)
+        if combo:
+            recency = sum(_date_score(deposit, invoice) for invoice in combo) / len(combo)
+            found.append(_candidate("split", 0.35 + 0.4 * name + 0.15 * recency, [(inv, inv.cents) for inv in combo]))
+        for invoice in open_invoices:
+            if invoice.cents > deposit.cents:
+                confidence = 0.2 + 0.4 * name + 0.1 * _date_score(deposit, invoice)
+                found.append(_candidate("partial", confidence, [(invoice, deposit.cents)]))
+
+    if not found:
+        # No name or amount hit: suggest the latest invoices issued before it that it could part-pay.
+        recent = reversed(index.issued_between(deposit.day - DATE_WINDOW, deposit.day))
+        for invoice in [invoice for invoice in recent if invoice.cents > deposit.cents][:MAX_ALTERNATIVES]:
+            confidence = 0.1 + 0.1 * _date_score(deposit, invoice)
+            found.append(_candidate("partial", confidence, [(invoice, deposit.cents)]))
+
+    unique = {}
+    for candidate in sorted(found, key=lambda candidate: -candidate["confidence"]):
+        key = tuple((invoice.id, cents) for invoice, cents in candidate["allocations"])
+        unique.setdefault(key, candidate)
+    return list(unique.values())
+
+
+def _allocation_out(invoice: OpenInvoice, cents: int) -> dict:
+    return {
+        "invoice_id": invoice.id,
+        "customer_id": invoice.customer_id,
+        "customer_name": invoice.customer_name,
+        "amount": cents / 100,
+        "balance": invoice.cents / 100,
+    }
+
+
+def _match_out(candidate: dict) -> dict:
+    return {
+        "kind": candidate["kind"],
+        "confidence": candidate["confidence"],
+        "allocations": [_allocation_out(invoice, cents) for invoice, cents in candidate["allocations"]],
+    }
+
+
+def propose(db: Session, deposits: list[Deposit], statement: str) -> dict:
+    """Match each deposit to open invoices without letting two deposits share a balance.
+
+    A line is "matched" when its chosen match is confident, "review" when it
+    has a weaker one and "unmatched" otherwise; alternatives are listed either
+    way. Lines of this statement approved before are "posted" and not matched.
+    """
+    posted = posted_lines(db, statement)
+    done = [deposit for deposit in deposits if deposit.line in posted]
+    deposits = [deposit for deposit in deposits if deposit.line not in posted]
+    index = InvoiceIndex.load(db)
+    options = {deposit.line: candidates(deposit, index) for deposit in deposits}
+    remaining = {invoice_id: invoice.cents for invoice_id, invoice in index.by_id.items()}
+    chosen = {}
+    best = {line: found[0]["confidence"] if found else 0.0 for line, found in options.items()}
+    for deposit in sorted(deposits, key=lambda deposit: -best[deposit.line]):
+        for candidate in options[deposit.line]:
+            if candidate["confidence"] < MIN_CONFIDENCE:
+                break
+            if all(cents <= remaining[invoice.id] for invoice, cents in candidate["allocations"]):
+                for invoice, cents in candidate["allocations"]:
+                    remaining[invoice.id] -= cents
+                chosen[deposit.line] = candidate
+                break
+
+    results = []
+    for deposit in sorted(deposits + done, key=lambda deposit: deposit.line):
+        match = chosen.get(deposit.line)
+        if deposit.line in posted:
+            status = "posted"
+        elif match is None:
+            status = "unmatched"
+        else:
+            status = "matched" if match["confidence"] >= CONFIDENT else "review"
+        alternatives = [candidate for candidate in options.get(deposit.line, []) if candidate is not match]
+        results.append(
+            {
+                "line": deposit.line,
+                "posted_on": deposit.day,
+                "amount": deposit.cents / 100,
+                "description": deposit.description,
+                "status": status,
+                "match": _match_out(match) if match else None,
+                "alternatives": [_match_out(candidate) for candidate in alternatives[:MAX_ALTERNATIVES]],
+            }
+        )
+    counts = {status: sum(result["status"] == status for result in results) for status in STATUSES}
+    return {**counts, "statement": statement, "lines": results}
+
+
+def _balances(db: Session, invoice_ids: set[int]) -> dict[int, int]:
+    """Current balance in cents of each of these invoices that exists."""
+    paid = (
+        select(models.Payment.invoice_id, func.sum(models.Payment.amount).label("paid"))
+        .where(models.Payment.invoice_id.in_(invoice_ids))
+        .group_by(models.Payment.invoice_id)
+        .subquery()
+    )
+    rows = db.execute(
+        select(models.Invoice.id, models.Invoice.total - func.coalesce(paid.c.paid, 0.0))
+        .outerjoin(paid, paid.c.invoice_id == models.Invoice.id)
+        .where(models.Invoice.id.in_(invoice_ids))
+    )
+    return {invoice_id: round(balance * 100) for invoice_id, balance in rows}
+
+
+def _check(approval: schemas.ReconciliationApproval, balances: dict[int, int], posted: set[int]) -> str | None:
+    """Why this approval cannot be posted against `balances`, or None."""
+    if approval.line in posted:
+        return "Statement line already posted"
+    wanted: dict[int, int] = {}
+    for allocation in approval.allocations:
+        if allocation.amount <= 0:
+            return "Amount must be positive"
+        if allocation.invoice_id not in balances:
+            return "Invoice not found"
+        wanted[allocation.invoice_id] = wanted.get(allocation.invoice_id, 0) + round(allocation.amount * 100)
+    if any(cents > balances[invoice_id] for invoice_id, cents in wanted.items()):
+        return "Amount exceeds the invoice balance"
+    return None
+
+
+def approve(db: Session, statement: str, approvals: list[schemas.ReconciliationApproval], method: str) -> dict:
+    """Post approved matches as payments and record their statement lines; the caller commits.
+
+    A line is rejected whole if it was posted before (or appears twice), or if
+    an allocation is not positive or exceeds what its invoice still owes after
+    the lines before it. Raises AlreadyReconciled if a concurrent approval
+    records one of the same lines first.
+    """
+    balances = _balances(db, {allocation.invoice_id for approval in approvals for allocation in approval.allocations})
+    posted = posted_lines(db, statement)
+    lines, rejected, reconciled = [], [], []
+    for approval in approvals:
+        message = _check(approval, balances, posted)
+        if message:
+            rejected.extend(
+                {"line": approval.line, "status": "rejected", "invoice_id": allocation.invoice_id, "message": message}
+                for allocation in approval.allocations
+            )
+            continue
+        posted.add(approval.line)
+        reconciled.append({"statement_sha256": statement, "line": approval.line, "posted_on": approval.posted_on})
+        for allocation in approval.allocations:
+            balances[allocation.invoice_id] -= round(allocation.amount * 100)
+            payment = schemas.PaymentCreate(
+                invoice_id=allocation.invoice_id,
+                amount=allocation.amount,
+                method=method,
+                paid_at=datetime.combine(approval.posted_on, datetime.min.time()),
+                note=f"Bank deposit, statement line {approval.line}: {approval.description}".rstrip(": "),
+            )
+            lines.append((approval.line, payment))
+    if reconciled:
+        try:
+            db.execute(insert(models.ReconciledLine), reconciled)
+        except IntegrityError as exc:
+            raise AlreadyReconciled("Statement lines were posted by another approval") from exc
+    return crud.record_payments_batch(db, lines, rejected)
@@ -0,0 +1,197 @@
+import calendar
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+from . import events, models
+from .db import SessionLocal, unit_of_work
+
+DEFAULT_HORIZON_DAYS = 365
+FREQUENCIES = {"DAILY", "WEEKLY", "MONTHLY", "YEARLY"}
+
+
+class InvalidRule(ValueError):
+    pass
+
+
+def parse_rule(rule: str) -> dict:
+    """Parse the RRULE subset we support: FREQ, INTERVAL, COUNT and UNTIL.
+
+    e.g. "FREQ=MONTHLY;INTERVAL=3" for quarterly pruning.
+    """
+    text = rule.strip()
+    if text.upper().startswith("RRULE:"):
+        text = text[len("RRULE:"):]
+    parts = {}
+    for chunk in text.split(";"):
+        key, sep, value = chunk.partition("=")
+        if not sep:
+            raise InvalidRule(rule)
+        parts[key.strip().upper()] = value.strip().upper()
+    unknown = set(parts) - {"FREQ", "INTERVAL", "COUNT", "UNTIL"}
+    if unknown or parts.get("FREQ") not in FREQUENCIES:
+        raise InvalidRule(rule)
+    try:
+        interval = int(parts.get("INTERVAL", "1"))
+        count = int(parts["COUNT"]) if "COUNT" in parts else None
+        until = None
+        if "UNTIL" in parts:
+            fmt = "%Y%m%dT%H%M%SZ" if "T" in parts["UNTIL"] else "%Y%m%d"
+            until = datetime.strptime(parts["UNTIL"], fmt)
+            if fmt == "%Y%m%d":
+                until += timedelta(days=1) - timedelta(microseconds=1)
+    except ValueError as exc:
+        raise InvalidRule(rule) from exc
+    if interval < 1 or (count is not None and count < 1):
+        raise InvalidRule(rule)
+    return {"freq": parts["FREQ"], "interval": interval, "count": count, "until": until}
+
+
+def _add_months(ts: datetime, months: int) -> datetime:
+    month_index = ts.month - 1 + months
+    year = ts.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(ts.day, calendar.monthrange(year, month)[1])
+    return ts.replace(year=year, month=month, day=day)
+
+
+def _nth(rule: dict, dtstart: datetime, n: int) -> datetime:
+    step = rule["interval"] * n
+    if rule["freq"] == "DAILY":
+        return dtstart + timedelta(days=step)
+    if rule["freq"] == "WEEKLY":
+        return dtstart + timedelta(weeks=step)
+    if rule["freq"] == "MONTHLY":
+        return _add_months(dtstart, step)
+    return _add_months(dtstart, 12 * step)
+
+
+def _first_index_after(rule: dict, dtstart: datetime, after: datetime) -> int:
+    # Jump close to `after` instead of walking every occurrence since dtstart.
+    if after <= dtstart:
+        return 0
+    if rule["freq"] in {"DAILY", "WEEKLY"}:
+        days = 1 if rule["freq"] == "DAILY" else 7
+        n = (after - dtstart) // timedelta(days=days * rule["interval"])
+    else:
+        months = (after.year - dtstart.year) * 12 + after.month - dtstart.month
+        n = months // ((12 if rule["freq"] == "YEARLY" else 1) * rule["interval"]) - 1
+    return max(int(n), 0)
+
+
+def occurrences(rule: dict, dtstart: datetime, after: datetime, through: datetime):
+    """Yield occurrence starts in (after, through], honouring COUNT and UNTIL."""
+    n = _first_index_after(rule, dtstart, after)
+    while True:
+        if rule["count"] is not None and n >= rule["count"]:
+            return
+        ts = _nth(rule, dtstart, n)
+        if ts > through or (rule["until"] is not None and ts > rule["until"]):
+            return
+        if ts > after:
+            yield ts
+        n += 1
+
+
+def materialize(db: Session, horizon_days: int = DEFAULT_HORIZON_DAYS, now: datetime | None = None) -> dict:
+    """Create jobs for every active template's occurrences up to now + horizon.
+
+    Each template remembers how far it has been materialized, so reruns only
+    add the newly uncovered part of the horizon. Jobs and their tasks are
+    written with one multi-row INSERT each; the caller commits the run in
+    its unit of work, and job events go out once it does.
+    """
+    now = now or datetime.utcnow()
+    through = now + timedelta(days=horizon_days)
+    # Occurrences earlier today still count; anything before that is history.
+    floor = datetime(now.year, now.month, now.day) - timedelta(microseconds=1)
+    templates = (
+        db.query(models.RecurringJobTemplate)
+        .filter(models.RecurringJobTemplate.active.is_(True))
+        .filter(
+            (models.RecurringJobTemplate.materialized_through.is_(None))
+            | (models.RecurringJobTemplate.materialized_through < through)
+        )
+        .all()
+    )
+    job_rows = []
+    tasks_by_template = {}
+    for template in templates:
+        rule = parse_rule(template.rrule)
+        after = max(template.materialized_through or floor, floor)
+        duration = timedelta(minutes=template.duration_minutes) if template.duration_minutes else None
+        tasks_by_template[template.id] = list(template.task_titles or [])
+        for start in occurrences(rule, template.dtstart, after, through):
+            job_rows.append(
+                {
+                    "customer_id": template.customer_id,
+                    "crew_id": template.crew_id,
+                    "sales_rep_id": template.sales_rep_id,
+                    "job_type_id": template.job_type_id,
+                    "status": "scheduled",
+                    "scheduled_start": start,
+                    "scheduled_end": start + duration if duration else None,
+                    "service_address": template.service_address,
+                    "total": template.total,
+                    "notes": template.notes,
+                    "recurring_template_id": template.id,
+                    "occurrence_at": start,
+                }
+            )
+
+    if job_rows:
+        # Guard against a concurrent run that got there first.
+        existing = set(
+            db.query(models.Job.recurring_template_id, models.Job.occurrence_at)
+            .filter(
+                models.Job.recurring_template_id.in_(list(tasks_by_template)),
+                models.Job.occurrence_at > floor,
+            )
+            .all()
+        )
+        job_rows = [row for row in job_rows if (row["recurring_template_id"], row["occurrence_at"]) not in existing]
+
+    created = []
+    task_rows = []
+    if job_rows:
+        # Returned rows carry their template id, so no ordering guarantee is
+        # needed (sort_by_parameter_order would make SQLite insert row by row).
+        created = db.execute(
+            insert(models.Job).returning(
+                models.Job.id,
+                models.Job.recurring_template_id,
+                models.Job.crew_id,
+                models.Job.scheduled_start,
+            ),
+            job_rows,
+        ).all()
+        task_rows = [
+            {"job_id": job.id, "title": title, "sort_order": idx}
+            for job in created
+            for idx, title in enumerate(tasks_by_template[job.recurring_template_id])
+        ]
+        if task_rows:
+            db.execute(insert(models.JobTask), task_rows)
+    if templates:
+        db.execute(
+            update(models.RecurringJobTemplate),
+            [{"id": template.id, "materialized_through": through} for template in templates],
+        )
+    if created:
+        events.publish_jobs_bulk("created", [job._asdict() for job in created], db=db)
+    return {
+        "templates": len(templates),
+        "jobs_created": len(created),
+        "tasks_created": len(task_rows),
+        "through": through,
+    }
+
+
+if __name__ == "__main__":
+    session = SessionLocal()
+    try:
+        with unit_of_work(session):
+            print(materialize(session))
+    finally:
+        session.close()
@@ -0,0 +1,737 @@
+import calendar
+import os
+import statistics
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import and_, case, func, literal, null, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from . import ical, models, rollups, versions
+
+GRANULARITIES = ("day", "week", "month")
+UNASSIGNED = "Unassigned"
+# Entries also expire after this long, bounding staleness from writes made
+# outside the app (scripts, other services) that never bump a data version.
+CACHE_SECONDS = int(os.getenv("REPORT_CACHE_SECONDS", "900"))
+CACHE_ENTRIES = 256
+CACHE_BYTES = int(os.getenv("REPORT_CACHE_BYTES", str(32 * 1024 * 1024)))
+# Ended months rarely change, so their entries outlive CACHE_SECONDS; writes still invalidate them.
+CLOSED_PERIOD_CACHE_SECONDS = int(os.getenv("REPORT_CLOSED_PERIOD_CACHE_SECONDS", str(24 * 3600)))
+
+# Tables each cached report reads; a committed write to any of them invalidates it.
+REPORT_TABLES = {
+    "revenue": (
+        "payments", "invoices", "jobs", "crews", "sales_reps", "job_types", "daily_payments", "rollup_state",
+    ),
+    "estimate_conversion": ("estimates", "daily_estimates", "rollup_state"),
+    "funnel": ("leads", "estimates", "jobs", "invoices", "sales_reps", "job_types"),
+    "utilization": ("jobs", "job_equipment", "crews", "equipment"),
+    "dashboard": (
+        "jobs", "estimates", "invoices", "payments", "daily_payments", "daily_jobs_completed", "rollup_state",
+    ),
+    "sales_reps": ("jobs", "invoices", "payments", "sales_reps", "settings"),
+}
+
+
+class InvalidReport(ValueError):
+    pass
+
+
+class ResultCache:
+    """LRU of serialized report results keyed by report name and normalized parameters.
+
+    Each entry remembers the data versions of its report's tables when it was
+    computed and only answers while they are unchanged. Versions are read
+    before computing, so a write racing the computation makes the entry stale
+    rather than hiding the write. Bounded by entry count and total bytes.
+    """
+
+    def __init__(self, ttl: int = CACHE_SECONDS, max_entries: int = CACHE_ENTRIES, max_bytes: int = CACHE_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, tuple[tuple, float, bytes]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, report: str, params: dict, compute, ttl: int | None = None) -> tuple[bytes, bool]:
+        """Return (body, hit); `compute` returns the serialized body on a miss."""
+        ttl = self.ttl if ttl is None else ttl
+        key = (report, tuple(sorted(params.items())))
+        data_version = versions.current(REPORT_TABLES[report])
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == data_version and entry[1] > now:
+                self._entries.move_to_end(key)
+                return entry[2], True
+        body = compute()
+        if ttl > 0 and len(body) <= self.max_bytes:
+            with self._lock:
+                self._discard(key)
+                self._entries[key] = (data_version, now + ttl, body)
+                self._bytes += len(body)
+                while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                    self._discard(next(iter(self._entries)))
+        return body, False
+
+    def _discard(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[2])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+cache = ResultCache()
+
+
+def bucket_expression(column, granularity: str):
+    """SQL for the start date of the bucket containing `column`, as YYYY-MM-DD."""
+    if granularity == "day":
+        return func.date(column)
+    if granularity == "week":
+        # Weeks start on Monday: jump to the coming Sunday, then back six days.
+        return func.date(column, "weekday 0", "-6 days")
+    if granularity == "month":
+        return func.strftime("%Y-%m-01", column)
+    raise InvalidReport(f"granularity must be one of {', '.join(GRANULARITIES)}")
+
+
+def bucket_start(value: date, granularity: str) -> date:
+    if granularity == "week":
+        return value - timedelta(days=value.weekday())
+    if granularity == "month":
+        return value.replace(day=1)
+    return value
+
+
+def next_bucket(value: date, granularity: str) -> date:
+    if granularity == "month":
+        days = calendar.monthrange(value.year, value.month)[1]
+        return value + timedelta(days=days)
+    return value + timedelta(days=7 if granularity == "week" else 1)
+
+
+def bucket_starts(start: datetime, end: datetime, granularity: str) -> list[date]:
+    """Every bucket overlapping [start, end], so empty ones can be filled with zeros."""
+    current, last = bucket_start(start.date(), granularity), end.date()
+    starts = []
+    while current <= last:
+        starts.append(current)
+        current = next_bucket(current, granularity)
+    return starts
+
+
+# breakdown -> (payment fact column, model whose name labels it; None: the value is its own label)
+REVENUE_BREAKDOWNS = {
+    "method": ("method", None),
+    "crew": ("crew_id", models.Crew),
+    "sales_rep": ("sales_rep_id", models.SalesRep),
+    "job_type": ("job_type_id", models.JobType),
+}
+
+
+def _payment_facts(db: Session, start: datetime, end: datetime, job_dims: bool):
+    """Payments in [start, end] as (at, method, crew_id, sales_rep_id, job_type_id, amount) rows.
+
+    Whole closed days come from the daily_payments rollup and the rest from
+    raw payments, glued with UNION ALL. Raw rows join invoices and jobs only
+    when a job-level column is needed; otherwise the paid_at index covers them.
+    """
+    window = rollups.window(db, start, end, "payments")
+    if job_dims:
+        raw = (
+            select(
+                models.Payment.paid_at.label("at"),
+                models.Payment.method,
+                models.Job.crew_id,
+                models.Job.sales_rep_id,
+                models.Job.job_type_id,
+                models.Payment.amount,
+            )
+            .join(models.Invoice, models.Invoice.id == models.Payment.invoice_id)
+            .outerjoin(models.Job, models.Job.id == models.Invoice.job_id)
+        )
+    else:
+        raw = select(
+            models.Payment.paid_at.label("at"),
+            models.Payment.method,
+            null().label("crew_id"),
+            null().label("sales_rep_id"),
+            null().label("job_type_id"),
+            models.Payment.amount,
+        )
+    raw = raw.where(window.raw(models.Payment.paid_at))
+    if window.days is None:
+        return raw.subquery()
+    daily = models.DailyPayment
+    rolled = select(
+        daily.day.label("at"), daily.method, daily.crew_id, daily.sales_rep_id, daily.job_type_id, daily.amount
+    ).where(window.rolled(daily.day))
+    return union_all(rolled, raw).subquery()
+
+
+def revenue(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    granularity: str | None = None,
+    breakdown: str | None = None,
+) -> dict:
+    """Payments received in [start, end], optionally bucketed and broken down.
+
+    Every bucket and group comes from one GROUP BY over payment facts (daily
+    rollups for closed days plus raw payments for the rest). Buckets with no
+    payments are filled in here, and every bucket lists every group seen in
+    the range so chart series line up.
+    """
+    if breakdown is not None and breakdown not in REVENUE_BREAKDOWNS:
+        raise InvalidReport(f"breakdown must be one of {', '.join(REVENUE_BREAKDOWNS)}")
+    if granularity is not None and granularity not in GRANULARITIES:
+        raise InvalidReport(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    facts = _payment_facts(db, start, end, job_dims=breakdown not in (None, "method"))
+    columns = []
+    if granularity is not None:
+        columns.append(bucket_expression(facts.c.at, granularity).label("bucket"))
+    label_model = None
+    if breakdown is not None:
+        column, label_model = REVENUE_BREAKDOWNS[breakdown]
+        key = facts.c[column]
+        columns += [key.label("key"), (label_model.name if label_model else key).label("label")]
+    statement = select(*columns, func.sum(facts.c.amount).label("total")).select_from(facts)
+    if label_model is not None:
+        statement = statement.outerjoin(label_model, label_model.id == key)
+    if columns:
+        statement = statement.group_by(*columns)
+    rows = db.execute(statement).all()
+
+    report = {
+        "start": start,
+        "end": end,
+        "granularity": granularity,
+        "breakdown": breakdown,
+        "total_revenue": round(sum(row.total or 0.0 for row in rows), 2),
+        "groups": [],
+        "buckets": [],
+    }
+    groups: dict = {}
+    if breakdown is not None:
+        for row in rows:
+            group = groups.setdefault(row.key, {"key": row.key, "label": row.label or UNASSIGNED, "total": 0.0})
+            group["total"] += row.total or 0.0
+        report["groups"] = sorted(groups.values(), key=lambda group: -group["total"])
+        for group in report["groups"]:
+            group["total"] = round(group["total"], 2)
+    if granularity is None:
+        return report
+
+    totals: dict[date, dict] = {}
+    for row in rows:
+        by_key = totals.setdefault(date.fromisoformat(row.bucket), {})
+        key = row.key if breakdown is not None else None
+        by_key[key] = by_key.get(key, 0.0) + (row.total or 0.0)
+    for bucket in bucket_starts(start, end, granularity):
+        by_key = totals.get(bucket, {})
+        report["buckets"].append(
+            {
+                "start": bucket,
+                "total": round(sum(by_key.values()), 2),
+                "groups": [
+                    {"key": group["key"], "label": group["label"], "total": round(by_key.get(group["key"], 0.0), 2)}
+                    for group in report["groups"]
+                ],
+            }
+        )
+    return report
+
+
+# name -> inclusive upper bound in days past the basis date (None: no bound)
+AGING_BUCKETS = {"days_0_30": 30, "days_31_60": 60, "days_61_90": 90, "days_90_plus": None}
+AGING_BASES = ("due", "issued")
+
+
+def aging(
+    db: Session,
+    as_of: datetime | None = None,
+    basis: str = "due",
+    limit: int = 100,
+    offset: int = 0,
+) -> dict:
+    """Open receivables per customer, split into 30-day age buckets.
+
+    A balance is the invoice total less payments made by `as_of`; invoices
+    issued after `as_of` are ignored. Age is whole days from the due date
+    (falling back to the issue date) or, with basis="issued", from the issue
+    date; not-yet-due balances count as 0-30. Balances, buckets and per-customer
+    sums are all computed in SQL, and the grand totals ride along on the page
+    query as window aggregates.
+    """
+    if basis not in AGING_BASES:
+        raise InvalidReport(f"basis must be one of {', '.join(AGING_BASES)}")
+    as_of = as_of or datetime.utcnow()
+    paid = (
+        select(models.Payment.invoice_id, func.sum(models.Payment.amount).label("paid"))
+        .where(models.Payment.paid_at <= as_of)
+        .group_by(models.Payment.invoice_id)
+        .subquery()
+    )
+    issued = func.coalesce(models.Invoice.issued_at, models.Invoice.created_at)
+    anchor = func.coalesce(models.Invoice.due_date, issued) if basis == "due" else issued
+    balance = models.Invoice.total - func.coalesce(paid.c.paid, 0.0)
+    # Age in whole days is compared via per-bucket cutoffs so SQL never parses dates.
+    today = datetime.combine(as_of.date(), datetime.min.time())
+    bucket = case(
+        *[
+            (anchor >= today - timedelta(days=upper), name)
+            for name, upper in AGING_BUCKETS.items()
+            if upper is not None
+        ],
+        else_="days_90_plus",
+    )
+    open_invoices = (
+        select(models.Invoice.customer_id, balance.label("balance"), bucket.label("bucket"))
+        .outerjoin(paid, paid.c.invoice_id == models.Invoice.id)
+        .where(issued <= as_of, balance > 0.005)
+        .subquery()
+    )
+    sums = [
+        func.sum(case((open_invoices.c.bucket == name, open_invoices.c.balance), else_=0.0)).label(name)
+        for name in AGING_BUCKETS
+    ]
+    per_customer = (
+        select(
+            open_invoices.c.customer_id,
+            func.count().label("invoices"),
+            func.sum(open_invoices.c.balance).label("total"),
+            *sums,
+        )
+        .group_by(open_invoices.c.customer_id)
+        .subquery()
+    )
+    columns = ["total", *AGING_BUCKETS]
+    rows = db.execute(
+        select(
+            per_customer,
+            models.Customer.name.label("customer_name"),
+            func.count().over().label("total_customers"),
+            *[func.sum(per_customer.c[column]).over().label(f"all_{column}") for column in columns],
+        )
+        .join(models.Customer, models.Customer.id == per_customer.c.customer_id)
+        .order_by(per_customer.c.total.desc(), per_customer.c.customer_id)
+        .limit(limit)
+        .offset(offset)
+    ).all()
+    if rows:
+        first = rows[0]
+        total_customers = first.total_customers
+        totals = {column: getattr(first, f"all_{column}") for column in columns}
+    else:
+        # Past the last page: the window aggregates had no rows to ride on.
+        summary = db.execute(
+            select(func.count(), *[func.sum(per_customer.c[column]) for column in columns])
+        ).one()
+        total_customers = summary[0]
+        totals = dict(zip(columns, summary[1:]))
+
+    return {
+        "as_of": as_of,
+        "basis": basis,
+        "limit": limit,
+        "offset": offset,
+        "total_customers": total_customers,
+        "totals": {column: round(value or 0.0, 2) for column, value in totals.items()},
+        "customers": [
+            {
+                "customer_id": row.customer_id,
+                "customer_name": row.customer_name,
+                "invoices": row.invoices,
+                **{column: round(getattr(row, column) or 0.0, 2) for column in columns},
+            }
+            for row in rows
+        ],
+    }
+
+
+FUNNEL_STAGES = ("leads", "estimates", "approved", "jobs", "invoiced", "paid")
+
+
+def _funnel_counts(leads: list) -> dict:
+    counts = {stage: 0 for stage in FUNNEL_STAGES}
+    hours = []
+    for lead in leads:
+        for stage in FUNNEL_STAGES:
+            counts[stage] += 1 if stage == "leads" else getattr(lead, stage)
+        if lead.hours_to_approve is not None:
+            hours.append(lead.hours_to_approve)
+    counts["median_hours_to_approve"] = round(statistics.median(hours), 2) if hours else None
+    counts["conversion_rate"] = round(counts["paid"] / counts["leads"], 4) if counts["leads"] else 0.0
+    return counts
+
+
+def _funnel_groups(leads: list, key: str, label: str) -> list[dict]:
+    grouped: dict = {}
+    for lead in leads:
+        grouped.setdefault(getattr(lead, key), (getattr(lead, label), []))[1].append(lead)
+    groups = [
+        {"key": group_key, "label": group_label or UNASSIGNED, **_funnel_counts(members)}
+        for group_key, (group_label, members) in grouped.items()
+    ]
+    return sorted(groups, key=lambda group: (-group["leads"], group["label"]))
+
+
+def _flag(condition):
+    """1 if any joined row for the group satisfies `condition`."""
+    return func.max(case((condition, 1), else_=0))
+
+
+def funnel(db: Session, start: datetime, end: datetime) -> dict:
+    """Lead -> estimate -> approved -> job -> invoiced -> paid for leads created in [start, end].
+
+    One statement collapses each lead's estimates, jobs and invoices into
+    stage flags plus hours from estimate creation to its first approval, and
+    joins rep and job type names. The overall funnel and the breakdowns by
+    sales rep, job type and lead source are tallied from those rows in one
+    pass. Rep and job type live on jobs, so leads that never became a job
+    count as Unassigned there.
+    """
+    approved = (models.Estimate.status == "approved") | models.Estimate.approved_at.isnot(None)
+    per_lead = (
+        select(
+            models.Lead.id,
+            models.Lead.source,
+            _flag(models.Estimate.id.isnot(None)).label("estimates"),
+            _flag(approved).label("approved"),
+            _flag(models.Job.id.isnot(None)).label("jobs"),
+            _flag(models.Invoice.id.isnot(None)).label("invoiced"),
+            _flag(models.Invoice.status == "paid").label("paid"),
+            func.min(
+                case(
+                    (
+                        models.Estimate.approved_at.isnot(None),
+                        (func.julianday(models.Estimate.approved_at) - func.julianday(models.Estimate.created_at)) * 24,
+                    )
+                )
+            ).label("hours_to_approve"),
+            func.max(models.Job.sales_rep_id).label("sales_rep_id"),
+            func.max(models.Job.job_type_id).label("job_type_id"),
+        )
+        .outerjoin(models.Estimate, models.Estimate.lead_id == models.Lead.id)
+        .outerjoin(models.Job, models.Job.estimate_id == models.Estimate.id)
+        .outerjoin(models.Invoice, models.Invoice.job_id == models.Job.id)
+        .where(models.Lead.created_at >= start, models.Lead.created_at <= end)
+        .group_by(models.Lead.id)
+        .subquery()
+    )
+    leads = db.execute(
+        select(
+            per_lead,
+            models.SalesRep.name.label("sales_rep"),
+            models.JobType.name.label("job_type"),
+        )
+        .outerjoin(models.SalesRep, models.SalesRep.id == per_lead.c.sales_rep_id)
+        .outerjoin(models.JobType, models.JobType.id == per_lead.c.job_type_id)
+    ).all()
+    return {
+        "start": start,
+        "end": end,
+        "generated_at": datetime.utcnow(),
+        "overall": _funnel_counts(leads),
+        "by_sales_rep": _funnel_groups(leads, "sales_rep_id", "sales_rep"),
+        "by_job_type": _funnel_groups(leads, "job_type_id", "job_type"),
+        "by_source": _funnel_groups(leads, "source", "source"),
+    }
+
+
+MAX_UTILIZATION_DAYS = 366
+GRID_BLOCK_ROWS = 4096
+
+
+def _interval_hours(
+    rows, start: datetime, days: int, capacity: np.ndarray | None = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """Per-day hours each (key, scheduled_start, scheduled_end) row covers in the window.
+
+    Returns (keys, hours) where hours is rows x days. Intervals are clipped to
+    each day with one broadcast min/max, then to that day's `capacity` when
+    given; jobs without a usable end last ical.DEFAULT_DURATION, as on the
+    calendar feeds.
+    """
+    keys = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    starts = np.empty(len(rows))
+    ends = np.empty(len(rows))
+    for index, (_, begin, finish) in enumerate(rows):
+        if finish is None or finish <= begin:
+            finish = begin + ical.DEFAULT_DURATION
+        starts[index] = (begin - start).total_seconds() / 3600
+        ends[index] = (finish - start).total_seconds() / 3600
+    edges = np.arange(days + 1) * 24.0
+    hours = np.minimum(ends[:, None], edges[None, 1:]) - np.maximum(starts[:, None], edges[None, :-1])
+    hours = np.clip(hours, 0.0, None)
+    if capacity is not None:
+        hours = np.minimum(hours, capacity[None, :])
+    return keys, hours
+
+
+def _grid(ids: list[int], rows, start: datetime, days: int, capacity: np.ndarray | None = None) -> np.ndarray:
+    """Sum per-row day hours into an ids x days matrix, a block of rows at a time to bound memory."""
+    grid = np.zeros((len(ids), days))
+    position = {key: index for index, key in enumerate(ids)}
+    for offset in range(0, len(rows), GRID_BLOCK_ROWS):
+        keys, hours = _interval_hours(rows[offset : offset + GRID_BLOCK_ROWS], start, days, capacity)
+        indexes = np.array([position.get(int(key), -1) for key in keys])
+        known = indexes >= 0
+        np.add.at(grid, indexes[known], hours[known])
+    return grid
+
+
+def utilization(db: Session, start: date, end: date, hours_per_day: float = 8.0) -> dict:
+    """Scheduled vs. available crew hours and equipment use per day for [start, end].
+
+    Available hours are `hours_per_day` on weekdays and zero on weekends.
+    Scheduled hours come from non-canceled jobs' scheduled_start/scheduled_end
+    clipped to each day and then to that day's available hours, so a job
+    spanning several days counts one working day per weekday; equipment use comes from the same jobs through
+    JobEquipment, and an equipment idle day is a weekday with no use. The
+    crews x days and equipment x days matrices are computed with NumPy; the
+    response carries them as compact per-row lists plus weekly rollups.
+    """
+    days = (end - start).days + 1
+    if days < 1 or days > MAX_UTILIZATION_DAYS:
+        raise InvalidReport(f"Range must cover 1 to {MAX_UTILIZATION_DAYS} days")
+    window_start = datetime.combine(start, datetime.min.time())
+    window_end = window_start + timedelta(days=days)
+    overlapping = (
+        models.Job.status != "canceled",
+        models.Job.scheduled_start.isnot(None),
+        models.Job.scheduled_start < window_end,
+        or_(
+            models.Job.scheduled_end > window_start,
+            models.Job.scheduled_start > window_start - ical.DEFAULT_DURATION,
+        ),
+    )
+    crew_rows = db.execute(
+        select(models.Job.crew_id, models.Job.scheduled_start, models.Job.scheduled_end).where(
+            models.Job.crew_id.isnot(None), *overlapping
+        )
+    ).all()
+    equipment_rows = db.execute(
+        select(models.JobEquipment.equipment_id, models.Job.scheduled_start, models.Job.scheduled_end)
+        .join(models.Job, models.Job.id == models.JobEquipment.job_id)
+        .where(*overlapping)
+    ).all()
+    crews = db.query(models.Crew.id, models.Crew.name).order_by(models.Crew.name, models.Crew.id).all()
+    equipment = (
+        db.query(models.Equipment.id, models.Equipment.name, models.Equipment.status)
+        .order_by(models.Equipment.name, models.Equipment.id)
+        .all()
+    )
+
+    dates = [start + timedelta(days=offset) for offset in range(days)]
+    weekday = np.array([day.weekday() < 5 for day in dates])
+    available = np.where(weekday, hours_per_day, 0.0)
+    # Week index of each day, weeks starting on Monday.
+    first_monday = start - timedelta(days=start.weekday())
+    week_of_day = np.array([(day - first_monday).days // 7 for day in dates])
+    weeks = [first_monday + timedelta(weeks=index) for index in range(int(week_of_day[-1]) + 1)]
+    membership = np.eye(len(weeks))[week_of_day]  # days x weeks
+    weekly_available = available @ membership
+
+    crew_grid = _grid([crew.id for crew in crews], crew_rows, window_start, days, available)
+    equipment_grid = _grid([item.id for item in equipment], equipment_rows, window_start, days)
+    weekly_scheduled = crew_grid @ membership
+    total_available = float(available.sum())
+
+    def ratio(scheduled, capacity):
+        return np.round(np.divide(scheduled, capacity, out=np.zeros_like(scheduled), where=capacity > 0), 4)
+
+    return {
+        "start": start,
+        "end": end,
+        "hours_per_day": hours_per_day,
+        "days": dates,
+        "available_hours": available.round(2).tolist(),
+        "weeks": weeks,
+        "weekly_available_hours": weekly_available.round(2).tolist(),
+        "crews": [
+            {
+                "crew_id": crew.id,
+                "name": crew.name,
+                "scheduled_hours": crew_grid[index].round(2).tolist(),
+                "weekly_scheduled_hours": weekly_scheduled[index].round(2).tolist(),
+                "weekly_utilization": ratio(weekly_scheduled[index], weekly_available).tolist(),
+                "total_scheduled_hours": round(float(crew_grid[index].sum()), 2),
+                "utilization": round(float(crew_grid[index].sum()) / total_available, 4) if total_available else 0.0,
+            }
+            for index, crew in enumerate(crews)
+        ],
+        "equipment": [
+            {
+                "equipment_id": item.id,
+                "name": item.name,
+                "status": item.status,
+                "used_hours": equipment_grid[index].round(2).tolist(),
+                "idle_days": int(np.count_nonzero(weekday & (equipment_grid[index] == 0))),
+            }
+            for index, item in enumerate(equipment)
+        ],
+    }
+
+
+def estimate_conversion(db: Session, start: datetime, end: datetime) -> dict:
+    """Estimates created in [start, end] and how many are approved, from rollups plus raw rows."""
+    window = rollups.window(db, start, end, "estimates")
+    facts = select(models.Estimate.status, literal(1).label("estimates")).where(
+        window.raw(models.Estimate.created_at)
+    )
+    if window.days is not None:
+        daily = models.DailyEstimate
+        facts = union_all(select(daily.status, daily.estimates).where(window.rolled(daily.day)), facts)
+    facts = facts.subquery()
+    total, approved = db.execute(
+        select(
+            func.coalesce(func.sum(facts.c.estimates), 0),
+            func.coalesce(func.sum(case((facts.c.status == "approved", facts.c.estimates), else_=0)), 0),
+        )
+    ).one()
+    return {
+        "start": start,
+        "end": end,
+        "total_estimates": total,
+        "approved_estimates": approved,
+        "conversion_rate": (approved / total) if total else 0.0,
+    }
+
+
+def completed_jobs(db: Session, start: datetime, end: datetime) -> tuple[int, float]:
+    """(count, summed total) of jobs completed in [start, end], from rollups plus raw rows."""
+    window = rollups.window(db, start, end, "jobs_completed")
+    facts = select(literal(1).label("jobs"), models.Job.total).where(
+        models.Job.status == "completed", window.raw(models.Job.completed_at)
+    )
+    if window.days is not None:
+        daily = models.DailyJobCompletion
+        facts = union_all(select(daily.jobs, daily.total).where(window.rolled(daily.day)), facts)
+    facts = facts.subquery()
+    jobs, total = db.execute(
+        select(func.coalesce(func.sum(facts.c.jobs), 0), func.coalesce(func.sum(facts.c.total), 0.0))
+    ).one()
+    return jobs, total
+
+
+COMMISSION_BASES = ("booked", "completed", "invoiced", "collected")
+DEFAULT_COMMISSION_RULES = {"basis": "collected", "tiers": []}
+
+
+def commission(amount: float, tiers: list[dict]) -> float:
+    """Marginal tiered commission: each rate applies to the part of `amount` between its threshold and the next."""
+    ordered = sorted(tiers, key=lambda tier: tier["threshold"])
+    earned = 0.0
+    for index, tier in enumerate(ordered):
+        upper = ordered[index + 1]["threshold"] if index + 1 < len(ordered) else amount
+        if amount > tier["threshold"]:
+            earned += (min(amount, upper) - tier["threshold"]) * tier["rate"]
+    return round(earned, 2)
+
+
+def closed_period(end: datetime, today: date | None = None) -> bool:
+    """True when [.., end] lies wholly in months that have ended."""
+    month_start = (today or date.today()).replace(day=1)
+    return end < datetime.combine(month_start, datetime.min.time())
+
+
+def sales_reps(db: Session, start: datetime, end: datetime, rank_by: str = "collected") -> dict:
+    """Booked, completed, invoiced and collected amounts per sales rep, with commissions.
+
+    Booked counts non-canceled jobs created in [start, end], completed those
+    completed in it, invoiced the invoices issued in it and collected the
+    payments received in it, all attributed through the job's sales rep. One
+    grouped statement joins jobs to their in-period invoice and payment totals,
+    each pre-summed per job so a job with several invoices or payments is
+    still one row. Commissions follow each rep's rules, or Settings.commission_rules.
+    """
+    if rank_by not in COMMISSION_BASES:
+        raise InvalidReport(f"rank_by must be one of {', '.join(COMMISSION_BASES)}")
+
+    def within(column):
+        return and_(column >= start, column <= end)
+
+    invoiced = (
+        select(models.Invoice.job_id, func.sum(models.Invoice.total).label("amount"))
+        .where(within(func.coalesce(models.Invoice.issued_at, models.Invoice.created_at)))
+        .group_by(models.Invoice.job_id)
+        .subquery()
+    )
+    collected = (
+        select(models.Invoice.job_id, func.sum(models.Payment.amount).label("amount"))
+        .join(models.Invoice, models.Invoice.id == models.Payment.invoice_id)
+        .where(within(models.Payment.paid_at))
+        .group_by(models.Invoice.job_id)
+        .subquery()
+    )
+    booked = and_(within(models.Job.created_at), models.Job.status != "canceled")
+    completed = within(models.Job.completed_at)
+    activity = (
+        select(
+            models.Job.sales_rep_id,
+            func.sum(case((booked, 1), else_=0)).label("booked_jobs"),
+            func.sum(case((booked, models.Job.total), else_=0.0)).label("booked"),
+            func.sum(case((completed, 1), else_=0)).label("completed_jobs"),
+            func.sum(case((completed, models.Job.total), else_=0.0)).label("completed"),
+            func.sum(func.coalesce(invoiced.c.amount, 0.0)).label("invoiced"),
+            func.sum(func.coalesce(collected.c.amount, 0.0)).label("collected"),
+        )
+        .outerjoin(invoiced, invoiced.c.job_id == models.Job.id)
+        .outerjoin(collected, collected.c.job_id == models.Job.id)
+        .where(
+            models.Job.sales_rep_id.isnot(None),
+            or_(booked, completed, invoiced.c.amount.isnot(None), collected.c.amount.isnot(None)),
+        )
+        .group_by(models.Job.sales_rep_id)
+        .subquery()
+    )
+    metrics = ["booked_jobs", "booked", "completed_jobs", "completed", "invoiced", "collected"]
+    rows = db.execute(
+        select(
+            models.SalesRep.id,
+            models.SalesRep.name,
+            models.SalesRep.commission_rules,
+            *[func.coalesce(activity.c[metric], 0) for metric in metrics],
+        ).outerjoin(activity, activity.c.sales_rep_id == models.SalesRep.id)
+    ).all()
+    default_rules = db.query(models.Settings.commission_rules).scalar() or DEFAULT_COMMISSION_RULES
+
+    reps = []
+    for rep_id, name, rules, *values in rows:
+        totals = dict(zip(metrics, values))
+        rules = rules or default_rules
+        basis = rules.get("basis", "collected")
+        base = round(totals[basis], 2)
+        reps.append(
+            {
+                "sales_rep_id": rep_id,
+                "name": name,
+                **{metric: round(value, 2) for metric, value in totals.items()},
+                "commission_basis": basis,
+                "commission_base": base,
+                "commission": commission(base, rules.get("tiers", [])),
+            }
+        )
+    reps.sort(key=lambda rep: (-rep[rank_by], rep["name"]))
+    for rank, rep in enumerate(reps, start=1):
+        rep["rank"] = rank
+    return {
+        "start": start,
+        "end": end,
+        "rank_by": rank_by,
+        "closed": closed_period(end),
+        "reps": reps,
+        "total_commission": round(sum(rep["commission"] for rep in reps), 2),
+    }
@@ -0,0 +1,317 @@
+"""Daily rollups of payments, estimates and completed jobs.
+
+Reports read these for whole days up to RollupState.closed_through and raw
+rows for anything later (today) or for partial days at the edges of a range.
+
+A refresh re-rolls two sets of days: days closed since the last refresh, and
+older days that are stale. A day is stale when it holds a source row updated
+after the high-water mark, or when a row left it (a payment's paid_at edited
+to another day, or the row deleted); commits record those old days in
+rollup_dirty_days. Each re-rolled day is deleted and rebuilt with one
+INSERT ... SELECT per table. Until then reports read stale days from raw rows.
+"""
+import argparse
+import logging
+import os
+import threading
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import and_, delete, event, func, insert, inspect, or_, select, union
+from sqlalchemy.orm import Session
+
+from . import models
+from .db import SessionLocal, unit_of_work
+
+logger = logging.getLogger(__name__)
+
+# Writes stamped just before a refresh may commit just after it; re-reading
+# this far behind the mark catches them (re-rolling a day is idempotent).
+CLOCK_SKEW = timedelta(minutes=5)
+REFRESH_SECONDS = int(os.getenv("ROLLUP_REFRESH_SECONDS", "3600"))
+
+
+def _midnight(day: date) -> datetime:
+    return datetime.combine(day, time())
+
+
+class Window:
+    """Split an inclusive [start, end] range into whole rolled-up days and raw edges.
+
+    Stale days inside the rolled range are read from raw rows as well.
+    """
+
+    def __init__(self, start: datetime, end: datetime, closed_through: date | None, stale=()):
+        self.start = start
+        self.end = end
+        first = start.date() if start == _midnight(start.date()) else start.date() + timedelta(days=1)
+        # The last day whose every instant is <= end.
+        last = (end + timedelta(microseconds=1)).date() - timedelta(days=1)
+        if closed_through is not None:
+            last = min(last, closed_through)
+        self.days = (first, last) if closed_through is not None and first <= last else None
+        self.stale = sorted(day for day in stale if self.days and first <= day <= last)
+
+    def rolled(self, day_column):
+        first, last = self.days
+        clause = and_(day_column >= first, day_column <= last)
+        return and_(clause, day_column.notin_(self.stale)) if self.stale else clause
+
+    def raw(self, column):
+        if self.days is None:
+            return and_(column >= self.start, column <= self.end)
+        first, last = self.days
+        return or_(
+            and_(column >= self.start, column < _midnight(first)),
+            and_(column >= _midnight(last + timedelta(days=1)), column <= self.end),
+            *(and_(column >= _midnight(day), column < _midnight(day + timedelta(days=1))) for day in self.stale),
+        )
+
+
+def closed_through(db: Session) -> date | None:
+    return db.query(models.RollupState.closed_through).scalar()
+
+
+def _recorded(db: Session, name: str) -> list[tuple[int, date]]:
+    return (
+        db.query(models.RollupDirtyDay.id, models.RollupDirtyDay.day)
+        .filter(models.RollupDirtyDay.rollup == name)
+        .all()
+    )
+
+
+def window(db: Session, start: datetime, end: datetime, name: str) -> Window:
+    """The Window for rollup `name`, with the days it has not re-rolled yet marked stale."""
+    state = db.query(models.RollupState).first()
+    if state is None or state.closed_through is None:
+        return Window(start, end, None)
+    stale = {day for _, day in _recorded(db, name)}
+    if state.high_water_mark is not None:
+        dirty_days = ROLLUPS[name][3]
+        stale.update(
+            date.fromisoformat(day)
+            for (day,) in db.execute(dirty_days(state.high_water_mark - CLOCK_SKEW))
+            if day is not None
+        )
+    return Window(start, end, state.closed_through, stale)
+
+
+def _payment_rows(day_filter):
+    day = func.date(models.Payment.paid_at)
+    return (
+        select(
+            day,
+            models.Payment.method,
+            models.Job.crew_id,
+            models.Job.sales_rep_id,
+            models.Job.job_type_id,
+            func.count(models.Payment.id),
+            func.sum(models.Payment.amount),
+        )
+        .join(models.Invoice, models.Invoice.id == models.Payment.invoice_id)
+        .outerjoin(models.Job, models.Job.id == models.Invoice.job_id)
+        .where(day_filter(models.Payment.paid_at, day))
+        .group_by(day, models.Payment.method, models.Job.crew_id, models.Job.sales_rep_id, models.Job.job_type_id)
+    )
+
+
+def _payment_days(since: datetime):
+    # A payment's crew, rep and type come from its job, so job edits dirty its payment days too.
+    return union(
+        select(func.date(models.Payment.paid_at)).where(models.Payment.updated_at > since),
+        select(func.date(models.Payment.paid_at))
+        .join(models.Invoice, models.Invoice.id == models.Payment.invoice_id)
+        .join(models.Job, models.Job.id == models.Invoice.job_id)
+        .where(models.Job.updated_at > since),
+    )
+
+
+def _estimate_rows(day_filter):
+    day = func.date(models.Estimate.created_at)
+    return (
+        select(day, models.Estimate.status, func.count(models.Estimate.id), func.sum(models.Estimate.total))
+        .where(day_filter(models.Estimate.created_at, day))
+        .group_by(day, models.Estimate.status)
+    )
+
+
+def _estimate_days(since: datetime):
+    return select(func.date(models.Estimate.created_at)).where(models.Estimate.updated_at > since).distinct()
+
+
+def _job_rows(day_filter):
+    day = func.date(models.Job.completed_at)
+    return (
+        select(day, models.Job.job_type_id, models.Job.crew_id, func.count(models.Job.id), func.sum(models.Job.total))
+        .where(models.Job.status == "completed", day_filter(models.Job.completed_at, day))
+        .group_by(day, models.Job.job_type_id, models.Job.crew_id)
+    )
+
+
+def _job_days(since: datetime):
+    return (
+        select(func.date(models.Job.completed_at))
+        .where(models.Job.updated_at > since, models.Job.completed_at.isnot(None))
+        .distinct()
+    )
+
+
+# name -> (rollup table, its columns in INSERT order, grouped source rows, dirty days since a mark)
+ROLLUPS = {
+    "payments": (
+        models.DailyPayment,
+        ["day", "method", "crew_id", "sales_rep_id", "job_type_id", "payments", "amount"],
+        _payment_rows,
+        _payment_days,
+    ),
+    "estimates": (models.DailyEstimate, ["day", "status", "estimates", "total"], _estimate_rows, _estimate_days),
+    "jobs_completed": (
+        models.DailyJobCompletion,
+        ["day", "job_type_id", "crew_id", "jobs", "total"],
+        _job_rows,
+        _job_days,
+    ),
+}
+
+
+def refresh(db: Session, now: datetime | None = None, full: bool = False) -> dict:
+    """Bring the rollups up to date through yesterday; the caller commits."""
+    now = now or datetime.utcnow()
+    today = now.date()
+    state = db.query(models.RollupState).first()
+    if state is None:
+        state = models.RollupState()
+        db.add(state)
+    incremental = not full and state.high_water_mark is not None and state.closed_through is not None
+    first_new = state.closed_through + timedelta(days=1) if incremental else None
+    summary = {"full": not incremental, "closed_through": today - timedelta(days=1), "days": {}, "rows": {}}
+
+    for name, (table, columns, source_rows, dirty_days) in ROLLUPS.items():
+        recorded = _recorded(db, name)
+        if recorded:
+            db.execute(delete(models.RollupDirtyDay).where(models.RollupDirtyDay.id.in_([id for id, _ in recorded])))
+        if incremental:
+            dirty = sorted(
+                {
+                    date.fromisoformat(day)
+                    for (day,) in db.execute(dirty_days(state.high_water_mark - CLOCK_SKEW))
+                    if day is not None and day < first_new.isoformat()
+                }
+                | {day for _, day in recorded if day < first_new}
+            )
+            labels = [day.isoformat() for day in dirty]
+
+            def day_filter(column, day, labels=labels):
+                return or_(day.in_(labels), and_(column >= _midnight(first_new), column < _midnight(today)))
+
+            db.execute(
+                delete(table).where(
+                    or_(table.day.in_(dirty), and_(table.day >= first_new, table.day < today))
+                )
+            )
+            summary["days"][name] = len(dirty) + max((today - first_new).days, 0)
+        else:
+
+            def day_filter(column, day):
+                return column < _midnight(today)
+
+            db.execute(delete(table))
+            summary["days"][name] = None
+        result = db.execute(insert(table).from_select(columns, source_rows(day_filter)))
+        summary["rows"][name] = result.rowcount
+
+    state.high_water_mark = now
+    state.closed_through = summary["closed_through"]
+    state.refreshed_at = now
+    db.flush()
+    return summary
+
+
+# model -> (rollup it feeds, the column that picks its day)
+TRACKED = {
+    models.Payment: ("payments", "paid_at"),
+    models.Estimate: ("estimates", "created_at"),
+    models.Job: ("jobs_completed", "completed_at"),
+}
+
+
+def _left_days(obj, column: str, deleted: bool) -> list[datetime]:
+    """Days `obj` no longer counts towards: its previous day if it moved, its day if deleted."""
+    values = list(inspect(obj).attrs[column].history.deleted)
+    if deleted:
+        values.append(getattr(obj, column))
+    return [value for value in values if value is not None]
+
+
+@event.listens_for(Session, "after_flush")
+def _record_left_days(session: Session, flush_context):
+    today = datetime.utcnow().date()
+    pending = session.info.setdefault("rollup_dirty_days", set())
+    for obj in [*session.dirty, *session.deleted]:
+        tracked = TRACKED.get(type(obj))
+        if tracked is None:
+            continue
+        name, column = tracked
+        for value in _left_days(obj, column, obj in session.deleted):
+            # Today and later are never rolled up yet.
+            if value.date() < today:
+                pending.add((name, value.date()))
+
+
+@event.listens_for(Session, "before_commit")
+def _write_left_days(session: Session):
+    if session.new or session.dirty or session.deleted:
+        session.flush()
+    pending = session.info.pop("rollup_dirty_days", None)
+    if pending:
+        now = datetime.utcnow()
+        session.execute(
+            insert(models.RollupDirtyDay),
+            [{"rollup": name, "day": day, "marked_at": now} for name, day in sorted(pending)],
+        )
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session: Session):
+    session.info.pop("rollup_dirty_days", None)
+
+
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+
+
+def _refresh_loop():
+    while not _stop.is_set():
+        db = SessionLocal()
+        try:
+            with unit_of_work(db):
+                refresh(db)
+        except Exception:
+            logger.exception("Rollup refresh failed")
+        finally:
+            db.close()
+        _stop.wait(REFRESH_SECONDS)
+
+
+def start_background_refresh():
+    global _thread
+    if REFRESH_SECONDS <= 0 or (_thread is not None and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_refresh_loop, name="rollups", daemon=True)
+    _thread.start()
+
+
+def stop_background_refresh():
+    _stop.set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the daily report rollups.")
+    parser.add_argument("--full", action="store_true", help="rebuild every day instead of only changed ones")
+    args = parser.parse_args()
+    session = SessionLocal()
+    try:
+        print(refresh(session, full=args.full))
+        session.commit()
+    finally:
+        session.close()
@@ -1,5 +1,5 @@
-from datetime import datetime
-from typing import Optional, List
+from datetime import date, datetime
+from typing import Any, Dict, Optional, List
 from pydantic import BaseModel
 
 
@@ -60,15 +60,43 @@ class CustomerUpdate(BaseModel):
     tags: Optional[List[str]] = None
 
 
+class CustomerSummaryOut(BaseModel):
+    job_count: int
+    last_job_at: Optional[datetime] = None
+    invoice_count: int
+    invoiced_total: float
+    lifetime_revenue: float
+    open_balance: float
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
 class CustomerOut(CustomerBase):
     id: int
     created_at: datetime
     updated_at: datetime
+    summary: Optional[CustomerSummaryOut] = None
 
     class Config:
         from_attributes = True
 
 
+class ImportRowError(BaseModel):
+    row: int
+    message: str
+
+
+class ImportResultOut(BaseModel):
+    processed: int
+    inserted: int
+    duplicates: int
+    failed: int
+    errors: List[ImportRowError] = []
+    errors_truncated: bool = False
+
+
 class LeadBase(BaseModel):
     customer_id: int
     source: Optional[str] = None
@@ -190,6 +218,7 @@ class EstimateConvertRequest(BaseModel):
     scheduled_start: Optional[datetime] = None
     scheduled_end: Optional[datetime] = None
     crew_id: Optional[int] = None
+    job_type_id: Optional[int] = None
     notes: str = ""
     status: str = "scheduled"
     tasks: List[JobTaskCreate] = []
@@ -264,6 +293,7 @@ class JobOut(JobBase):
     created_at: datetime
     updated_at: datetime
     completed_at: Optional[datetime] = None
+    recurring_template_id: Optional[int] = None
     tasks: List[JobTaskOut] = []
     equipment_ids: List[int] = []
 
@@ -271,6 +301,112 @@ class JobOut(JobBase):
         from_attributes = True
 
 
+class JobBulkUpdate(BaseModel):
+    job_ids: List[int]
+    shift_days: int = 0
+    crew_id: Optional[int] = None
+    status: Optional[str] = None
+    allow_conflicts: bool = False
+
+
+class ScheduleConflictOut(BaseModel):
+    crew_id: int
+    job_id: int
+    conflicting_job_id: int
+
+
+class JobBulkUpdateOut(BaseModel):
+    applied: bool
+    jobs: List[JobOut] = []
+    conflicts: List[ScheduleConflictOut] = []
+
+
+class RecurringJobTemplateBase(BaseModel):
+    customer_id: int
+    crew_id: Optional[int] = None
+    sales_rep_id: Optional[int] = None
+    job_type_id: Optional[int] = None
+    rrule: str
+    dtstart: datetime
+    duration_minutes: Optional[int] = None
+    service_address: str = ""
+    total: float = 0.0
+    notes: str = ""
+    task_titles: List[str] = []
+    active: bool = True
+
+
+class RecurringJobTemplateCreate(RecurringJobTemplateBase):
+    pass
+
+
+class RecurringJobTemplateUpdate(BaseModel):
+    crew_id: Optional[int] = None
+    sales_rep_id: Optional[int] = None
+    job_type_id: Optional[int] = None
+    rrule: Optional[str] = None
+    duration_minutes: Optional[int] = None
+    service_address: Optional[str] = None
+    total: Optional[float] = None
+    notes: Optional[str] = None
+    task_titles: Optional[List[str]] = None
+    active: Optional[bool] = None
+
+
+class RecurringJobTemplateOut(RecurringJobTemplateBase):
+    id: int
+    materialized_through: Optional[datetime] = None
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class MaterializeOut(BaseModel):
+    templates: int
+    jobs_created: int
+    tasks_created: int
+    through: datetime
+
+
+class BillingRunRequest(BaseModel):
+    dry_run: bool = False
+    completed_before: Optional[datetime] = None
+    due_in_days: Optional[int] = None
+
+
+class BillingRunInvoiceOut(BaseModel):
+    invoice_id: Optional[int] = None
+    job_id: int
+    customer_id: int
+    subtotal: float
+    tax: float
+    total: float
+
+
+class BillingRunOut(BaseModel):
+    dry_run: bool
+    tax_rate: float
+    jobs: int
+    invoices_created: int
+    subtotal: float
+    tax: float
+    total: float
+    invoices: List[BillingRunInvoiceOut] = []
+
+
+class DurationEstimateOut(BaseModel):
+    job_type_id: Optional[int] = None
+    crew_id: Optional[int] = None
+    basis: Optional[str] = None
+    samples: int = 0
+    p50_hours: Optional[float] = None
+    p80_hours: Optional[float] = None
+    p90_hours: Optional[float] = None
+    trained_at: Optional[datetime] = None
+
+
 class InvoiceBase(BaseModel):
     customer_id: int
     job_id: int
@@ -327,6 +463,84 @@ class PaymentOut(PaymentBase):
         from_attributes = True
 
 
+class PaymentBatchIn(BaseModel):
+    payments: List[Dict[str, Any]]
+
+
+class PaymentBatchLineOut(BaseModel):
+    line: int
+    status: str
+    invoice_id: Optional[int] = None
+    message: Optional[str] = None
+
+
+class InvoicePaymentStatusOut(BaseModel):
+    invoice_id: int
+    status: str
+    paid: float
+    balance: float
+
+
+class PaymentBatchOut(BaseModel):
+    posted: int
+    rejected: int
+    results: List[PaymentBatchLineOut] = []
+    invoices: List[InvoicePaymentStatusOut] = []
+
+
+class ReconciliationAllocationOut(BaseModel):
+    invoice_id: int
+    customer_id: int
+    customer_name: str
+    amount: float
+    balance: float
+
+
+class ReconciliationMatchOut(BaseModel):
+    kind: str
+    confidence: float
+    allocations: List[ReconciliationAllocationOut]
+
+
+class ReconciliationLineOut(BaseModel):
+    line: int
+    posted_on: date
+    amount: float
+    description: str
+    status: str
+    match: Optional[ReconciliationMatchOut] = None
+    alternatives: List[ReconciliationMatchOut] = []
+
+
+class ReconciliationOut(BaseModel):
+    matched: int
+    review: int
+    unmatched: int
+    posted: int = 0
+    # sha256 of the uploaded file; approvals send it back to name the statement.
+    statement: str
+    lines: List[ReconciliationLineOut]
+    rejected: List[PaymentBatchLineOut] = []
+
+
+class ReconciliationAllocationIn(BaseModel):
+    invoice_id: int
+    amount: float
+
+
+class ReconciliationApproval(BaseModel):
+    line: int
+    posted_on: date
+    description: str = ""
+    allocations: List[ReconciliationAllocationIn]
+
+
+class ReconciliationApproveIn(BaseModel):
+    statement: str
+    method: str = "bank"
+    matches: List[ReconciliationApproval]
+
+
 class InvoiceOut(InvoiceBase):
     id: int
     created_at: datetime
@@ -410,11 +624,22 @@ class EquipmentOut(EquipmentBase):
         from_attributes = True
 
 
+class CommissionTier(BaseModel):
+    threshold: float = 0.0
+    rate: float
+
+
+class CommissionRules(BaseModel):
+    basis: str = "collected"
+    tiers: List[CommissionTier] = []
+
+
 class SalesRepBase(BaseModel):
     name: str
     email: str = ""
     phone: str = ""
     notes: str = ""
+    commission_rules: Optional[CommissionRules] = None
 
 
 class SalesRepCreate(SalesRepBase):
@@ -426,6 +651,7 @@ class SalesRepUpdate(BaseModel):
     email: Optional[str] = None
     phone: Optional[str] = None
     notes: Optional[str] = None
+    commission_rules: Optional[CommissionRules] = None
 
 
 class SalesRepOut(SalesRepBase):
@@ -466,7 +692,10 @@ class AttachmentCreate(BaseModel):
 
 class AttachmentOut(AttachmentCreate):
     id: int
+    sha256: Optional[str] = None
+    filename: Optional[str] = None
     created_at: datetime
+    updated_at: datetime
 
     class Config:
         from_attributes = True
@@ -477,6 +706,7 @@ class SettingsOut(BaseModel):
     company_name: str
     company_logo_url: str
     default_tax_rate: float
+    commission_rules: Optional[CommissionRules] = None
     created_at: datetime
     updated_at: datetime
 
@@ -488,6 +718,80 @@ class SettingsUpdate(BaseModel):
     company_name: Optional[str] = None
     company_logo_url: Optional[str] = None
     default_tax_rate: Optional[float] = None
+    commission_rules: Optional[CommissionRules] = None
+
+
+class SyncJobTaskOut(JobTaskOut):
+    job_id: int
+
+
+class TombstoneOut(BaseModel):
+    entity_type: str
+    entity_id: int
+    deleted_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class SyncOut(BaseModel):
+    token: str
+    jobs: List[JobOut] = []
+    tasks: List[SyncJobTaskOut] = []
+    customers: List[CustomerOut] = []
+    equipment: List[EquipmentOut] = []
+    attachments: List[AttachmentOut] = []
+    deleted: List[TombstoneOut] = []
+
+
+class TaskCreate(BaseModel):
+    name: str
+    payload: Dict[str, Any] = {}
+    priority: str = "default"
+    max_attempts: int = 3
+
+
+class TaskOut(BaseModel):
+    id: int
+    name: str
+    status: str
+    priority: int
+    attempts: int
+    max_attempts: int
+    payload: Dict[str, Any]
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    available_at: datetime
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+class OutboxMessageOut(BaseModel):
+    id: int
+    kind: str
+    topic: str
+    payload: Dict[str, Any]
+    status: str
+    attempts: int
+    next_attempt_at: datetime
+    last_error: Optional[str] = None
+    created_at: datetime
+    sent_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+class OutboxDispatchOut(BaseModel):
+    claimed: int
+    sent: int
+    retried: int
+    failed: int
+    skipped: int
 
 
 class DashboardOut(BaseModel):
@@ -500,10 +804,26 @@ class DashboardOut(BaseModel):
     avg_job_value: float
 
 
+class RevenueGroupOut(BaseModel):
+    key: Optional[int | str] = None
+    label: str
+    total: float
+
+
+class RevenueBucketOut(BaseModel):
+    start: date
+    total: float
+    groups: List[RevenueGroupOut] = []
+
+
 class RevenueReportOut(BaseModel):
     start: datetime
     end: datetime
     total_revenue: float
+    granularity: Optional[str] = None
+    breakdown: Optional[str] = None
+    groups: List[RevenueGroupOut] = []
+    buckets: List[RevenueBucketOut] = []
 
 
 class OutstandingInvoiceOut(BaseModel):
@@ -514,6 +834,86 @@ class OutstandingInvoiceOut(BaseModel):
     status: str
 
 
+class AgingTotalsOut(BaseModel):
+    total: float
+    days_0_30: float
+    days_31_60: float
+    days_61_90: float
+    days_90_plus: float
+
+
+class AgingCustomerOut(AgingTotalsOut):
+    customer_id: int
+    customer_name: str
+    invoices: int
+
+
+class AgingReportOut(BaseModel):
+    as_of: datetime
+    basis: str
+    limit: int
+    offset: int
+    total_customers: int
+    totals: AgingTotalsOut
+    customers: List[AgingCustomerOut]
+
+
+class FunnelCountsOut(BaseModel):
+    leads: int
+    estimates: int
+    approved: int
+    jobs: int
+    invoiced: int
+    paid: int
+    median_hours_to_approve: Optional[float] = None
+    conversion_rate: float
+
+
+class FunnelGroupOut(FunnelCountsOut):
+    key: Optional[int | str] = None
+    label: str
+
+
+class FunnelReportOut(BaseModel):
+    start: datetime
+    end: datetime
+    generated_at: datetime
+    overall: FunnelCountsOut
+    by_sales_rep: List[FunnelGroupOut]
+    by_job_type: List[FunnelGroupOut]
+    by_source: List[FunnelGroupOut]
+
+
+class CrewUtilizationOut(BaseModel):
+    crew_id: int
+    name: str
+    scheduled_hours: List[float]
+    weekly_scheduled_hours: List[float]
+    weekly_utilization: List[float]
+    total_scheduled_hours: float
+    utilization: float
+
+
+class EquipmentUtilizationOut(BaseModel):
+    equipment_id: int
+    name: str
+    status: str
+    used_hours: List[float]
+    idle_days: int
+
+
+class UtilizationReportOut(BaseModel):
+    start: date
+    end: date
+    hours_per_day: float
+    days: List[date]
+    available_hours: List[float]
+    weeks: List[date]
+    weekly_available_hours: List[float]
+    crews: List[CrewUtilizationOut]
+    equipment: List[EquipmentUtilizationOut]
+
+
 class EstimateConversionOut(BaseModel):
     start: datetime
     end: datetime
@@ -522,6 +922,52 @@ class EstimateConversionOut(BaseModel):
     conversion_rate: float
 
 
+class SnapshotExportRequest(BaseModel):
+    format: Optional[str] = None
+
+
+class SnapshotTableOut(BaseModel):
+    file: str
+    rows: int
+    columns: Dict[str, str]
+
+
+class SnapshotOut(BaseModel):
+    id: str
+    created_at: datetime
+    format: str
+    tables: Dict[str, SnapshotTableOut]
+
+
+class SnapshotManifestOut(BaseModel):
+    latest: Optional[str] = None
+    snapshots: List[SnapshotOut]
+
+
+class SalesRepStandingOut(BaseModel):
+    rank: int
+    sales_rep_id: int
+    name: str
+    booked_jobs: int
+    booked: float
+    completed_jobs: int
+    completed: float
+    invoiced: float
+    collected: float
+    commission_basis: str
+    commission_base: float
+    commission: float
+
+
+class SalesRepReportOut(BaseModel):
+    start: datetime
+    end: datetime
+    rank_by: str
+    closed: bool
+    reps: List[SalesRepStandingOut]
+    total_commission: float
+
+
 # AI
 class AiEstimateRequest(BaseModel):
     lead_id: Optional[int] = None
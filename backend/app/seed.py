@@ -10,12 +10,23 @@ from .security import hash_password
 
 def clear_data(db: Session):
     for model in [
+        models.CustomerSummary,
+        models.RollupState,
+        models.DailyPayment,
+        models.DailyEstimate,
+        models.DailyJobCompletion,
+        models.BackgroundTask,
+        models.OutboxMessage,
+        models.IdempotencyKey,
+        models.Tombstone,
         models.Attachment,
+        models.Blob,
         models.Payment,
         models.Invoice,
         models.JobEquipment,
         models.JobTask,
         models.Job,
+        models.RecurringJobTemplate,
         models.EstimateLineItem,
         models.Estimate,
         models.Lead,
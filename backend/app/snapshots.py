@@ -0,0 +1,177 @@
+"""Columnar snapshots of the analytics tables for BI tools and notebooks.
+
+An export streams jobs, estimates, line items, invoices and payments out of
+the database a chunk of rows at a time, straight from Core selects (no ORM
+objects, no Pydantic), into one file per table with typed columns: Parquet or
+Arrow IPC when pyarrow is installed, CSV otherwise. Each export lands in its
+own directory, renamed into place once complete, and manifest.json lists the
+snapshots kept, newest last, with row counts and column types, so analysts
+read files and never the API.
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+from datetime import date, datetime
+from pathlib import Path
+
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, JSON, select
+from sqlalchemy.orm import Session
+
+from . import models
+from .db import SessionLocal
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Installs without pyarrow (see requirements.txt) write snapshots as CSV.
+    pa = None
+
+ROOT = Path(os.getenv("SNAPSHOT_DIR", "/data/snapshots"))
+CHUNK_ROWS = 10_000
+KEEP = max(int(os.getenv("SNAPSHOT_KEEP", "7")), 1)
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+DEFAULT_FORMAT = os.getenv("SNAPSHOT_FORMAT", "parquet")
+
+TABLES = {
+    "jobs": models.Job,
+    "estimates": models.Estimate,
+    "estimate_line_items": models.EstimateLineItem,
+    "invoices": models.Invoice,
+    "payments": models.Payment,
+}
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def column_type(column) -> str:
+    """Arrow type name for a column; CSV readers cast with the same names from the manifest."""
+    kind = column.type
+    if isinstance(kind, Boolean):
+        return "bool"
+    if isinstance(kind, Integer):
+        return "int64"
+    if isinstance(kind, Float):
+        return "float64"
+    if isinstance(kind, DateTime):
+        return "timestamp[us]"
+    if isinstance(kind, Date):
+        return "date32"
+    return "string"
+
+
+def _cell(column, value):
+    if value is not None and isinstance(column.type, JSON):
+        return json.dumps(value)
+    return value
+
+
+def _csv_cell(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return "" if value is None else value
+
+
+def _chunks(db: Session, table):
+    result = db.execute(select(*table.columns).order_by(*table.primary_key).execution_options(yield_per=CHUNK_ROWS))
+    for rows in result.partitions():
+        yield [[_cell(column, value) for column, value in zip(table.columns, row)] for row in rows]
+
+
+def _write_arrow(db: Session, table, path: Path, fmt: str) -> int:
+    schema = pa.schema([(column.name, pa.type_for_alias(column_type(column))) for column in table.columns])
+    writer = pq.ParquetWriter(path, schema, compression="zstd") if fmt == "parquet" else pa.ipc.new_file(path, schema)
+    written = 0
+    try:
+        for rows in _chunks(db, table):
+            columns = list(zip(*rows))
+            batch = pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+            )
+            writer.write_batch(batch)  # one row group / record batch per chunk
+            written += len(rows)
+    finally:
+        writer.close()
+    return written
+
+
+def _write_csv(db: Session, table, path: Path) -> int:
+    written = 0
+    with open(path, "w", newline="") as handle:
+        writer = csv.writer(handle)
+        writer.writerow([column.name for column in table.columns])
+        for rows in _chunks(db, table):
+            writer.writerows([_csv_cell(value) for value in row] for row in rows)
+            written += len(rows)
+    return written
+
+
+def read_manifest() -> dict:
+    try:
+        return json.loads((ROOT / "manifest.json").read_text())
+    except FileNotFoundError:
+        return {"snapshots": []}
+
+
+def _write_manifest(manifest: dict):
+    tmp = ROOT / "manifest.json.tmp"
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, ROOT / "manifest.json")
+
+
+def export(db: Session, fmt: str | None = None, now: datetime | None = None) -> dict:
+    """Write a new snapshot and record it in the manifest; returns its manifest entry.
+
+    Without pyarrow a Parquet or Arrow request falls back to CSV. Snapshots
+    beyond the newest KEEP are deleted.
+    """
+    fmt = fmt or DEFAULT_FORMAT
+    if fmt not in FORMATS:
+        raise SnapshotError(f"format must be one of {', '.join(FORMATS)}")
+    if pa is None:
+        fmt = "csv"
+    now = now or datetime.utcnow()
+    snapshot_id = now.strftime("%Y%m%dT%H%M%S%fZ")
+    staging = ROOT / f"{snapshot_id}.tmp"
+    staging.mkdir(parents=True)
+    tables = {}
+    try:
+        for name, model in TABLES.items():
+            table = model.__table__
+            filename = name + FORMATS[fmt]
+            if fmt == "csv":
+                rows = _write_csv(db, table, staging / filename)
+            else:
+                rows = _write_arrow(db, table, staging / filename, fmt)
+            tables[name] = {
+                "file": f"{snapshot_id}/{filename}",
+                "rows": rows,
+                "columns": {column.name: column_type(column) for column in table.columns},
+            }
+        os.replace(staging, ROOT / snapshot_id)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    entry = {"id": snapshot_id, "created_at": now.isoformat(), "format": fmt, "tables": tables}
+    manifest = read_manifest()
+    snapshots = manifest["snapshots"] + [entry]
+    kept, dropped = snapshots[-KEEP:], snapshots[:-KEEP]
+    _write_manifest({"latest": snapshot_id, "snapshots": kept})
+    for old in dropped:
+        shutil.rmtree(ROOT / old["id"], ignore_errors=True)
+    return entry
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a columnar snapshot of the analytics tables.")
+    parser.add_argument("--format", choices=list(FORMATS), default=None)
+    args = parser.parse_args()
+    session = SessionLocal()
+    try:
+        print(json.dumps(export(session, args.format), indent=2))
+    finally:
+        session.close()
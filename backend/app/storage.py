@@ -0,0 +1,244 @@
+"""Content-addressed file storage for attachments.
+
+Uploads are streamed to a temp file while being hashed, and renamed to
+blobs/<sha256[:2]>/<sha256> only once the transaction recording them
+commits; a rejected or rolled-back upload leaves nothing behind. A file that
+is already stored is not written twice, so the same photo attached to an
+estimate and a job shares one blob. Thumbnails and previews are derived
+later by a background task.
+"""
+import hashlib
+import mimetypes
+import os
+import tempfile
+from pathlib import Path
+
+from python_multipart.multipart import FormParser, parse_options_header
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+from .db import after_commit, after_rollback
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Installs without Pillow (see requirements.txt) store blobs but make no previews.
+    Image = None
+
+ROOT = Path(os.getenv("ATTACHMENT_STORAGE_DIR", "/data/attachments"))
+CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(50 * 1024 * 1024)))
+# Longest edge in pixels for each derived image.
+VARIANTS = {"thumbnail": 256, "preview": 1600}
+
+_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"%PDF-", "application/pdf"),
+]
+
+
+# Only these are served inline. Anything else (HTML or SVG guessed from the
+# filename, PDFs) is a download, so an upload cannot run script on our origin.
+INLINE_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp"}
+
+
+class UploadError(ValueError):
+    pass
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def blob_path(sha256: str) -> Path:
+    return ROOT / "blobs" / sha256[:2] / sha256
+
+
+def variant_path(sha256: str, variant: str) -> Path:
+    return ROOT / variant / sha256[:2] / f"{sha256}.jpg"
+
+
+def sniff_content_type(head: bytes, filename: str | None) -> str:
+    for signature, content_type in _SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    guessed, _ = mimetypes.guess_type(filename or "")
+    return guessed or "application/octet-stream"
+
+
+class BlobWriter:
+    """Receives one multipart file part, writing it to disk and hashing it as it arrives."""
+
+    def __init__(self, file_name: bytes | None, field_name: bytes | None = None):
+        self.filename = os.path.basename((file_name or b"").decode("utf-8", errors="replace")) or None
+        self.field_name = (field_name or b"").decode()
+        self.size = 0
+        self.sha256: str | None = None
+        self.content_type = "application/octet-stream"
+        self._head = b""
+        self._hash = hashlib.sha256()
+        tmp_dir = ROOT / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, self._tmp = tempfile.mkstemp(dir=tmp_dir)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.size > MAX_UPLOAD_BYTES:
+            raise UploadError(f"File exceeds {MAX_UPLOAD_BYTES} bytes")
+        if len(self._head) < 16:
+            self._head += data[: 16 - len(self._head)]
+        self._hash.update(data)
+        self._file.write(data)
+        return len(data)
+
+    def finalize(self):
+        if self.sha256 is not None:  # the parser finalizes the last part twice
+            return
+        self._file.close()
+        self.sha256 = self._hash.hexdigest()
+        self.content_type = sniff_content_type(self._head, self.filename)
+
+    def promote(self):
+        """Move the finished file to its blob path, unless that blob is already stored."""
+        target = blob_path(self.sha256)
+        if target.exists():
+            os.unlink(self._tmp)
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(self._tmp, target)
+
+    def close(self):
+        """Drop the temp file of a part that was never promoted."""
+        self._file.close()
+        if os.path.exists(self._tmp):
+            os.unlink(self._tmp)
+
+
+async def receive_upload(request) -> tuple[dict[str, str], list[BlobWriter]]:
+    """Parse a multipart body chunk by chunk, storing file parts as blobs.
+
+    Returns the plain form fields and one finished BlobWriter per file part.
+    Disk writes happen off the event loop; nothing holds a whole file in memory.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise UploadError("Expected a multipart/form-data body")
+    fields: dict[str, str] = {}
+    files: list[BlobWriter] = []
+    opened: list[BlobWriter] = []
+
+    def open_file(file_name, field_name, config=None):
+        writer = BlobWriter(file_name, field_name)
+        opened.append(writer)
+        return writer
+
+    parser = FormParser(
+        "multipart/form-data",
+        on_field=lambda field: fields.__setitem__(field.field_name.decode(), (field.value or b"").decode()),
+        on_file=files.append,
+        boundary=options[b"boundary"],
+        FileClass=open_file,
+    )
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                await run_in_threadpool(parser.write, chunk)
+        parser.finalize()
+    except UploadError:
+        raise
+    except Exception as exc:
+        raise UploadError(f"Malformed multipart body: {exc}") from exc
+    finally:
+        for writer in opened:
+            if writer not in files:
+                writer.close()
+    return fields, files
+
+
+def store(db: Session, upload: BlobWriter) -> tuple[models.Blob, bool]:
+    """Record the blob row for a finished upload; returns (blob, created).
+
+    The file is moved into place when the transaction commits and deleted if
+    it rolls back. The row is inserted with ON CONFLICT DO NOTHING, so losing
+    the race to a concurrent upload of the same file just re-reads the
+    winner's row and leaves the rest of the transaction alone.
+    """
+    blob = db.query(models.Blob).filter(models.Blob.sha256 == upload.sha256).first()
+    created = False
+    if blob is None:
+        previews = "pending" if upload.content_type.startswith("image/") and Image is not None else "unsupported"
+        dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+        inserted = db.execute(
+            dialect.insert(models.Blob)
+            .values(sha256=upload.sha256, size=upload.size, content_type=upload.content_type, previews=previews)
+            .on_conflict_do_nothing(index_elements=["sha256"])
+            .returning(models.Blob.id)
+        ).first()
+        created = inserted is not None
+        blob = db.query(models.Blob).filter(models.Blob.sha256 == upload.sha256).one()
+    after_commit(db, upload.promote)
+    after_rollback(db, upload.close)
+    return blob, created
+
+
+def make_previews(sha256: str) -> list[str]:
+    """Write a downscaled JPEG for each variant; returns the variants written."""
+    if Image is None:
+        raise RuntimeError("Pillow is not installed")
+    with Image.open(blob_path(sha256)) as source:
+        image = ImageOps.exif_transpose(source).convert("RGB")
+    written = []
+    for variant, edge in VARIANTS.items():
+        scaled = image.copy()
+        scaled.thumbnail((edge, edge))
+        target = variant_path(sha256, variant)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_suffix(".tmp")
+        scaled.save(tmp, "JPEG", quality=85, optimize=True)
+        os.replace(tmp, target)
+        written.append(variant)
+    return written
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """Resolve a single `bytes=` range to inclusive offsets.
+
+    Returns None when the whole file should be sent (no header, a syntax we
+    do not handle, or several ranges) and raises RangeNotSatisfiable when the
+    range lies outside the file.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[6:].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            start, end = max(size - int(end_text), 0), size - 1
+    except ValueError:
+        return None
+    if start > end and end_text and start_text:
+        return None
+    if start >= size or (not start_text and not int(end_text)):
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
+
+
+def iter_file(path: Path, start: int, end: int):
+    with open(path, "rb") as handle:
+        handle.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = handle.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
@@ -0,0 +1,209 @@
+"""Per-customer account summaries: job count, last job, invoiced total,
+lifetime revenue and open balance, stored in customer_summaries.
+
+Writes to jobs, invoices and payments mark their customers on the session;
+just before the transaction commits, those customers' rows are recomputed
+with one grouped INSERT ... SELECT, so the customer list can sort by lifetime
+value without aggregating per request. ORM flushes and set-based statements
+whose parameters carry customer, invoice or row ids are picked up
+automatically; a set-based write that names its rows only in a WHERE clause
+must call `mark`. `python -m app.summaries` rebuilds every row.
+"""
+from datetime import datetime
+
+from sqlalchemy import DateTime, case, delete, event, func, insert, inspect, literal, select, true
+from sqlalchemy.orm import Session
+
+from . import models
+from .db import SessionLocal
+
+# Keeps IN lists well under SQLite's bound-parameter limit.
+CHUNK_SIZE = 500
+
+COLUMNS = [
+    "customer_id",
+    "job_count",
+    "last_job_at",
+    "invoice_count",
+    "invoiced_total",
+    "lifetime_revenue",
+    "open_balance",
+    "updated_at",
+]
+# table -> the model whose writes dirty a summary
+TRACKED = {"jobs": models.Job, "invoices": models.Invoice, "payments": models.Payment}
+
+
+def _pending(session: Session) -> dict[str, set]:
+    if "summary_pending" not in session.info:
+        session.info["summary_pending"] = {"customers": set(), "jobs": set(), "invoices": set(), "payments": set()}
+    return session.info["summary_pending"]
+
+
+def mark(db: Session, customers=(), jobs=(), invoices=(), payments=()):
+    """Have the summaries of these customers (or of the rows' customers) recomputed at commit."""
+    pending = _pending(db)
+    pending["customers"].update(customers)
+    pending["jobs"].update(jobs)
+    pending["invoices"].update(invoices)
+    pending["payments"].update(payments)
+
+
+def _chunks(ids):
+    ids = sorted(ids)
+    for offset in range(0, len(ids), CHUNK_SIZE):
+        yield ids[offset : offset + CHUNK_SIZE]
+
+
+def _resolve(db: Session, pending: dict[str, set]) -> set[int]:
+    customers = set(pending["customers"])
+    invoices = set(pending["invoices"])
+    for chunk in _chunks(pending["payments"]):
+        invoices.update(db.scalars(select(models.Payment.invoice_id).where(models.Payment.id.in_(chunk))))
+    for model, ids in ((models.Job, pending["jobs"]), (models.Invoice, invoices)):
+        for chunk in _chunks(ids):
+            customers.update(db.scalars(select(model.customer_id).where(model.id.in_(chunk))))
+    customers.discard(None)
+    return customers
+
+
+def _summary_rows(customer_filter, invoice_filter, job_filter, now: datetime):
+    paid = (
+        select(models.Payment.invoice_id, func.sum(models.Payment.amount).label("paid"))
+        .join(models.Invoice, models.Invoice.id == models.Payment.invoice_id)
+        .where(invoice_filter)
+        .group_by(models.Payment.invoice_id)
+        .subquery()
+    )
+    invoice_paid = func.coalesce(paid.c.paid, 0.0)
+    invoices = (
+        select(
+            models.Invoice.customer_id,
+            func.count(models.Invoice.id).label("invoices"),
+            func.sum(models.Invoice.total).label("invoiced"),
+            func.sum(invoice_paid).label("paid"),
+            func.sum(
+                case((models.Invoice.total > invoice_paid, models.Invoice.total - invoice_paid), else_=0.0)
+            ).label("balance"),
+        )
+        .outerjoin(paid, paid.c.invoice_id == models.Invoice.id)
+        .where(invoice_filter)
+        .group_by(models.Invoice.customer_id)
+        .subquery()
+    )
+    jobs = (
+        select(
+            models.Job.customer_id,
+            func.count(models.Job.id).label("jobs"),
+            func.max(models.Job.completed_at).label("last_job_at"),
+        )
+        .where(models.Job.status != "canceled", job_filter)
+        .group_by(models.Job.customer_id)
+        .subquery()
+    )
+    return (
+        select(
+            models.Customer.id,
+            func.coalesce(jobs.c.jobs, 0),
+            jobs.c.last_job_at,
+            func.coalesce(invoices.c.invoices, 0),
+            func.coalesce(invoices.c.invoiced, 0.0),
+            func.coalesce(invoices.c.paid, 0.0),
+            func.coalesce(invoices.c.balance, 0.0),
+            literal(now, DateTime),
+        )
+        .outerjoin(jobs, jobs.c.customer_id == models.Customer.id)
+        .outerjoin(invoices, invoices.c.customer_id == models.Customer.id)
+        .where(customer_filter)
+    )
+
+
+def refresh(db: Session, customer_ids=None) -> int:
+    """Recompute the given customers' summaries, or every customer's; the caller commits."""
+    now = datetime.utcnow()
+    table = models.CustomerSummary
+    if customer_ids is None:
+        db.execute(delete(table), execution_options={"synchronize_session": False})
+        result = db.execute(insert(table).from_select(COLUMNS, _summary_rows(true(), true(), true(), now)))
+        _expire_loaded(db, None)
+        return result.rowcount
+    refreshed = 0
+    for chunk in _chunks(customer_ids):
+        db.execute(
+            delete(table).where(table.customer_id.in_(chunk)),
+            execution_options={"synchronize_session": False},
+        )
+        rows = _summary_rows(
+            models.Customer.id.in_(chunk),
+            models.Invoice.customer_id.in_(chunk),
+            models.Job.customer_id.in_(chunk),
+            now,
+        )
+        refreshed += db.execute(insert(table).from_select(COLUMNS, rows)).rowcount
+    _expire_loaded(db, set(customer_ids))
+    return refreshed
+
+
+def _expire_loaded(db: Session, customer_ids: set | None):
+    # The rows were replaced behind the ORM's back; reload any this session already
+    # holds. Both are keyed by customer id, read from the identity so nothing loads.
+    for obj in list(db.identity_map.values()):
+        if not isinstance(obj, (models.Customer, models.CustomerSummary)):
+            continue
+        if customer_ids is None or inspect(obj).identity[0] in customer_ids:
+            db.expire(obj, ["summary"] if isinstance(obj, models.Customer) else None)
+
+
+def _previous(obj, key: str) -> list:
+    return [value for value in inspect(obj).attrs[key].history.deleted if value is not None]
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_flushed(session: Session, flush_context):
+    for obj in [*session.new, *session.dirty, *session.deleted]:
+        if isinstance(obj, (models.Job, models.Invoice)):
+            mark(session, customers=[obj.customer_id, *_previous(obj, "customer_id")])
+        elif isinstance(obj, models.Payment):
+            mark(session, invoices=[obj.invoice_id, *_previous(obj, "invoice_id")])
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_statement(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update):
+        return
+    table = getattr(orm_execute_state.statement, "table", None)
+    if table is None or table.name not in TRACKED:
+        return
+    parameters = orm_execute_state.parameters or {}
+    for row in parameters if isinstance(parameters, list) else [parameters]:
+        if "customer_id" in row:
+            mark(orm_execute_state.session, customers=[row["customer_id"]])
+        elif table.name == "payments" and "invoice_id" in row:
+            mark(orm_execute_state.session, invoices=[row["invoice_id"]])
+        elif "id" in row:
+            mark(orm_execute_state.session, **{table.name: [row["id"]]})
+
+
+@event.listens_for(Session, "before_commit")
+def _refresh_marked(session: Session):
+    if session.new or session.dirty or session.deleted:
+        session.flush()
+    pending = session.info.pop("summary_pending", None)
+    if pending:
+        customers = _resolve(session, pending)
+        if customers:
+            refresh(session, customers)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session: Session):
+    session.info.pop("summary_pending", None)
+
+
+if __name__ == "__main__":
+    session = SessionLocal()
+    try:
+        print(f"Rebuilt {refresh(session)} customer summaries")
+        session.commit()
+    finally:
+        session.close()
@@ -0,0 +1,112 @@
+import base64
+import binascii
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import get_history
+
+from . import models
+
+# Entities exposed by /sync, keyed by the name used in the response payload.
+SYNC_ENTITIES = {
+    "jobs": models.Job,
+    "tasks": models.JobTask,
+    "customers": models.Customer,
+    "equipment": models.Equipment,
+    "attachments": models.Attachment,
+}
+_ENTITY_NAMES = {model: name for name, model in SYNC_ENTITIES.items()}
+# Tombstone type for a job that left a crew; crew feeds cancel it, /sync ignores it.
+REASSIGNED_JOBS = "reassigned_jobs"
+# updated_at is stamped when a write flushes, which can be a while before it
+# commits; issued tokens sit this far back so a slow transaction is not missed.
+CLOCK_SKEW = timedelta(minutes=5)
+
+
+class InvalidSyncToken(ValueError):
+    pass
+
+
+def encode_token(ts: datetime) -> str:
+    return base64.urlsafe_b64encode(f"v1:{ts.isoformat()}".encode()).decode().rstrip("=")
+
+
+def next_token() -> str:
+    """Token for the next sync, CLOCK_SKEW behind now; the overlap is re-delivered."""
+    return encode_token(datetime.utcnow() - CLOCK_SKEW)
+
+
+def decode_token(token: str) -> datetime:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        version, _, value = raw.partition(":")
+        if version != "v1":
+            raise InvalidSyncToken(token)
+        return datetime.fromisoformat(value)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as exc:
+        raise InvalidSyncToken(token) from exc
+
+
+def _record_tombstone(mapper, connection, target):
+    # Runs for explicit deletes and ORM cascades (e.g. delete-orphan tasks) alike.
+    connection.execute(
+        insert(models.Tombstone).values(
+            entity_type=_ENTITY_NAMES[mapper.class_],
+            entity_id=target.id,
+            crew_id=target.crew_id if mapper.class_ is models.Job else None,
+            deleted_at=datetime.utcnow(),
+        )
+    )
+
+
+def record_reassignments(connection, moves):
+    """Record (job id, previous crew id) pairs for jobs moved off a crew."""
+    rows = [
+        {"entity_type": REASSIGNED_JOBS, "entity_id": job_id, "crew_id": crew_id, "deleted_at": datetime.utcnow()}
+        for job_id, crew_id in moves
+        if crew_id is not None
+    ]
+    if rows:
+        connection.execute(insert(models.Tombstone), rows)
+
+
+def _record_reassignment(mapper, connection, target):
+    previous = get_history(target, "crew_id").deleted
+    if previous and previous[0] != target.crew_id:
+        record_reassignments(connection, [(target.id, previous[0])])
+
+
+for _model in SYNC_ENTITIES.values():
+    event.listen(_model, "after_delete", _record_tombstone)
+# Set-based reassignments (crud.bulk_update_jobs) call record_reassignments themselves.
+event.listen(models.Job, "after_update", _record_reassignment)
+
+
+def changes_since(db: Session, since: datetime | None = None):
+    """Return (token, changes, deleted) for rows touched at or after `since`.
+
+    The new token is taken before querying and CLOCK_SKEW behind the clock, so
+    a row stamped before the sync but committed after it is delivered again
+    next time rather than missed. Every sync therefore repeats the last few
+    minutes of changes; clients apply them as upserts and deletes keyed by id,
+    which makes the overlap harmless.
+    """
+    token = next_token()
+    changes = {}
+    for name, model in SYNC_ENTITIES.items():
+        query = db.query(model)
+        if model is models.Job:
+            query = query.options(selectinload(models.Job.tasks), selectinload(models.Job.equipment_links))
+        if since is not None:
+            query = query.filter(model.updated_at >= since)
+        changes[name] = query.order_by(model.updated_at, model.id).all()
+    deleted = []
+    if since is not None:
+        deleted = (
+            db.query(models.Tombstone)
+            .filter(models.Tombstone.deleted_at >= since, models.Tombstone.entity_type.in_(SYNC_ENTITIES))
+            .order_by(models.Tombstone.deleted_at, models.Tombstone.id)
+            .all()
+        )
+    return token, changes, deleted
@@ -0,0 +1,317 @@
+import argparse
+import logging
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+
+from . import ai, billing, events, models, recurring, rollups, schemas, snapshots, storage
+from .db import SessionLocal, after_commit, unit_of_work
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = {"high": 0, "default": 1, "low": 2}
+DEFAULT_MAX_ATTEMPTS = 3
+# A running task whose worker has not finished it by then is handed to another worker.
+VISIBILITY_TIMEOUT = timedelta(minutes=int(os.getenv("TASK_VISIBILITY_MINUTES", "10")))
+BASE_BACKOFF = timedelta(seconds=15)
+MAX_BACKOFF = timedelta(minutes=30)
+POLL_SECONDS = 2
+WORKER_THREADS = int(os.getenv("TASK_WORKER_THREADS", "2"))
+
+HANDLERS: dict[str, tuple] = {}
+
+_wake = threading.Event()
+
+
+class UnknownTask(ValueError):
+    pass
+
+
+def handler(name: str, schema: type[BaseModel] | None = None):
+    """Register `fn(db, payload)` as the task `name`; `schema` validates payloads at enqueue time."""
+
+    def register(fn):
+        HANDLERS[name] = (fn, schema)
+        return fn
+
+    return register
+
+
+def validate(name: str, payload: dict) -> dict:
+    if name not in HANDLERS:
+        raise UnknownTask(name)
+    _, schema = HANDLERS[name]
+    return jsonable_encoder(schema(**payload).model_dump() if schema else payload)
+
+
+def enqueue(
+    db: Session,
+    name: str,
+    payload: dict | None = None,
+    priority: str = "default",
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+) -> models.BackgroundTask:
+    """Queue a task inside the caller's transaction; workers see it once that commits."""
+    task = models.BackgroundTask(
+        name=name,
+        payload=validate(name, payload or {}),
+        priority=PRIORITIES[priority],
+        max_attempts=max_attempts,
+        available_at=datetime.utcnow(),
+    )
+    db.add(task)
+    db.flush()
+    after_commit(db, _wake.set)
+    return task
+
+
+def claim(db: Session, worker_id: str, limit: int, now: datetime | None = None) -> list[int]:
+    """Lease up to `limit` runnable tasks, highest priority lane first.
+
+    Queued tasks and running tasks whose visibility timeout has lapsed are
+    both runnable. The conditional UPDATE ... RETURNING makes the lease
+    atomic, so two workers never run the same attempt.
+    """
+    now = now or datetime.utcnow()
+    runnable = or_(models.BackgroundTask.status == "queued", models.BackgroundTask.status == "running")
+    candidates = [
+        task_id
+        for (task_id,) in db.query(models.BackgroundTask.id)
+        .filter(runnable, models.BackgroundTask.available_at <= now)
+        .order_by(models.BackgroundTask.priority, models.BackgroundTask.available_at, models.BackgroundTask.id)
+        .limit(limit)
+    ]
+    if not candidates:
+        return []
+    claimed = [
+        task_id
+        for (task_id,) in db.execute(
+            update(models.BackgroundTask)
+            .where(
+                models.BackgroundTask.id.in_(candidates),
+                runnable,
+                models.BackgroundTask.available_at <= now,
+            )
+            .values(
+                status="running",
+                locked_by=worker_id,
+                attempts=models.BackgroundTask.attempts + 1,
+                available_at=now + VISIBILITY_TIMEOUT,
+                started_at=now,
+            )
+            .returning(models.BackgroundTask.id)
+        )
+    ]
+    db.commit()
+    return claimed
+
+
+def _backoff(attempts: int) -> timedelta:
+    return min(BASE_BACKOFF * 2 ** (attempts - 1), MAX_BACKOFF)
+
+
+def execute(db: Session, task_id: int, worker_id: str):
+    """Run one leased task and record its result, retry or failure."""
+    task = db.get(models.BackgroundTask, task_id, populate_existing=True)
+    if task is None or task.locked_by != worker_id or task.status != "running":
+        return
+    fn, _ = HANDLERS.get(task.name, (None, None))
+    values = {"locked_by": None, "finished_at": None}
+    try:
+        if fn is None:
+            raise UnknownTask(task.name)
+        with unit_of_work(db):
+            result = fn(db, task.payload)
+        values.update(status="succeeded", result=jsonable_encoder(result), error=None, finished_at=datetime.utcnow())
+    except Exception as exc:
+        logger.exception("Task %s (%s) failed", task_id, task.name)
+        if task.attempts >= task.max_attempts or isinstance(exc, UnknownTask):
+            values.update(status="failed", error=str(exc) or type(exc).__name__, finished_at=datetime.utcnow())
+        else:
+            values.update(
+                status="queued",
+                error=str(exc) or type(exc).__name__,
+                available_at=datetime.utcnow() + _backoff(task.attempts),
+            )
+    # Only the worker holding the lease may record the outcome.
+    db.execute(
+        update(models.BackgroundTask)
+        .where(models.BackgroundTask.id == task_id, models.BackgroundTask.locked_by == worker_id)
+        .values(**values)
+    )
+    db.commit()
+    if values["status"] != "queued":
+        events.bus.publish("background_task", values["status"], task_id, name=task.name)
+
+
+def drain(db: Session, worker_id: str = "inline", limit: int = 100) -> int:
+    """Run every currently runnable task in this session, one after another."""
+    ran = 0
+    while True:
+        claimed = claim(db, worker_id, limit)
+        if not claimed:
+            return ran
+        for task_id in claimed:
+            execute(db, task_id, worker_id)
+        ran += len(claimed)
+
+
+class Worker:
+    """Polls the queue and runs up to `concurrency` tasks at a time."""
+
+    def __init__(self, concurrency: int = WORKER_THREADS, session_factory=SessionLocal):
+        self.concurrency = concurrency
+        self.session_factory = session_factory
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._slots = threading.Semaphore(concurrency)
+        self._thread: threading.Thread | None = None
+
+    def _run_one(self, task_id: int):
+        db = self.session_factory()
+        try:
+            execute(db, task_id, self.worker_id)
+        except Exception:
+            logger.exception("Task %s could not be recorded", task_id)
+        finally:
+            db.close()
+            self._slots.release()
+            _wake.set()
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="task-worker") as pool:
+            while not self._stop.is_set():
+                free = 0
+                while free < self.concurrency and self._slots.acquire(blocking=False):
+                    free += 1
+                claimed = []
+                if free:
+                    db = self.session_factory()
+                    try:
+                        claimed = claim(db, self.worker_id, free)
+                    except Exception:
+                        logger.exception("Task claim failed")
+                    finally:
+                        db.close()
+                for _ in range(free - len(claimed)):
+                    self._slots.release()
+                for task_id in claimed:
+                    pool.submit(self._run_one, task_id)
+                if len(claimed) < free or not free:
+                    _wake.wait(POLL_SECONDS)
+                    _wake.clear()
+
+    def start(self):
+        if self.concurrency <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="task-queue", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        _wake.set()
+
+
+worker = Worker()
+
+
+@handler("ai.estimate", schemas.AiEstimateRequest)
+def ai_estimate(db: Session, payload: dict):
+    hist = db.query(models.Estimate).order_by(models.Estimate.id.desc()).limit(50).all()
+    historical_jobs = [
+        {
+            "scope": e.scope,
+            "hazards": e.hazards,
+            "equipment": e.equipment,
+            "final_price": e.total,
+            "suggested_price": e.suggested_price,
+        }
+        for e in hist
+        if (e.total or 0) > 0
+    ]
+    return ai.suggest_estimate(payload, historical_jobs)
+
+
+@handler("ai.notes", schemas.AiNotesRequest)
+def ai_notes(db: Session, payload: dict):
+    return ai.structure_notes(payload["raw_notes"])
+
+
+@handler("ai.schedule", schemas.AiScheduleRequest)
+def ai_schedule(db: Session, payload: dict):
+    est = db.query(models.Estimate).filter(models.Estimate.id == payload["estimate_id"]).first()
+    if not est:
+        raise LookupError("Estimate not found")
+    estimate_dict = {
+        "id": est.id,
+        "scope": est.scope,
+        "hazards": est.hazards,
+        "equipment": est.equipment,
+        "suggested_price": est.suggested_price,
+        "final_price": est.total,
+        "status": est.status,
+    }
+    return ai.suggest_schedule(estimate_dict, payload["preferred_window"], payload["crew_options"])
+
+
+@handler("billing.run", schemas.BillingRunRequest)
+def billing_run(db: Session, payload: dict):
+    request = schemas.BillingRunRequest(**payload)
+    return billing.run(
+        db,
+        dry_run=request.dry_run,
+        completed_before=request.completed_before,
+        due_in_days=request.due_in_days,
+    )
+
+
+@handler("recurring.materialize")
+def materialize_recurring(db: Session, payload: dict):
+    return recurring.materialize(db, horizon_days=int(payload.get("horizon_days", recurring.DEFAULT_HORIZON_DAYS)))
+
+
+@handler("rollups.refresh")
+def refresh_rollups(db: Session, payload: dict):
+    return rollups.refresh(db, full=bool(payload.get("full")))
+
+
+@handler("snapshots.export", schemas.SnapshotExportRequest)
+def export_snapshot(db: Session, payload: dict):
+    return snapshots.export(db, payload.get("format"))
+
+
+@handler("attachments.previews")
+def attachment_previews(db: Session, payload: dict):
+    blob = db.query(models.Blob).filter(models.Blob.sha256 == payload["sha256"]).first()
+    if not blob:
+        raise LookupError("Blob not found")
+    try:
+        variants = storage.make_previews(blob.sha256)
+        blob.previews = "ready"
+    except Exception:
+        # Corrupt or unreadable images will not get better on retry.
+        logger.exception("Previews for blob %s failed", blob.sha256)
+        variants = []
+        blob.previews = "failed"
+    return {"sha256": blob.sha256, "previews": blob.previews, "variants": variants}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the background task worker.")
+    parser.add_argument("--concurrency", type=int, default=max(WORKER_THREADS, 1))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    standalone = Worker(concurrency=args.concurrency)
+    try:
+        standalone.run()
+    except KeyboardInterrupt:
+        standalone.stop()
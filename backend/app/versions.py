@@ -0,0 +1,72 @@
+"""Per-table data versions.
+
+Every committed transaction bumps a counter for each table it wrote, whether
+through ORM objects or set-based insert/update/delete statements. Caches key
+their entries on the versions of the tables they read, so a write makes the
+affected entries stale without anyone listing what to evict.
+
+The bump travels as a "data" event on the event bus, so with a networked
+broker every worker's counters move, not just the one that wrote.
+"""
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import events
+from .db import after_commit
+
+_versions: dict[str, int] = {}
+_lock = threading.Lock()
+
+
+def current(tables) -> tuple[int, ...]:
+    with _lock:
+        return tuple(_versions.get(table, 0) for table in tables)
+
+
+def bump(tables):
+    with _lock:
+        for table in tables:
+            _versions[table] = _versions.get(table, 0) + 1
+
+
+def _record(session: Session, tables):
+    written = session.info.get("written_tables")
+    if written is None:
+        written = session.info["written_tables"] = set()
+        after_commit(session, lambda: _publish(session))
+    written.update(tables)
+
+
+def _publish(session: Session):
+    written = session.info.pop("written_tables", None)
+    if written:
+        events.bus.publish("data", "changed", 0, tables=sorted(written))
+
+
+@event.listens_for(Session, "after_flush")
+def _record_flush(session: Session, flush_context):
+    objects = [*session.new, *session.dirty, *session.deleted]
+    _record(session, {obj.__table__.name for obj in objects if hasattr(obj, "__table__")})
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _record_statement(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if table is not None:
+            _record(orm_execute_state.session, {table.name})
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session: Session):
+    session.info.pop("written_tables", None)
+
+
+def _on_event(event: dict):
+    if event["topic"] == "data":
+        bump(event.get("tables") or [])
+
+
+events.bus.add_listener(_on_event)
@@ -0,0 +1,85 @@
+"""Time the AR aging report against 100k invoices.
+
+Builds a throwaway file-backed SQLite database with 5k customers, 100k
+invoices and 120k payments, then times a few report calls. Usage, from
+backend/:
+
+    python -m benchmarks.ar_aging
+"""
+import os
+import random
+import tempfile
+import time
+
+_tmpdir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir.name, 'bench.db')}"
+
+from datetime import datetime, timedelta  # noqa: E402
+
+from sqlalchemy import insert  # noqa: E402
+
+from app import models, reports  # noqa: E402
+from app.db import Base, SessionLocal, engine  # noqa: E402
+
+CUSTOMERS = 5_000
+INVOICES = 100_000
+PAYMENTS = 120_000
+
+
+def seed(db, now: datetime):
+    rng = random.Random(1)
+    db.execute(insert(models.Customer), [{"name": f"Customer {i}", "tags": []} for i in range(CUSTOMERS)])
+    db.execute(insert(models.Job), [{"customer_id": 1 + i % CUSTOMERS, "total": 100.0} for i in range(INVOICES)])
+    invoices = []
+    for i in range(INVOICES):
+        issued = now - timedelta(days=rng.randint(0, 200))
+        invoices.append(
+            {
+                "customer_id": 1 + i % CUSTOMERS,
+                "job_id": i + 1,
+                "subtotal": 100.0,
+                "total": 100.0,
+                "issued_at": issued,
+                "due_date": issued + timedelta(days=30),
+            }
+        )
+    db.execute(insert(models.Invoice), invoices)
+    db.execute(
+        insert(models.Payment),
+        [
+            {
+                "invoice_id": rng.randint(1, INVOICES),
+                "amount": 50.0,
+                "paid_at": now - timedelta(days=rng.randint(0, 150)),
+            }
+            for _ in range(PAYMENTS)
+        ],
+    )
+    db.commit()
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        seed(db, now)
+        cases = [
+            ("first page", {}),
+            ("last page", {"offset": CUSTOMERS - 10}),
+            ("as of 120 days ago, by issue date", {"as_of": now - timedelta(days=120), "basis": "issued"}),
+        ]
+        for label, kwargs in cases:
+            started = time.perf_counter()
+            report = reports.aging(db, **kwargs)
+            elapsed = time.perf_counter() - started
+            print(f"{label:<36} {elapsed * 1000:>7.0f} ms  {report['total_customers']} customers")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        _tmpdir.cleanup()
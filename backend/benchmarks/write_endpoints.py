@@ -0,0 +1,95 @@
+"""Count SQL statements and commits issued by the main write endpoints.
+
+Runs against a throwaway file-backed SQLite database, so every commit is a
+real fsync. Usage, from backend/:
+
+    python -m benchmarks.write_endpoints
+"""
+import os
+import tempfile
+
+_tmpdir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir.name, 'bench.db')}"
+os.environ.setdefault("DURATION_MODEL_REFRESH_SECONDS", "0")
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from app.db import Base, engine  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+class Counter:
+    def __init__(self):
+        self.statements = 0
+        self.commits = 0
+
+    def reset(self):
+        self.statements = 0
+        self.commits = 0
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    counter = Counter()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count_statement(*_args):
+        counter.statements += 1
+
+    @event.listens_for(engine, "commit")
+    def _count_commit(*_args):
+        counter.commits += 1
+
+    client = TestClient(app)
+    results = []
+
+    def measure(label, method, url, **kwargs):
+        counter.reset()
+        response = client.request(method, url, **kwargs)
+        response.raise_for_status()
+        results.append((label, counter.statements, counter.commits))
+        return response.json()
+
+    measure("PUT /settings", "PUT", "/settings", json={"default_tax_rate": 0.07})
+    customer = measure("POST /customers", "POST", "/customers", json={"name": "Bench Customer"})
+    measure("PUT /customers/{id}", "PUT", f"/customers/{customer['id']}", json={"notes": "updated"})
+    crew = measure("POST /crews", "POST", "/crews", json={"name": "Bench Crew"})
+    estimate = measure(
+        "POST /estimates",
+        "POST",
+        "/estimates",
+        json={
+            "customer_id": customer["id"],
+            "status": "approved",
+            "line_items": [{"name": "Removal", "qty": 1, "unit_price": 900}],
+        },
+    )
+    job = measure(
+        "POST /estimates/{id}/convert",
+        "POST",
+        f"/estimates/{estimate['id']}/convert",
+        json={"crew_id": crew["id"], "tasks": [{"title": "Climb"}, {"title": "Chip"}]},
+    )
+    measure("PUT /jobs/{id}", "PUT", f"/jobs/{job['id']}", json={"notes": "bring the chipper"})
+    measure("POST /jobs/{id}/tasks", "POST", f"/jobs/{job['id']}/tasks", json={"title": "Haul"})
+    invoice = measure("POST /jobs/{id}/complete", "POST", f"/jobs/{job['id']}/complete", json={})
+    measure(
+        "POST /invoices/{id}/payments",
+        "POST",
+        f"/invoices/{invoice['id']}/payments",
+        json={"invoice_id": invoice["id"], "amount": 400},
+    )
+
+    width = max(len(label) for label, _, _ in results)
+    print(f"{'endpoint'.ljust(width)}  statements  commits")
+    for label, statements, commits in results:
+        print(f"{label.ljust(width)}  {statements:>10}  {commits:>7}")
+    print(f"{'total'.ljust(width)}  {sum(r[1] for r in results):>10}  {sum(r[2] for r in results):>7}")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        _tmpdir.cleanup()
@@ -9,8 +9,14 @@ from sqlalchemy.pool import StaticPool
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.append(BASE_DIR)
-
-from app.db import Base, get_db
+os.environ.setdefault("DURATION_MODEL_REFRESH_SECONDS", "0")
+os.environ.setdefault("OUTBOX_POLL_SECONDS", "0")
+os.environ.setdefault("TASK_WORKER_THREADS", "0")
+os.environ.setdefault("PDF_WORKERS", "0")
+os.environ.setdefault("ROLLUP_REFRESH_SECONDS", "0")
+
+from app.db import Base, get_db, unit_of_work
+from app import reports
 from app.main import app
 
 TEST_DATABASE_URL = "sqlite://"
@@ -20,7 +26,7 @@ engine = create_engine(
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False)
 
 
 @pytest.fixture(scope="function")
@@ -37,12 +43,11 @@ def db_session():
 @pytest.fixture(scope="function")
 def client(db_session):
     def override_get_db():
-        try:
+        with unit_of_work(db_session):
             yield db_session
-        finally:
-            pass
 
     app.dependency_overrides[get_db] = override_get_db
     with TestClient(app) as test_client:
         yield test_client
     app.dependency_overrides.clear()
+    reports.cache.clear()
@@ -1,4 +1,7 @@
+import pytest
+
 from app import crud, models, schemas
+from app.db import after_commit, unit_of_work
 
 
 def test_estimate_total_calculation(db_session):
@@ -27,3 +30,59 @@ def test_estimate_total_calculation(db_session):
     )
     estimate = crud.create_estimate(db_session, payload, payload.line_items)
     assert estimate.total == 205.0
+
+
+def test_materialize_recurring_templates_is_idempotent(db_session):
+    from datetime import datetime
+
+    from app import recurring
+
+    customer = models.Customer(name="Contract Customer", tags=[])
+    db_session.add(customer)
+    db_session.commit()
+    template = models.RecurringJobTemplate(
+        customer_id=customer.id,
+        rrule="FREQ=MONTHLY;INTERVAL=3",
+        dtstart=datetime(2026, 1, 31, 8, 0),
+        duration_minutes=240,
+        task_titles=["Prune", "Clean up"],
+    )
+    db_session.add(template)
+    db_session.commit()
+
+    now = datetime(2026, 3, 1)
+    summary = recurring.materialize(db_session, horizon_days=365, now=now)
+    assert summary["jobs_created"] == 4
+    assert summary["tasks_created"] == 8
+    starts = [job.scheduled_start for job in db_session.query(models.Job).order_by(models.Job.scheduled_start)]
+    assert starts == [
+        datetime(2026, 4, 30, 8, 0),
+        datetime(2026, 7, 31, 8, 0),
+        datetime(2026, 10, 31, 8, 0),
+        datetime(2027, 1, 31, 8, 0),
+    ]
+
+    assert recurring.materialize(db_session, horizon_days=365, now=now)["jobs_created"] == 0
+    rolled = recurring.materialize(db_session, horizon_days=365, now=datetime(2026, 5, 1))
+    assert rolled["jobs_created"] == 1
+    assert db_session.query(models.JobTask).count() == 10
+
+
+def test_unit_of_work_commits_once_and_defers_callbacks(db_session):
+    published = []
+    with pytest.raises(RuntimeError):
+        with unit_of_work(db_session):
+            customer = crud.create_customer(db_session, name="Rolled Back", tags=[])
+            assert customer.id is not None
+            after_commit(db_session, lambda: published.append("rolled back"))
+            raise RuntimeError("boom")
+    assert db_session.query(models.Customer).count() == 0
+    assert published == []
+
+    with unit_of_work(db_session):
+        customer = crud.create_customer(db_session, name="Kept", tags=[])
+        crud.update_customer(db_session, customer, notes="same transaction")
+        after_commit(db_session, lambda: published.append(customer.id))
+        assert published == []
+    assert published == [customer.id]
+    assert db_session.query(models.Customer).one().notes == "same transaction"
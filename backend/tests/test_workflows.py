@@ -1,4 +1,11 @@
-from app import models
+from datetime import date, datetime, time, timedelta
+
+import pytest
+from fastapi import Response
+from sqlalchemy import event, func, insert, update
+
+from app import documents, models, outbox, reconcile, rollups, snapshots, storage, summaries, sync, tasks
+from app.main import app
 
 
 def test_complete_job_creates_invoice(client, db_session):
@@ -28,3 +35,1297 @@ def test_complete_job_creates_invoice(client, db_session):
     payload = response.json()
     assert payload["job_id"] == job.id
     assert payload["total"] == 220.0
+
+
+def test_sync_returns_only_changes_since_token(client, db_session):
+    customer = models.Customer(name="Sync Customer", tags=[])
+    db_session.add(customer)
+    db_session.commit()
+    job = models.Job(customer_id=customer.id, status="scheduled", total=100.0)
+    job.tasks = [models.JobTask(title="Prune"), models.JobTask(title="Haul")]
+    db_session.add(job)
+    db_session.commit()
+    # Tokens trail the clock by sync.CLOCK_SKEW, so age the rows past it.
+    aged = datetime.utcnow() - 2 * sync.CLOCK_SKEW
+    for model in (models.Customer, models.Job, models.JobTask):
+        db_session.execute(update(model).values(updated_at=aged))
+    db_session.commit()
+
+    first = client.get("/sync").json()
+    assert [c["id"] for c in first["customers"]] == [customer.id]
+    assert len(first["tasks"]) == 2
+    assert first["deleted"] == []
+
+    task_id = first["tasks"][0]["id"]
+    assert client.delete(f"/jobs/{job.id}/tasks/{task_id}").status_code == 200
+    client.put(f"/jobs/{job.id}", json={"notes": "Bring the chipper"})
+
+    second = client.get("/sync", params={"since": first["token"]}).json()
+    assert second["customers"] == [] and second["tasks"] == []
+    assert [j["id"] for j in second["jobs"]] == [job.id]
+    assert second["deleted"] == [
+        {"entity_type": "tasks", "entity_id": task_id, "deleted_at": second["deleted"][0]["deleted_at"]}
+    ]
+    # Changes inside the skew margin are delivered again; clients dedupe by id.
+    third = client.get("/sync", params={"since": second["token"]}).json()
+    assert [j["id"] for j in third["jobs"]] == [job.id]
+    assert [d["entity_id"] for d in third["deleted"]] == [task_id]
+
+    assert client.get("/sync", params={"since": "not-a-token"}).status_code == 400
+
+
+def test_event_socket_receives_job_diffs_for_subscribed_crew(client, db_session):
+    customer = models.Customer(name="Event Customer", tags=[])
+    crew = models.Crew(name="Event Crew")
+    db_session.add_all([customer, crew])
+    db_session.commit()
+    job = models.Job(customer_id=customer.id, status="scheduled", crew_id=crew.id)
+    other = models.Job(customer_id=customer.id, status="scheduled")
+    db_session.add_all([job, other])
+    db_session.commit()
+
+    with client.websocket_connect(f"/events?topics=job&crew_id={crew.id}") as ws:
+        client.put(f"/jobs/{other.id}", json={"status": "in_progress"})
+        client.put(f"/jobs/{job.id}", json={"status": "in_progress"})
+        event = ws.receive_json()
+    assert event["topic"] == "job"
+    assert event["id"] == job.id
+    assert event["changes"] == {"status": "in_progress"}
+
+
+def test_crew_calendar_feed_revalidates_and_invalidates(client, db_session):
+    customer = models.Customer(name="Calendar Customer", service_address="1 Oak St", tags=[])
+    crew = models.Crew(name="Calendar Crew")
+    db_session.add_all([customer, crew])
+    db_session.commit()
+    job = models.Job(
+        customer_id=customer.id,
+        crew_id=crew.id,
+        status="scheduled",
+        scheduled_start=datetime.combine(date.today() + timedelta(days=1), time(9, 30)),
+        service_address="1 Oak St",
+    )
+    db_session.add(job)
+    db_session.commit()
+
+    response = client.get(f"/calendar/crews/{crew.id}.ics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/calendar")
+    assert f"UID:job-{job.id}@arborsoftai" in response.text
+    # Local wall-clock times are floating (no Z), so phones show 09:30 wherever they are.
+    start = (date.today() + timedelta(days=1)).strftime("%Y%m%d")
+    assert f"\r\nDTSTART:{start}T093000\r\nDTEND:{start}T103000\r\n" in response.text
+    etag = response.headers["etag"]
+
+    assert client.get(f"/calendar/crews/{crew.id}.ics", headers={"If-None-Match": etag}).status_code == 304
+
+    client.put(f"/jobs/{job.id}", json={"status": "canceled"})
+    refreshed = client.get(f"/calendar/crews/{crew.id}.ics", headers={"If-None-Match": etag})
+    assert refreshed.status_code == 200
+    assert "STATUS:CANCELLED" in refreshed.text
+
+    # The token trails the clock by sync.CLOCK_SKEW, so the cancellation is sent once more.
+    delta = client.get(f"/calendar/crews/{crew.id}.ics", params={"since": refreshed.headers["x-sync-token"]})
+    assert delta.text.count("BEGIN:VEVENT") == 1 and "STATUS:CANCELLED" in delta.text
+
+    etag = refreshed.headers["etag"]
+    client.put(f"/customers/{customer.id}", json={"name": "Renamed Customer"})
+    renamed = client.get(f"/calendar/crews/{crew.id}.ics", headers={"If-None-Match": etag})
+    assert renamed.status_code == 200
+    assert "Renamed Customer" in renamed.text
+
+    other_crew = models.Crew(name="Other Crew")
+    db_session.add(other_crew)
+    db_session.commit()
+    since = renamed.headers["x-sync-token"]
+    client.put(f"/jobs/{job.id}", json={"crew_id": other_crew.id, "status": "scheduled"})
+    moved_away = client.get(f"/calendar/crews/{crew.id}.ics", params={"since": since}).text
+    assert f"UID:job-{job.id}@arborsoftai" in moved_away and "STATUS:CANCELLED" in moved_away
+    other_delta = client.get(f"/calendar/crews/{other_crew.id}.ics", params={"since": since}).text
+    assert "STATUS:CANCELLED" not in other_delta
+
+    db_session.delete(db_session.get(models.Job, job.id))
+    db_session.commit()
+    deleted = client.get(f"/calendar/crews/{other_crew.id}.ics", params={"since": since}).text
+    assert "STATUS:CANCELLED" in deleted
+    assert client.get(f"/calendar/crews/{crew.id}.ics", params={"since": since}).text.count("BEGIN:VEVENT") == 1
+
+
+def test_recurring_rule_change_replaces_upcoming_occurrences(client, db_session):
+    customer = models.Customer(name="Recurring Customer", tags=[])
+    db_session.add(customer)
+    db_session.commit()
+    start = datetime.combine(date.today() + timedelta(days=1), time(8))
+    template = client.post(
+        "/recurring-jobs",
+        json={"customer_id": customer.id, "rrule": "FREQ=MONTHLY", "dtstart": start.isoformat(), "total": 90},
+    ).json()
+    assert client.post("/recurring-jobs/materialize", params={"horizon_days": 90}).json()["jobs_created"] == 3
+
+    def upcoming():
+        jobs = db_session.query(models.Job).filter(models.Job.recurring_template_id == template["id"])
+        return sorted(job.scheduled_start for job in jobs.populate_existing())
+
+    client.put(f"/recurring-jobs/{template['id']}", json={"total": 95})
+    assert len(upcoming()) == 3
+    client.put(f"/recurring-jobs/{template['id']}", json={"rrule": "FREQ=WEEKLY;INTERVAL=2"})
+    assert upcoming() == []
+    created = client.post("/recurring-jobs/materialize", params={"horizon_days": 90}).json()["jobs_created"]
+    assert upcoming() == [start + timedelta(weeks=2 * n) for n in range(created)]
+    assert created == 7
+
+
+def test_convert_estimate_prefills_scheduled_end_from_duration_model(client, db_session):
+    customer = models.Customer(name="Duration Customer", tags=[])
+    crew = models.Crew(name="Duration Crew")
+    job_type = models.JobType(name="Removal")
+    db_session.add_all([customer, crew, job_type])
+    db_session.commit()
+    start = datetime(2026, 3, 2, 8, 0)
+    for hours in [4, 5, 6, 7]:
+        db_session.add(
+            models.Job(
+                customer_id=customer.id,
+                crew_id=crew.id,
+                job_type_id=job_type.id,
+                status="completed",
+                scheduled_start=start,
+                completed_at=start + timedelta(hours=hours),
+            )
+        )
+    estimate = models.Estimate(customer_id=customer.id, status="approved", total=900.0)
+    db_session.add(estimate)
+    db_session.commit()
+
+    assert client.post("/durations/retrain").status_code == 200
+    duration = client.get("/durations/estimate", params={"job_type_id": job_type.id, "crew_id": crew.id}).json()
+    assert duration["basis"] == "job_type_crew"
+    assert duration["samples"] == 4
+    assert duration["p50_hours"] == 5.5
+
+    response = client.post(
+        f"/estimates/{estimate.id}/convert",
+        json={"scheduled_start": "2026-04-01T08:00:00", "crew_id": crew.id, "job_type_id": job_type.id},
+    )
+    assert response.status_code == 200
+    assert response.json()["scheduled_end"] == "2026-04-01T13:30:00"
+
+
+def test_import_customers_reports_duplicates_and_invalid_rows(client, db_session):
+    db_session.add(models.Customer(name="Existing", email="Taken@Example.com", tags=[]))
+    db_session.commit()
+    csv_body = (
+        "Name,Email,Phone,Tags\n"
+        "Ada,ada@example.com,555-1000,priority;hoa\n"
+        "Dup,TAKEN@example.com,555-1001,\n"
+        ",noname@example.com,555-1002,\n"
+        "Ada Again,other@example.com,555-1000,\n"
+    )
+    response = client.post("/import/customers", files={"file": ("customers.csv", csv_body, "text/csv")})
+    assert response.status_code == 200
+    report = response.json()
+    assert (report["processed"], report["inserted"], report["duplicates"], report["failed"]) == (4, 1, 2, 1)
+    assert [error["row"] for error in report["errors"]] == [3, 4, 5]
+    ada = db_session.query(models.Customer).filter(models.Customer.email == "ada@example.com").one()
+    assert ada.tags == ["priority", "hoa"]
+
+    leads = "customer_email,source,status\nada@example.com,web,new\nnobody@example.com,web,new\n"
+    response = client.post("/import/leads", files={"file": ("leads.csv", leads, "text/csv")})
+    assert response.json()["inserted"] == 1
+    assert response.json()["errors"] == [{"row": 3, "message": "Customer not found"}]
+
+
+def test_bulk_update_jobs_shifts_and_checks_conflicts(client, db_session):
+    customer = models.Customer(name="Bulk Customer", tags=[])
+    crew_a = models.Crew(name="Crew A")
+    crew_b = models.Crew(name="Crew B")
+    db_session.add_all([customer, crew_a, crew_b])
+    db_session.commit()
+    day = datetime(2026, 5, 4, 8, 0)
+    rained_out = [
+        models.Job(customer_id=customer.id, crew_id=crew_a.id, scheduled_start=day, scheduled_end=day + timedelta(hours=3)),
+        models.Job(
+            customer_id=customer.id,
+            crew_id=crew_a.id,
+            scheduled_start=day + timedelta(hours=4),
+            scheduled_end=day + timedelta(hours=6),
+        ),
+    ]
+    busy = models.Job(
+        customer_id=customer.id,
+        crew_id=crew_b.id,
+        scheduled_start=day + timedelta(days=1, hours=1),
+        scheduled_end=day + timedelta(days=1, hours=2),
+    )
+    db_session.add_all(rained_out + [busy])
+    db_session.commit()
+    ids = [job.id for job in rained_out]
+
+    conflict = client.post("/jobs/bulk", json={"job_ids": ids, "shift_days": 1, "crew_id": crew_b.id})
+    assert conflict.status_code == 409
+    assert conflict.json()["detail"]["conflicts"] == [
+        {"crew_id": crew_b.id, "job_id": ids[0], "conflicting_job_id": busy.id}
+    ]
+
+    response = client.post("/jobs/bulk", json={"job_ids": ids, "shift_days": 1})
+    assert response.status_code == 200
+    jobs = response.json()["jobs"]
+    assert [job["scheduled_start"] for job in jobs] == ["2026-05-05T08:00:00", "2026-05-05T12:00:00"]
+    assert all(job["crew_id"] == crew_a.id for job in jobs)
+
+    multi_day = models.Job(
+        customer_id=customer.id,
+        crew_id=crew_a.id,
+        status="in_progress",
+        scheduled_start=day - timedelta(days=1),
+        scheduled_end=day + timedelta(days=1, hours=1),
+    )
+    canceled = models.Job(
+        customer_id=customer.id,
+        crew_id=crew_a.id,
+        status="canceled",
+        scheduled_start=day + timedelta(days=1, hours=4),
+    )
+    db_session.add_all([multi_day, canceled])
+    db_session.commit()
+    started_earlier = client.post("/jobs/bulk", json={"job_ids": [ids[0]], "crew_id": crew_a.id})
+    assert started_earlier.status_code == 409
+    assert started_earlier.json()["detail"]["conflicts"][0]["job_id"] == multi_day.id
+    reactivated = client.post("/jobs/bulk", json={"job_ids": [canceled.id], "status": "scheduled"})
+    assert reactivated.status_code == 409
+    found = reactivated.json()["detail"]["conflicts"][0]
+    assert {found["job_id"], found["conflicting_job_id"]} == {ids[1], canceled.id}
+
+
+def test_payment_batch_posts_valid_lines_and_updates_statuses(client, db_session):
+    customer = models.Customer(name="Lockbox Customer", tags=[])
+    db_session.add(customer)
+    db_session.commit()
+    job = models.Job(customer_id=customer.id, status="completed", total=100.0)
+    db_session.add(job)
+    db_session.commit()
+    first = models.Invoice(customer_id=customer.id, job_id=job.id, total=100.0)
+    second = models.Invoice(customer_id=customer.id, job_id=job.id, total=300.0)
+    db_session.add_all([first, second])
+    db_session.commit()
+
+    csv_body = (
+        "invoice_id,amount,method\n"
+        f"{first.id},60,check\n"
+        f"{first.id},40,check\n"
+        f"{second.id},100,check\n"
+        "9999,10,check\n"
+        f"{second.id},abc,check\n"
+    )
+    response = client.post("/payments/batch/upload", files={"file": ("deposit.csv", csv_body, "text/csv")})
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["posted"], result["rejected"]) == (3, 2)
+    assert [line["status"] for line in result["results"]] == ["posted", "posted", "posted", "rejected", "rejected"]
+    assert {(i["invoice_id"], i["status"], i["balance"]) for i in result["invoices"]} == {
+        (first.id, "paid", 0.0),
+        (second.id, "partial", 200.0),
+    }
+    assert db_session.query(models.Payment).count() == 3
+
+
+def test_billing_run_invoices_completed_jobs_once(client, db_session):
+    db_session.add(models.Settings(default_tax_rate=0.1))
+    customer = models.Customer(name="Billing Customer", tags=[])
+    db_session.add(customer)
+    db_session.commit()
+    done = models.Job(customer_id=customer.id, status="completed", total=200.0, completed_at=datetime(2026, 10, 16))
+    open_job = models.Job(customer_id=customer.id, status="scheduled", total=50.0)
+    invoiced = models.Job(customer_id=customer.id, status="completed", total=80.0, completed_at=datetime(2026, 10, 15))
+    db_session.add_all([done, open_job, invoiced])
+    db_session.commit()
+    db_session.add(models.Invoice(customer_id=customer.id, job_id=invoiced.id, total=80.0))
+    db_session.commit()
+
+    preview = client.post("/billing/run", json={"dry_run": True}).json()
+    assert (preview["jobs"], preview["invoices_created"], preview["total"]) == (1, 0, 220.0)
+    assert preview["invoices"][0]["invoice_id"] is None
+    assert db_session.query(models.Invoice).count() == 1
+
+    result = client.post("/billing/run", json={"due_in_days": 30}).json()
+    assert (result["invoices_created"], result["tax"]) == (1, 20.0)
+    invoice = client.get(f"/invoices/{result['invoices'][0]['invoice_id']}").json()
+    assert (invoice["job_id"], invoice["total"]) == (done.id, 220.0)
+
+    assert client.post("/billing/run", json={}).json()["jobs"] == 0
+
+
+def test_idempotency_key_replays_payment_without_double_posting(client, db_session):
+    customer = models.Customer(name="Retry Customer", tags=[])
+    db_session.add(customer)
+    db_session.commit()
+    job = models.Job(customer_id=customer.id, status="completed", total=100.0)
+    db_session.add(job)
+    db_session.commit()
+    invoice = models.Invoice(customer_id=customer.id, job_id=job.id, total=100.0)
+    db_session.add(invoice)
+    db_session.commit()
+
+    url = f"/invoices/{invoice.id}/payments"
+    body = {"invoice_id": invoice.id, "amount": 40}
+    headers = {"Idempotency-Key": "tablet-7-payment-1"}
+    first = client.post(url, json=body, headers=headers)
+    retry = client.post(url, json=body, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert db_session.query(models.Payment).count() == 1
+
+    reused = client.post(url, json={**body, "amount": 60}, headers=headers)
+    assert reused.status_code == 422
+    assert client.post(url, json=body).status_code == 200
+    assert db_session.query(models.Payment).count() == 2
+
+    # The claim was marked applied with the payment; losing the stored response
+    # must not let an old claim expire into a second posting.
+    record = db_session.query(models.IdempotencyKey).one()
+    assert record.applied_at is not None
+    record.status_code, record.created_at = None, datetime.utcnow() - timedelta(hours=1)
+    db_session.commit()
+    assert client.post(url, json=body, headers=headers).status_code == 409
+    assert db_session.query(models.Payment).count() == 2
+
+    upload = {"file": ("deposit.csv", f"invoice_id,amount\n{invoice.id},10\n", "text/csv")}
+    batch_headers = {"Idempotency-Key": "lockbox-1"}
+    posted = client.post("/payments/batch/upload", files=upload, headers=batch_headers)
+    replayed = client.post("/payments/batch/upload", files=upload, headers=batch_headers)
+    assert posted.status_code == replayed.status_code == 200
+    assert replayed.headers["Idempotent-Replayed"] == "true"
+    assert db_session.query(models.Payment).count() == 3
+
+    # Repeated headers pass through and replay as separate lines.
+    def set_cookies():
+        response = Response(status_code=201)
+        response.set_cookie("session", "abc")
+        response.set_cookie("theme", "dark")
+        return response
+
+    app.add_api_route("/test/cookies", set_cookies, methods=["POST"])
+    try:
+        responses = [client.post("/test/cookies", headers={"Idempotency-Key": "cookies-1"}) for _ in range(2)]
+    finally:
+        app.router.routes.pop()
+    for response in responses:
+        assert response.status_code == 201
+        cookies = [value.split(";")[0] for name, value in response.headers.multi_items() if name == "set-cookie"]
+        assert cookies == ["session=abc", "theme=dark"]
+    assert responses[1].headers["Idempotent-Replayed"] == "true"
+
+
+def test_outbox_records_side_effects_and_retries_failed_deliveries(client, db_session, monkeypatch):
+    customer = models.Customer(name="Outbox Customer", email="owner@example.com", phone="555-0142", tags=[])
+    db_session.add(customer)
+    db_session.commit()
+    job = client.post(
+        "/jobs",
+        json={"customer_id": customer.id, "scheduled_start": "2026-11-02T08:00:00", "total": 500},
+    ).json()
+    invoice = client.post(f"/jobs/{job['id']}/complete", json={}).json()
+    client.post(f"/invoices/{invoice['id']}/payments", json={"invoice_id": invoice["id"], "amount": 100})
+
+    pending = client.get("/outbox", params={"status": "pending"}).json()
+    assert sorted(message["topic"] for message in pending) == ["invoice.issued", "job.scheduled", "payment.recorded"]
+
+    class FlakySink:
+        def send(self, messages):
+            return {message["id"]: "gateway timeout" for message in messages}
+
+    monkeypatch.setitem(outbox.sinks, "sms", FlakySink())
+    email_sink = outbox.sinks["email"]
+    email_sink.delivered.clear()
+    assert client.post("/outbox/dispatch").json() == {
+        "claimed": 3,
+        "sent": 2,
+        "retried": 1,
+        "failed": 0,
+        "skipped": 0,
+    }
+    assert [message["to"] for message in email_sink.delivered] == ["owner@example.com"]
+    sms = client.get("/outbox", params={"status": "pending"}).json()
+    assert [(message["topic"], message["attempts"], message["last_error"]) for message in sms] == [
+        ("job.scheduled", 1, "gateway timeout")
+    ]
+    assert client.post("/outbox/dispatch").json()["claimed"] == 0
+
+    # A dispatcher that dies mid-delivery has still used up the attempt.
+    class Crash(BaseException):
+        pass
+
+    class CrashingSink:
+        def send(self, messages):
+            raise Crash()
+
+    monkeypatch.setitem(outbox.sinks, "sms", CrashingSink())
+    message = db_session.query(models.OutboxMessage).filter(models.OutboxMessage.kind == "sms").one()
+    message.attempts, message.next_attempt_at = outbox.MAX_ATTEMPTS - 1, datetime.utcnow()
+    db_session.commit()
+    with pytest.raises(Crash):
+        outbox.dispatch_once(db_session)
+    db_session.rollback()
+    db_session.refresh(message)
+    assert message.attempts == outbox.MAX_ATTEMPTS
+    message.next_attempt_at = datetime.utcnow()  # the lease has run out
+    db_session.commit()
+    assert outbox.dispatch_once(db_session)["failed"] == 1
+    db_session.refresh(message)
+    assert (message.status, message.attempts) == ("failed", outbox.MAX_ATTEMPTS)
+    monkeypatch.setitem(outbox.sinks, "sms", FlakySink())
+
+    # Only a new start, or a move into "scheduled", texts the customer again.
+    def scheduled_texts():
+        return db_session.query(models.OutboxMessage).filter(models.OutboxMessage.topic == "job.scheduled").count()
+
+    start = {"scheduled_start": "2026-11-09T08:00:00"}
+    held = client.post("/jobs", json={"customer_id": customer.id, "status": "canceled", "total": 50, **start}).json()
+    assert scheduled_texts() == 1
+    client.put(f"/jobs/{held['id']}", json={"status": "scheduled"})
+    assert scheduled_texts() == 2
+    client.put(f"/jobs/{held['id']}", json={**start, "notes": "Gate code 4412"})
+    assert scheduled_texts() == 2
+    client.put(f"/jobs/{held['id']}", json={"scheduled_start": "2026-11-10T08:00:00"})
+    assert scheduled_texts() == 3
+
+
+def test_task_queue_runs_by_priority_and_retries_with_backoff(client, db_session, monkeypatch):
+    calls = []
+
+    def flaky(db, payload):
+        calls.append(payload["n"])
+        raise RuntimeError("upstream unavailable")
+
+    monkeypatch.setitem(tasks.HANDLERS, "test.flaky", (flaky, None))
+    queued = client.post("/billing/run", params={"background": True}, json={"dry_run": True})
+    assert queued.status_code == 202
+    billing_task = queued.json()
+    flaky_task = client.post(
+        "/tasks", json={"name": "test.flaky", "payload": {"n": 1}, "priority": "high", "max_attempts": 2}
+    ).json()
+    assert client.post("/tasks", json={"name": "no.such.task"}).status_code == 400
+    assert client.get(f"/tasks/{billing_task['id']}/result").status_code == 409
+
+    assert tasks.claim(db_session, "worker-a", 1) == [flaky_task["id"]]
+    assert tasks.claim(db_session, "worker-b", 1) == [billing_task["id"]]
+    tasks.execute(db_session, flaky_task["id"], "worker-a")
+    tasks.execute(db_session, billing_task["id"], "worker-b")
+
+    assert client.get(f"/tasks/{billing_task['id']}/result").json()["dry_run"] is True
+    retried = client.get(f"/tasks/{flaky_task['id']}").json()
+    assert (retried["status"], retried["attempts"], retried["error"]) == ("queued", 1, "upstream unavailable")
+    assert tasks.drain(db_session) == 0
+
+    db_session.query(models.BackgroundTask).filter_by(id=flaky_task["id"]).update(
+        {"available_at": datetime.utcnow() - timedelta(seconds=1)}
+    )
+    db_session.commit()
+    assert tasks.drain(db_session) == 1
+    assert client.get(f"/tasks/{flaky_task['id']}").json()["status"] == "failed"
+    assert calls == [1, 1]
+
+
+def test_invoice_pdf_is_cached_by_content_and_zipped_by_month(client, db_session):
+    import io
+    import zipfile
+
+    customer = models.Customer(name="Pdf Customer", billing_address="1 Oak St\nSpringfield", tags=[])
+    db_session.add(customer)
+    db_session.commit()
+    job = models.Job(customer_id=customer.id, status="completed", total=250.0)
+    db_session.add(job)
+    db_session.commit()
+    october = models.Invoice(
+        customer_id=customer.id, job_id=job.id, subtotal=250.0, total=250.0, issued_at=datetime(2026, 10, 3)
+    )
+    november = models.Invoice(
+        customer_id=customer.id, job_id=job.id, subtotal=90.0, total=90.0, issued_at=datetime(2026, 11, 1)
+    )
+    db_session.add_all([october, november])
+    db_session.commit()
+
+    first = client.get(f"/invoices/{october.id}/pdf")
+    assert first.status_code == 200
+    assert first.headers["content-type"] == "application/pdf"
+    assert first.content.startswith(b"%PDF-1.4") and first.content.rstrip().endswith(b"%%EOF")
+    etag = first.headers["etag"]
+    documents.cache.clear()
+    assert client.get(f"/invoices/{october.id}/pdf", headers={"If-None-Match": etag}).status_code == 304
+    assert documents.cache.get(etag.strip('"')) is None  # revalidated without rendering
+
+    client.post(f"/invoices/{october.id}/payments", json={"invoice_id": october.id, "amount": 50})
+    assert client.get(f"/invoices/{october.id}/pdf").headers["etag"] != etag
+
+    archive = client.get("/invoices/pdf", params={"month": "2026-10"})
+    assert archive.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(archive.content)) as bundle:
+        assert bundle.namelist() == [f"invoice-{october.id}.pdf"]
+        assert bundle.read(f"invoice-{october.id}.pdf").startswith(b"%PDF")
+
+
+def test_uploads_are_content_addressed_and_served_with_ranges(client, db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "ROOT", tmp_path)
+    photo = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 64
+
+    def upload(entity_type, entity_id):
+        return client.post(
+            "/attachments/upload",
+            data={"entity_type": entity_type, "entity_id": str(entity_id), "caption": "Oak"},
+            files={"file": ("oak.png", photo, "application/octet-stream")},
+        )
+
+    first = upload("estimate", 1)
+    second = upload("job", 7)
+    assert first.status_code == 200 and second.status_code == 200
+    sha256 = first.json()["sha256"]
+    assert second.json()["sha256"] == sha256
+    assert first.json()["filename"] == "oak.png"
+    assert db_session.query(models.Blob).count() == 1
+    assert [path.name for path in (tmp_path / "blobs").rglob("*") if path.is_file()] == [sha256]
+    assert list((tmp_path / "tmp").iterdir()) == []
+
+    url = first.json()["url"]
+    full = client.get(url)
+    assert full.content == photo
+    assert full.headers["content-type"] == "image/png"
+    assert full.headers["accept-ranges"] == "bytes"
+    partial = client.get(url, headers={"Range": "bytes=8-15"})
+    assert partial.status_code == 206
+    assert partial.content == photo[8:16]
+    assert partial.headers["content-range"] == f"bytes 8-15/{len(photo)}"
+    assert client.get(url, headers={"Range": "bytes=-4"}).content == photo[-4:]
+    assert client.get(url, headers={"Range": f"bytes={len(photo)}-"}).status_code == 416
+    assert client.get(url, headers={"If-None-Match": full.headers["etag"]}).status_code == 304
+    assert full.headers["x-content-type-options"] == "nosniff"
+    assert "content-disposition" not in full.headers
+
+    # A type guessed from the filename alone (here HTML) is only ever a download.
+    page = client.post(
+        "/attachments/upload",
+        data={"entity_type": "job", "entity_id": "7"},
+        files={"file": ("notes.html", b"<script>alert(1)</script>", "text/html")},
+    ).json()
+    served = client.get(page["url"])
+    assert served.headers["content-disposition"] == "attachment"
+    assert served.headers["x-content-type-options"] == "nosniff"
+
+    assert client.post("/attachments/upload", data={"entity_type": "job", "entity_id": "1"}).status_code == 400
+    rejected = client.post(
+        "/attachments/upload",
+        data={"entity_type": "job", "entity_id": "not-a-number"},
+        files={"file": ("other.png", photo + b"x", "application/octet-stream")},
+    )
+    assert rejected.status_code == 422
+    assert sha256 in [path.name for path in (tmp_path / "blobs").rglob("*") if path.is_file()]
+    assert len([path for path in (tmp_path / "blobs").rglob("*") if path.is_file()]) == 2
+    assert list((tmp_path / "tmp").iterdir()) == []
+
+
+def test_attachment_previews_task_writes_variants(client, db_session, tmp_path, monkeypatch):
+    import io
+
+    from PIL import Image
+
+    monkeypatch.setattr(storage, "ROOT", tmp_path)
+    buffer = io.BytesIO()
+    Image.new("RGB", (2000, 1000), (30, 120, 60)).save(buffer, "PNG")
+    uploaded = client.post(
+        "/attachments/upload",
+        data={"entity_type": "job", "entity_id": "3"},
+        files={"file": ("canopy.png", buffer.getvalue(), "image/png")},
+    ).json()
+    sha256 = uploaded["sha256"]
+    blob = db_session.query(models.Blob).filter(models.Blob.sha256 == sha256).one()
+    assert blob.previews == "pending"
+    assert client.get(uploaded["url"], params={"variant": "thumbnail"}).status_code == 404
+
+    assert tasks.drain(db_session) == 1
+    db_session.refresh(blob)
+    assert blob.previews == "ready"
+    thumbnail = client.get(uploaded["url"], params={"variant": "thumbnail"})
+    assert thumbnail.headers["content-type"] == "image/jpeg"
+    with Image.open(io.BytesIO(thumbnail.content)) as image:
+        assert image.size == (256, 128)
+    with Image.open(storage.variant_path(sha256, "preview")) as image:
+        assert image.size == (1600, 800)
+
+
+def test_revenue_report_buckets_and_breakdowns(client, db_session):
+    customer = models.Customer(name="Revenue Customer", tags=[])
+    crew = models.Crew(name="Climbers")
+    db_session.add_all([customer, crew])
+    db_session.commit()
+    job = models.Job(customer_id=customer.id, crew_id=crew.id, total=500.0)
+    unassigned = models.Job(customer_id=customer.id, total=100.0)
+    db_session.add_all([job, unassigned])
+    db_session.commit()
+    invoice = models.Invoice(customer_id=customer.id, job_id=job.id, total=500.0)
+    loose = models.Invoice(customer_id=customer.id, job_id=unassigned.id, total=100.0)
+    db_session.add_all([invoice, loose])
+    db_session.commit()
+    db_session.add_all(
+        [
+            models.Payment(invoice_id=invoice.id, amount=100.0, method="card", paid_at=datetime(2026, 8, 3, 9)),
+            models.Payment(invoice_id=invoice.id, amount=50.0, method="check", paid_at=datetime(2026, 8, 9, 17)),
+            models.Payment(invoice_id=loose.id, amount=25.0, method="card", paid_at=datetime(2026, 10, 1, 8)),
+        ]
+    )
+    db_session.commit()
+    params = {"start": "2026-08-01T00:00:00", "end": "2026-10-31T23:59:59"}
+
+    assert client.get("/reports/revenue", params=params).json()["total_revenue"] == 175.0
+
+    monthly = client.get("/reports/revenue", params={**params, "granularity": "month"}).json()
+    assert [(b["start"], b["total"]) for b in monthly["buckets"]] == [
+        ("2026-08-01", 150.0),
+        ("2026-09-01", 0.0),
+        ("2026-10-01", 25.0),
+    ]
+
+    weekly = client.get("/reports/revenue", params={**params, "granularity": "week", "breakdown": "method"}).json()
+    assert [b["start"] for b in weekly["buckets"][:3]] == ["2026-07-27", "2026-08-03", "2026-08-10"]
+    assert weekly["buckets"][1]["groups"] == [
+        {"key": "card", "label": "card", "total": 100.0},
+        {"key": "check", "label": "check", "total": 50.0},
+    ]
+
+    by_crew = client.get("/reports/revenue", params={**params, "breakdown": "crew"}).json()
+    assert by_crew["groups"] == [
+        {"key": crew.id, "label": "Climbers", "total": 150.0},
+        {"key": None, "label": "Unassigned", "total": 25.0},
+    ]
+    assert client.get("/reports/revenue", params={**params, "granularity": "year"}).status_code == 400
+
+
+def test_ar_aging_buckets_balances_per_customer(client, db_session):
+    acme = models.Customer(name="Acme", tags=[])
+    birch = models.Customer(name="Birch", tags=[])
+    db_session.add_all([acme, birch])
+    db_session.commit()
+    job = models.Job(customer_id=acme.id, total=0.0)
+    db_session.add(job)
+    db_session.commit()
+    as_of = datetime(2026, 10, 19, 12)
+
+    def invoice(customer, total, due_days_ago, issued_days_ago=None):
+        issued_days_ago = due_days_ago + 30 if issued_days_ago is None else issued_days_ago
+        return models.Invoice(
+            customer_id=customer.id,
+            job_id=job.id,
+            total=total,
+            issued_at=as_of - timedelta(days=issued_days_ago),
+            due_date=as_of - timedelta(days=due_days_ago),
+        )
+
+    partly_paid = invoice(acme, 300.0, 45)
+    invoices = [
+        invoice(acme, 100.0, -5),
+        partly_paid,
+        invoice(acme, 80.0, 75),
+        invoice(birch, 500.0, 120),
+        invoice(birch, 60.0, 10, issued_days_ago=-1),
+    ]
+    db_session.add_all(invoices)
+    db_session.commit()
+    db_session.add_all(
+        [
+            models.Payment(invoice_id=partly_paid.id, amount=200.0, paid_at=as_of - timedelta(days=3)),
+            models.Payment(invoice_id=partly_paid.id, amount=100.0, paid_at=as_of + timedelta(days=3)),
+        ]
+    )
+    db_session.commit()
+
+    report = client.get("/reports/ar-aging", params={"as_of": as_of.isoformat()}).json()
+    assert report["total_customers"] == 2
+    assert report["totals"] == {
+        "total": 780.0,
+        "days_0_30": 100.0,
+        "days_31_60": 100.0,
+        "days_61_90": 80.0,
+        "days_90_plus": 500.0,
+    }
+    assert [(c["customer_name"], c["total"], c["invoices"]) for c in report["customers"]] == [
+        ("Birch", 500.0, 1),
+        ("Acme", 280.0, 3),
+    ]
+
+    page = client.get("/reports/ar-aging", params={"as_of": as_of.isoformat(), "limit": 1, "offset": 1}).json()
+    assert [c["customer_name"] for c in page["customers"]] == ["Acme"]
+    past_end = client.get("/reports/ar-aging", params={"as_of": as_of.isoformat(), "offset": 5}).json()
+    assert past_end["customers"] == [] and past_end["totals"]["total"] == 780.0
+
+    by_issue = client.get("/reports/ar-aging", params={"as_of": as_of.isoformat(), "basis": "issued"}).json()
+    assert by_issue["totals"]["days_0_30"] == 100.0
+    assert by_issue["totals"]["days_61_90"] == 100.0
+    assert client.get("/reports/ar-aging", params={"basis": "paid"}).status_code == 400
+
+
+def test_funnel_report_breaks_down_stages_and_caches(client, db_session):
+    customer = models.Customer(name="Funnel Customer", tags=[])
+    rep = models.SalesRep(name="Dana")
+    removal = models.JobType(name="Removal")
+    db_session.add_all([customer, rep, removal])
+    db_session.commit()
+    created = datetime(2026, 9, 1, 8)
+    web = models.Lead(customer_id=customer.id, source="web", created_at=created)
+    referral = models.Lead(customer_id=customer.id, source="referral", created_at=created)
+    cold = models.Lead(customer_id=customer.id, source="web", created_at=created)
+    db_session.add_all([web, referral, cold])
+    db_session.commit()
+    won = models.Estimate(
+        customer_id=customer.id,
+        lead_id=web.id,
+        status="approved",
+        created_at=created,
+        approved_at=created + timedelta(hours=6),
+    )
+    pending = models.Estimate(
+        customer_id=customer.id,
+        lead_id=referral.id,
+        status="approved",
+        created_at=created,
+        approved_at=created + timedelta(hours=30),
+    )
+    db_session.add_all([won, pending])
+    db_session.commit()
+    job = models.Job(customer_id=customer.id, estimate_id=won.id, sales_rep_id=rep.id, job_type_id=removal.id)
+    db_session.add(job)
+    db_session.commit()
+    db_session.add(models.Invoice(customer_id=customer.id, job_id=job.id, total=900.0, status="paid"))
+    db_session.commit()
+    params = {"start": "2026-09-01T00:00:00", "end": "2026-09-30T23:59:59"}
+
+    report = client.get("/reports/funnel", params=params).json()
+    assert report["overall"] == {
+        "leads": 3,
+        "estimates": 2,
+        "approved": 2,
+        "jobs": 1,
+        "invoiced": 1,
+        "paid": 1,
+        "median_hours_to_approve": 18.0,
+        "conversion_rate": round(1 / 3, 4),
+    }
+    by_rep = {group["label"]: (group["leads"], group["paid"]) for group in report["by_sales_rep"]}
+    assert by_rep == {"Unassigned": (2, 0), "Dana": (1, 1)}
+    assert [(g["label"], g["jobs"]) for g in report["by_job_type"]] == [("Unassigned", 0), ("Removal", 1)]
+    by_source = {group["key"]: (group["leads"], group["approved"]) for group in report["by_source"]}
+    assert by_source == {"web": (2, 1), "referral": (1, 1)}
+
+    cached = client.get("/reports/funnel", params=params)
+    assert cached.headers["X-Cache"] == "HIT"
+    assert cached.json()["generated_at"] == report["generated_at"]
+    db_session.add(models.Lead(customer_id=customer.id, source="web", created_at=created))
+    db_session.commit()
+    refreshed = client.get("/reports/funnel", params=params)
+    assert refreshed.headers["X-Cache"] == "MISS"
+    assert refreshed.json()["overall"]["leads"] == 4
+
+
+def test_report_cache_serves_repeats_without_queries_until_a_write(client, db_session):
+    customer = models.Customer(name="Cache Customer", tags=[])
+    db_session.add(customer)
+    db_session.commit()
+    job = models.Job(customer_id=customer.id, total=300.0)
+    db_session.add(job)
+    db_session.commit()
+    invoice = models.Invoice(customer_id=customer.id, job_id=job.id, total=300.0)
+    db_session.add(invoice)
+    db_session.commit()
+    db_session.add(models.Payment(invoice_id=invoice.id, amount=100.0, paid_at=datetime(2026, 9, 2, 10)))
+    db_session.commit()
+    params = {"start": "2026-09-01T00:00:00", "end": "2026-09-30T23:59:59"}
+
+    first = client.get("/reports/revenue", params=params)
+    assert first.headers["X-Cache"] == "MISS"
+    assert first.json()["total_revenue"] == 100.0
+    statements = []
+    bind = db_session.get_bind()
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(bind, "before_cursor_execute", record)
+    try:
+        # Same parameters spelled differently share the entry.
+        repeat = client.get("/reports/revenue", params={"start": "2026-09-01T00:00", "end": params["end"]})
+    finally:
+        event.remove(bind, "before_cursor_execute", record)
+    assert repeat.headers["X-Cache"] == "HIT"
+    assert repeat.content == first.content
+    assert statements == []
+    assert client.get("/reports/estimate-conversion", params=params).headers["X-Cache"] == "MISS"
+
+    db_session.execute(
+        insert(models.Payment), [{"invoice_id": invoice.id, "amount": 50.0, "paid_at": datetime(2026, 9, 3, 10)}]
+    )
+    db_session.commit()
+    updated = client.get("/reports/revenue", params=params)
+    assert updated.headers["X-Cache"] == "MISS"
+    assert updated.json()["total_revenue"] == 150.0
+    # Payments are not an input to estimate conversion, so its entry survives.
+    assert client.get("/reports/estimate-conversion", params=params).headers["X-Cache"] == "HIT"
+
+
+def test_utilization_report_clips_jobs_to_days(client, db_session):
+    customer = models.Customer(name="Utilization Customer", tags=[])
+    climbers = models.Crew(name="Climbers")
+    ground = models.Crew(name="Ground")
+    removal = models.Crew(name="Removal")
+    chipper = models.Equipment(name="Chipper")
+    bucket = models.Equipment(name="Bucket Truck")
+    db_session.add_all([customer, climbers, ground, removal, chipper, bucket])
+    db_session.commit()
+    # Monday 2026-10-05 20:00 to Tuesday 04:00 straddles midnight.
+    overnight = models.Job(
+        customer_id=customer.id,
+        crew_id=climbers.id,
+        scheduled_start=datetime(2026, 10, 5, 20),
+        scheduled_end=datetime(2026, 10, 6, 4),
+    )
+    # Starts before the window; only Monday's first six hours count.
+    early = models.Job(
+        customer_id=customer.id,
+        crew_id=climbers.id,
+        scheduled_start=datetime(2026, 10, 4, 12),
+        scheduled_end=datetime(2026, 10, 5, 6),
+    )
+    canceled = models.Job(
+        customer_id=customer.id,
+        crew_id=ground.id,
+        status="canceled",
+        scheduled_start=datetime(2026, 10, 6, 8),
+        scheduled_end=datetime(2026, 10, 6, 16),
+    )
+    # Monday midnight through Saturday noon: one working day per weekday, none on Saturday.
+    multi_day = models.Job(
+        customer_id=customer.id,
+        crew_id=removal.id,
+        scheduled_start=datetime(2026, 10, 5),
+        scheduled_end=datetime(2026, 10, 10, 12),
+    )
+    db_session.add_all([overnight, early, canceled, multi_day])
+    db_session.commit()
+    db_session.add(models.JobEquipment(job_id=overnight.id, equipment_id=chipper.id))
+    db_session.commit()
+
+    report = client.get("/reports/utilization", params={"start": "2026-10-05", "end": "2026-10-11"}).json()
+    assert report["available_hours"] == [8.0, 8.0, 8.0, 8.0, 8.0, 0.0, 0.0]
+    assert report["weeks"] == ["2026-10-05"]
+    crews = {crew["name"]: crew for crew in report["crews"]}
+    assert crews["Climbers"]["scheduled_hours"] == [10.0, 4.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    assert crews["Climbers"]["weekly_utilization"] == [0.35]
+    assert crews["Ground"]["total_scheduled_hours"] == 0.0
+    assert crews["Removal"]["scheduled_hours"] == [8.0, 8.0, 8.0, 8.0, 8.0, 0.0, 0.0]
+    assert (crews["Removal"]["weekly_utilization"], crews["Removal"]["utilization"]) == ([1.0], 1.0)
+    equipment = {item["name"]: item for item in report["equipment"]}
+    assert equipment["Chipper"]["used_hours"][:2] == [4.0, 4.0]
+    assert equipment["Chipper"]["idle_days"] == 3
+    assert equipment["Bucket Truck"]["idle_days"] == 5
+    assert client.get("/reports/utilization", params={"start": "2026-10-05", "end": "2026-10-01"}).status_code == 400
+
+
+def test_reports_combine_daily_rollups_with_raw_rows(client, db_session):
+    customer = models.Customer(name="Rollup Customer", tags=[])
+    crew = models.Crew(name="Rollers")
+    db_session.add_all([customer, crew])
+    db_session.commit()
+    job = models.Job(
+        customer_id=customer.id,
+        crew_id=crew.id,
+        status="completed",
+        total=400.0,
+        completed_at=datetime(2026, 10, 2, 15),
+    )
+    db_session.add(job)
+    db_session.commit()
+    invoice = models.Invoice(customer_id=customer.id, job_id=job.id, total=400.0)
+    db_session.add(invoice)
+    db_session.add_all(
+        [
+            models.Estimate(customer_id=customer.id, status="approved", created_at=datetime(2026, 10, 1, 9)),
+            models.Estimate(customer_id=customer.id, status="sent", created_at=datetime(2026, 10, 2, 9)),
+        ]
+    )
+    db_session.commit()
+    db_session.add_all(
+        [
+            models.Payment(invoice_id=invoice.id, amount=100.0, method="card", paid_at=datetime(2026, 10, 1, 10)),
+            models.Payment(invoice_id=invoice.id, amount=50.0, method="cash", paid_at=datetime(2026, 10, 2, 23)),
+            models.Payment(invoice_id=invoice.id, amount=25.0, method="card", paid_at=datetime(2026, 10, 5, 8)),
+        ]
+    )
+    db_session.commit()
+    params = {"start": "2026-10-01T00:00:00", "end": "2026-10-05T23:59:59", "granularity": "day", "breakdown": "crew"}
+    raw = client.get("/reports/revenue", params=params).json()
+
+    summary = rollups.refresh(db_session, now=datetime(2026, 10, 5, 12))
+    db_session.commit()
+    assert summary["full"] and summary["closed_through"] == datetime(2026, 10, 4).date()
+    assert db_session.query(models.DailyPayment).count() == 2
+    assert db_session.query(models.DailyJobCompletion).one().total == 400.0
+    # Closed days now come from rollups, the open day (Oct 5) from raw payments.
+    assert client.get("/reports/revenue", params=params).json() == raw
+    conversion = client.get(
+        "/reports/estimate-conversion", params={"start": "2026-10-01T00:00:00", "end": "2026-10-05T23:59:59"}
+    ).json()
+    assert (conversion["total_estimates"], conversion["approved_estimates"]) == (2, 1)
+
+    # A payment backdated into a closed day is picked up by the next incremental refresh.
+    db_session.add(models.Payment(invoice_id=invoice.id, amount=10.0, method="card", paid_at=datetime(2026, 10, 1, 12)))
+    job.crew_id = None
+    db_session.commit()
+    summary = rollups.refresh(db_session, now=datetime(2026, 10, 6, 1))
+    db_session.commit()
+    assert not summary["full"]
+    assert summary["days"]["payments"] == 3
+    report = client.get("/reports/revenue", params=params).json()
+    assert report["total_revenue"] == 185.0
+    assert report["groups"] == [{"key": None, "label": "Unassigned", "total": 185.0}]
+
+    # Moving a payment to another closed day leaves its old day stale: reports
+    # read it raw until the next refresh re-rolls both days.
+    moved = db_session.query(models.Payment).filter(models.Payment.amount == 100.0).one()
+    moved.paid_at = datetime(2026, 10, 3, 9)
+    db_session.commit()
+    assert db_session.query(models.RollupDirtyDay.day).scalar() == datetime(2026, 10, 1).date()
+    assert client.get("/reports/revenue", params=params).json()["total_revenue"] == 185.0
+    rollups.refresh(db_session)
+    db_session.commit()
+    assert db_session.query(models.RollupDirtyDay).count() == 0
+    assert db_session.query(func.sum(models.DailyPayment.amount)).filter(
+        models.DailyPayment.day == datetime(2026, 10, 1).date()
+    ).scalar() == 10.0
+    report = client.get("/reports/revenue", params={**params, "breakdown": "method"}).json()
+    assert report["total_revenue"] == 185.0
+
+
+def test_snapshot_export_writes_typed_files_and_manifest(client, db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots, "ROOT", tmp_path)
+    monkeypatch.setattr(snapshots, "KEEP", 2)
+    monkeypatch.setattr(snapshots, "CHUNK_ROWS", 2)
+    customer = models.Customer(name="Snapshot Customer", tags=[])
+    db_session.add(customer)
+    db_session.commit()
+    jobs = [models.Job(customer_id=customer.id, total=100.0 * n, completed_at=datetime(2026, 9, n)) for n in (1, 2, 3)]
+    db_session.add_all(jobs)
+    db_session.commit()
+
+    assert client.post("/exports/snapshots", json={"format": "xlsx"}).status_code == 400
+    queued = client.post("/exports/snapshots", json={"format": "csv"})
+    assert queued.status_code == 202
+    assert tasks.drain(db_session) == 1
+    manifest = client.get("/exports/snapshots").json()
+    (snapshot,) = manifest["snapshots"]
+    assert manifest["latest"] == snapshot["id"]
+    assert snapshot["format"] == "csv"
+    job_table = snapshot["tables"]["jobs"]
+    assert job_table["rows"] == 3
+    assert job_table["columns"]["total"] == "float64"
+    assert job_table["columns"]["completed_at"] == "timestamp[us]"
+    lines = (tmp_path / job_table["file"]).read_text().splitlines()
+    assert len(lines) == 4
+    assert lines[0].split(",")[:2] == ["id", "customer_id"]
+    assert "2026-09-03T00:00:00" in lines[3]
+    assert snapshot["tables"]["payments"]["rows"] == 0
+
+    for day in (1, 2):
+        snapshots.export(db_session, "csv", now=datetime(2026, 10, day))
+    kept = [entry["id"] for entry in snapshots.read_manifest()["snapshots"]]
+    assert len(kept) == 2
+    assert sorted(path.name for path in tmp_path.iterdir() if path.is_dir()) == sorted(kept)
+
+
+def test_snapshot_export_round_trips_parquet_and_arrow(db_session, tmp_path, monkeypatch):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    monkeypatch.setattr(snapshots, "ROOT", tmp_path)
+    monkeypatch.setattr(snapshots, "CHUNK_ROWS", 2)
+    customer = models.Customer(name="Columnar Customer", tags=[])
+    db_session.add(customer)
+    db_session.commit()
+    jobs = [models.Job(customer_id=customer.id, total=100.0 * n, completed_at=datetime(2026, 9, n)) for n in (1, 2, 3)]
+    jobs[2].completed_at = None
+    db_session.add_all(jobs)
+    db_session.commit()
+
+    readers = {
+        "parquet": pq.read_table,
+        "arrow": lambda path: pa.ipc.open_file(pa.memory_map(str(path))).read_all(),
+    }
+    for day, (fmt, read) in enumerate(readers.items(), start=1):
+        entry = snapshots.export(db_session, fmt, now=datetime(2026, 10, day))
+        assert entry["format"] == fmt
+        job_table = entry["tables"]["jobs"]
+        assert job_table["file"].endswith("." + fmt)
+        table = read(tmp_path / job_table["file"])
+        assert table.num_rows == job_table["rows"] == 3
+        assert table.schema == pa.schema(
+            [(name, pa.type_for_alias(alias)) for name, alias in job_table["columns"].items()]
+        )
+        assert table.column("total").to_pylist() == [100.0, 200.0, 300.0]
+        assert table.column("completed_at").to_pylist() == [datetime(2026, 9, 1), datetime(2026, 9, 2), None]
+        assert read(tmp_path / entry["tables"]["payments"]["file"]).num_rows == 0
+
+
+def test_customer_summaries_follow_writes_and_sort_the_list(client, db_session):
+    big = models.Customer(name="Big Spender", tags=[])
+    small = models.Customer(name="Small Spender", tags=[])
+    idle = models.Customer(name="No Jobs", tags=[])
+    db_session.add_all([big, small, idle])
+    db_session.commit()
+    jobs = [
+        models.Job(customer_id=big.id, total=500.0, status="completed", completed_at=datetime(2026, 9, 1)),
+        models.Job(customer_id=big.id, total=250.0, status="completed", completed_at=datetime(2026, 9, 20)),
+        models.Job(customer_id=small.id, total=100.0),
+    ]
+    db_session.add_all(jobs)
+    db_session.commit()
+    invoices = [models.Invoice(customer_id=job.customer_id, job_id=job.id, total=job.total) for job in jobs]
+    db_session.add_all(invoices)
+    db_session.commit()
+
+    client.post(f"/invoices/{invoices[2].id}/payments", json={"invoice_id": invoices[2].id, "amount": 100.0})
+    batch = [{"invoice_id": invoices[0].id, "amount": 500.0}, {"invoice_id": invoices[1].id, "amount": 50.0}]
+    assert client.post("/payments/batch", json={"payments": batch}).json()["posted"] == 2
+
+    listed = client.get("/customers", params={"sort": "lifetime_revenue"}).json()
+    assert [customer["name"] for customer in listed] == ["Big Spender", "Small Spender", "No Jobs"]
+    summary = listed[0]["summary"]
+    assert (summary["job_count"], summary["invoice_count"]) == (2, 2)
+    assert (summary["lifetime_revenue"], summary["open_balance"]) == (550.0, 200.0)
+    assert summary["last_job_at"] == "2026-09-20T00:00:00"
+    assert listed[2]["summary"] is None
+    assert client.get("/customers", params={"sort": "name"}).status_code == 400
+
+    # A set-based status change is picked up too.
+    client.post("/jobs/bulk", json={"job_ids": [jobs[2].id], "status": "canceled"})
+    assert client.get(f"/customers/{small.id}").json()["summary"]["job_count"] == 0
+
+    def stored():
+        rows = db_session.query(models.CustomerSummary).populate_existing()
+        return {row.customer_id: (row.lifetime_revenue, row.open_balance, row.job_count) for row in rows}
+
+    maintained = stored()
+    summaries.refresh(db_session)
+    db_session.commit()
+    assert stored() == {**maintained, idle.id: (0.0, 0.0, 0)}
+
+
+def test_bank_reconciliation_proposes_exact_split_and_reference_matches(client, db_session):
+    harper = models.Customer(name="Harper Orchards", tags=[])
+    willow = models.Customer(name="Pat Lee", company_name="Willow Creek HOA", tags=[])
+    quinn = models.Customer(name="Quinn Residence", tags=[])
+    db_session.add_all([harper, willow, quinn])
+    db_session.commit()
+    opened = [
+        (harper, 1200.0, datetime(2026, 9, 1)),
+        (harper, 300.0, datetime(2026, 9, 5)),
+        (harper, 450.0, datetime(2026, 9, 10)),
+        (willow, 875.5, datetime(2026, 9, 2)),
+        (quinn, 640.0, datetime(2026, 9, 3)),
+    ]
+    invoices = []
+    for customer, total, issued in opened:
+        job = models.Job(customer_id=customer.id, total=total)
+        db_session.add(job)
+        db_session.flush()
+        invoices.append(models.Invoice(customer_id=customer.id, job_id=job.id, total=total, issued_at=issued))
+    db_session.add_all(invoices)
+    db_session.commit()
+    statement = (
+        "Date,Amount,Description\n"
+        "2026-09-20,875.50,ACH DEPOSIT WILLOW CREEK\n"
+        "09/21/2026,750.00,HARPER ORCHARDS PAYMENT\n"
+        f"2026-09-22,\"$320.00\",CHECK 5521 QUINN RESIDENCE INV {invoices[4].id}\n"
+        "2026-09-23,-50.00,MONTHLY FEE\n"
+        "2026-09-24,abc,BROKEN\n"
+        "2026-09-25,99.99,UNKNOWN SENDER\n"
+        f"2026-09-26,120.00,MOBILE CHECK DEPOSIT #{invoices[4].id} BOB JONES\n"
+        f"2026-09-27,100.00,CHECK 7730 INV {invoices[0].id}\n"
+    )
+    upload = {"file": ("bank.csv", statement.encode(), "text/csv")}
+
+    proposal = client.post("/reconciliation/statements", files=upload).json()
+    assert (proposal["matched"], proposal["review"], proposal["unmatched"]) == (3, 1, 2)
+    assert [line["line"] for line in proposal["rejected"]] == [6]
+    lines = {line["line"]: line for line in proposal["lines"]}
+    assert lines[2]["match"]["kind"] == "exact"
+    assert [a["invoice_id"] for a in lines[2]["match"]["allocations"]] == [invoices[3].id]
+    assert lines[3]["match"]["kind"] == "split"
+    assert [a["invoice_id"] for a in lines[3]["match"]["allocations"]] == [invoices[1].id, invoices[2].id]
+    assert lines[4]["match"]["kind"] == "partial"
+    assert lines[4]["match"]["allocations"][0]["amount"] == 320.0
+    assert lines[7]["status"] == "unmatched"
+    # A bare "#<number>" is a check number, not an invoice reference.
+    assert lines[8]["status"] == "unmatched"
+    assert all(match["confidence"] < reconcile.MIN_CONFIDENCE for match in lines[8]["alternatives"])
+    # A partial payment naming an invoice but not its customer needs review.
+    assert lines[9]["status"] == "review"
+    assert lines[9]["match"]["kind"] == "partial"
+    assert lines[9]["match"]["confidence"] < reconcile.CONFIDENT
+
+    approved = [
+        {
+            "line": line["line"],
+            "posted_on": line["posted_on"],
+            "description": line["description"],
+            "allocations": line["match"]["allocations"],
+        }
+        for line in proposal["lines"]
+        if line["status"] == "matched"
+    ]
+    # An allocation above what the invoice still owes is rejected with its whole line.
+    overpaid = {
+        "line": 9,
+        "posted_on": "2026-09-27",
+        "allocations": [{"invoice_id": invoices[4].id, "amount": 1000.0}],
+    }
+    payload = {"statement": proposal["statement"], "matches": approved + [overpaid]}
+    posted = client.post("/reconciliation/approve", json=payload).json()
+    assert posted["posted"] == 4
+    assert [(r["line"], r["message"]) for r in posted["results"] if r["status"] == "rejected"] == [
+        (9, "Amount exceeds the invoice balance")
+    ]
+    statuses = {item["invoice_id"]: item["status"] for item in posted["invoices"]}
+    assert statuses == {
+        invoices[1].id: "paid",
+        invoices[2].id: "paid",
+        invoices[3].id: "paid",
+        invoices[4].id: "partial",
+    }
+    payment = db_session.query(models.Payment).filter(models.Payment.invoice_id == invoices[3].id).one()
+    assert (payment.method, payment.paid_at) == ("bank", datetime(2026, 9, 20))
+
+    # Approving the same lines again posts nothing.
+    repeat = client.post("/reconciliation/approve", json={"statement": proposal["statement"], "matches": approved})
+    assert repeat.json()["posted"] == 0
+    assert {r["message"] for r in repeat.json()["results"]} == {"Statement line already posted"}
+    assert db_session.query(models.Payment).filter(models.Payment.invoice_id == invoices[3].id).count() == 1
+
+    upload = {"file": ("bank.csv", statement.encode(), "text/csv")}
+    again = client.post("/reconciliation/statements", files=upload).json()
+    assert again["posted"] == 3
+    lines = {line["line"]: line for line in again["lines"]}
+    assert [lines[n]["status"] for n in (2, 3, 4)] == ["posted"] * 3
+    assert lines[2]["match"] is None
+    # The same deposits in another export are new lines; paid invoices have left the index.
+    upload = {"file": ("other.csv", statement.replace("Date,", "date,").encode(), "text/csv")}
+    other = {line["line"]: line for line in client.post("/reconciliation/statements", files=upload).json()["lines"]}
+    assert other[2]["status"] == "unmatched"
+
+
+def test_sales_rep_leaderboard_applies_commission_rules_and_caches_closed_months(client, db_session):
+    customer = models.Customer(name="Leaderboard Customer", tags=[])
+    flat = {"basis": "completed", "tiers": [{"threshold": 0, "rate": 0.1}]}
+    dana = models.SalesRep(name="Dana", commission_rules=flat)
+    eli = models.SalesRep(name="Eli")
+    db_session.add_all([customer, dana, eli])
+    db_session.commit()
+    client.put(
+        "/settings",
+        json={"commission_rules": {"tiers": [{"threshold": 0, "rate": 0.05}, {"threshold": 1000, "rate": 0.1}]}},
+    )
+    march = datetime(2024, 3, 1)
+    jobs = [
+        models.Job(
+            customer_id=customer.id,
+            sales_rep_id=rep.id,
+            total=total,
+            status=status,
+            created_at=march + timedelta(days=created),
+            completed_at=march + timedelta(days=completed) if completed else None,
+        )
+        for rep, total, status, created, completed in [
+            (dana, 1000.0, "completed", 1, 9),
+            (eli, 2000.0, "completed", 4, 14),
+            (eli, 500.0, "canceled", 5, None),
+        ]
+    ]
+    db_session.add_all(jobs)
+    db_session.commit()
+    invoices = [
+        models.Invoice(customer_id=customer.id, job_id=job.id, total=job.total, issued_at=job.completed_at)
+        for job in jobs[:2]
+    ]
+    db_session.add_all(invoices)
+    db_session.commit()
+    db_session.add_all(
+        [
+            models.Payment(invoice_id=invoices[0].id, amount=600.0, paid_at=march + timedelta(days=19)),
+            models.Payment(invoice_id=invoices[0].id, amount=400.0, paid_at=datetime(2024, 4, 2)),
+            models.Payment(invoice_id=invoices[1].id, amount=1500.0, paid_at=march + timedelta(days=24)),
+            models.Payment(invoice_id=invoices[1].id, amount=500.0, paid_at=march + timedelta(days=25)),
+        ]
+    )
+    db_session.commit()
+    params = {"start": "2024-03-01T00:00:00", "end": "2024-03-31T23:59:59"}
+
+    response = client.get("/reports/sales-reps", params=params)
+    report = response.json()
+    assert response.headers["X-Cache"] == "MISS"
+    assert report["closed"] is True
+    first, second = report["reps"]
+    assert (first["name"], first["rank"], first["collected"], first["booked_jobs"]) == ("Eli", 1, 2000.0, 1)
+    assert (first["commission_basis"], first["commission"]) == ("collected", 150.0)
+    assert (second["name"], second["collected"], second["invoiced"]) == ("Dana", 600.0, 1000.0)
+    assert (second["commission_basis"], second["commission"]) == ("completed", 100.0)
+    assert report["total_commission"] == 250.0
+    by_booked = client.get("/reports/sales-reps", params={**params, "rank_by": "booked"}).json()
+    assert [rep["name"] for rep in by_booked["reps"]] == ["Eli", "Dana"]
+    assert client.get("/reports/sales-reps", params={**params, "rank_by": "margin"}).status_code == 400
+
+    # A closed month is cached longer but still follows late writes and rule changes.
+    assert client.get("/reports/sales-reps", params=params).headers["X-Cache"] == "HIT"
+    db_session.add(models.Payment(invoice_id=invoices[0].id, amount=1.0, paid_at=march + timedelta(days=27)))
+    db_session.commit()
+    late = client.get("/reports/sales-reps", params=params)
+    assert late.headers["X-Cache"] == "MISS"
+    assert next(rep for rep in late.json()["reps"] if rep["name"] == "Dana")["collected"] == 601.0
+    assert client.get("/reports/sales-reps", params=params).headers["X-Cache"] == "HIT"
+    assert client.put(f"/sales-reps/{dana.id}", json={"commission_rules": {"basis": "margin"}}).status_code == 400
+    client.put(f"/sales-reps/{dana.id}", json={"commission_rules": {"basis": "collected", "tiers": [{"rate": 0.1}]}})
+    refreshed = client.get("/reports/sales-reps", params=params)
+    assert refreshed.headers["X-Cache"] == "MISS"
+    dana_row = next(rep for rep in refreshed.json()["reps"] if rep["name"] == "Dana")
+    assert (dana_row["collected"], dana_row["commission"]) == (601.0, 60.1)
+
+
+def test_sales_rep_totals_count_a_job_with_several_invoices_once(client, db_session):
+    customer = models.Customer(name="Split Billing Customer", tags=[])
+    rep = models.SalesRep(name="Fran")
+    db_session.add_all([customer, rep])
+    db_session.commit()
+    job = models.Job(
+        customer_id=customer.id,
+        sales_rep_id=rep.id,
+        total=1000.0,
+        status="completed",
+        created_at=datetime(2024, 5, 2),
+        completed_at=datetime(2024, 5, 9),
+    )
+    db_session.add(job)
+    db_session.commit()
+    invoices = [
+        models.Invoice(customer_id=customer.id, job_id=job.id, total=total, issued_at=datetime(2024, 5, day))
+        for total, day in ((300.0, 10), (700.0, 20))
+    ]
+    db_session.add_all(invoices)
+    db_session.commit()
+    db_session.add_all(
+        [
+            models.Payment(invoice_id=invoices[0].id, amount=300.0, paid_at=datetime(2024, 5, 15)),
+            models.Payment(invoice_id=invoices[1].id, amount=200.0, paid_at=datetime(2024, 5, 25)),
+            models.Payment(invoice_id=invoices[1].id, amount=500.0, paid_at=datetime(2024, 5, 26)),
+        ]
+    )
+    db_session.commit()
+
+    report = client.get("/reports/sales-reps", params={"start": "2024-05-01T00:00:00", "end": "2024-05-31T23:59:59"})
+    (row,) = report.json()["reps"]
+    totals = {metric: row[metric] for metric in ("booked_jobs", "booked", "completed_jobs", "completed")}
+    assert totals == {"booked_jobs": 1, "booked": 1000.0, "completed_jobs": 1, "completed": 1000.0}
+    assert (row["invoiced"], row["collected"]) == (1000.0, 1000.0)